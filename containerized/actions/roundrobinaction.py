@@ -3,11 +3,15 @@
 ##########################################################
 import os
 import json
+import math
 import typing
 from utils.configuration.configutil import Config
-from utils.storage.storagetable import AzureTableStoreUtil
-from utils.storage.record import Record
+from utils.storage.recordstore import RecordStore, RecordStoreFactory
 from utils.storage.share import FileShareUtil
+from utils.storage.workqueue import WorkQueue, WorkQueueFactory
+from utils.generator.partitioner import WorkloadPartitioner
+from utils.generator.manifestfile import ManifestWriter
+from utils.generator.planner import ThroughputPlanner, WorkloadPlan
 from utils.log.logutil import LogBase, Logger
 
 class RoundRobin(LogBase):
@@ -20,6 +24,17 @@ class RoundRobin(LogBase):
         Generate workload manfiests in the storage account identified by record_xxx fields
         by getting all of the unprocessed records from the storage table. 
 
+        Records are spread over the containers with the configured partition_strategy,
+        greedy and lpt balance the file bytes (plus a per record overhead) so the 
+        containers finish at about the same time.
+
+        When a work queue is configured the records are pushed to the queue as cost 
+        balanced chunks instead, and the chunk ids are returned.
+
+        With plan_deadline_hours set the container count comes from the throughput 
+        planner rather than a flat 1000 records per container, and the plan with the 
+        estimated completion time is written to the workload path as plan.json.
+
         TODO: Break this up to minimum 1000 records per workload, but for now keep it simple
         for testing until it's all working. 
         """
@@ -37,59 +52,231 @@ class RoundRobin(LogBase):
             self.configuration.record_account_share)
 
         ######################################################################
-        # Storage table to track files
-        table_util = AzureTableStoreUtil(
-            self.configuration.record_account, 
-            self.configuration.record_account_key)
+        # Record store (storage table) to track files
+        table_util:RecordStore = RecordStoreFactory.get_store(self.configuration)
 
-        records:typing.List[Record] = table_util.search_unprocessed(self.configuration.record_storage_table)
+        # Page through the unprocessed records asking only for the RowKey and size, spooling
+        # them to a local file so memory stays flat regardless of the table size.
+        spool_file = "unprocessed-{}.spool".format(self.configuration.log_identity)
+        record_count, total_bytes = self._spool_unprocessed(table_util, spool_file)
 
-        logger.info("Unprocessed Record Count: {}".format(len(records)))
+        logger.info("Unprocessed Record Count: {}".format(record_count))
+        logger.info("Unprocessed Bytes: {}".format(total_bytes))
         logger.info("Container Distribution: {}".format(self.configuration.container_count))
 
-        if len(records) == 0:
+        if record_count == 0:
+            os.remove(spool_file)
             logger.warn("There are 0 records to process")
             print("There are 0 unprocessed records in the table.")
             return return_workloads
 
-        # Create array, but we will limit the number of needed containers/workflow records
-        # to at max self.configuration.container_count, but each container should take on at 
+        plan:WorkloadPlan = None
+        if self.configuration.plan_deadline_hours > 0:
+            plan = self._plan_workloads(record_share_util, record_count, total_bytes)
+
+        work_queue:WorkQueue = WorkQueueFactory.get_queue(self.configuration)
+        if work_queue:
+            return_workloads = self._queue_workloads(work_queue, spool_file, record_count)
+            if plan:
+                plan.save(record_share_util, self.configuration.workload_path)
+            return return_workloads
+
+        # Limit the number of needed containers/workflow records to at max 
+        # self.configuration.container_count, but each container should take on at 
         # least 1000 records. 
-        workloads = []
         container_count = int(self.configuration.container_count)
-        record_count = len(records)
         containers_needed = int(record_count/1000)
 
-        if container_count > containers_needed:
+        if plan:
+            container_count = plan.container_count
+        elif container_count > containers_needed:
             container_count = containers_needed
             if container_count == 0 and record_count > 0:
                 container_count = 1
             logger.info("Container Distribution Downgraded for {} records: {}".format(record_count, container_count))
 
-        for idx in range(container_count):
-            workloads.append([])
-        
-        # Round robin to different buckets
-        count = 0
-        for record in records:
-            insert = count % container_count
-            count += 1
-            workloads[insert].append(record.RowKey)
-        
+        # Partition into buckets, each bucket is written directly to it's manifest 
+        # file. Buckets are added if partition_max_records is hit.
+        partitioner = WorkloadPartitioner(
+            self.configuration.partition_strategy,
+            container_count,
+            self.configuration.partition_request_overhead,
+            self.configuration.partition_max_records)
+
+        file_names:typing.List[str] = []
+        manifests:typing.List[ManifestWriter] = []
+
+        try:
+            with open(spool_file, "r") as spool:
+                for insert, row_key, file_size in partitioner.partition(self._read_spool(spool)):
+                    while insert >= len(manifests):
+                        file_names.append(ManifestWriter.get_file_name(
+                            "workload{}".format(len(manifests)), 
+                            self.configuration.manifest_format))
+                        manifests.append(ManifestWriter(file_names[-1], self.configuration.manifest_format))
+
+                    manifests[insert].write(row_key, file_size)
+        finally:
+            for manifest in manifests:
+                manifest.close()
+            os.remove(spool_file)
+
+        for idx in range(len(file_names)):
+            logger.info("Manifest {} : {} records, {} bytes, estimated cost {}".format(
+                file_names[idx], 
+                manifests[idx].count, 
+                manifests[idx].total_bytes,
+                partitioner.bucket_costs[idx]))
+
         # Creat directory if needed
         record_share_util.create_directory(self.configuration.workload_path)
 
-        for idx in range(len(workloads)):
-            file_name = "workload{}.json".format(idx)
+        for file_name in file_names:
             logger.info("Generating work manifest: {}".format(file_name))
             
-            with open(file_name, "w") as workload_manifest:
-                workload_manifest.writelines(json.dumps(workloads[idx], indent=4))
-            
             record_share_util.upload_file(self.configuration.workload_path, file_name)
             return_workloads.append(os.path.join(self.configuration.workload_path, file_name))
             os.remove(file_name)
 
+        if plan:
+            plan.save(record_share_util, self.configuration.workload_path)
+
         logger.info("Returning {} workloads".format(len(return_workloads)))
         
-        return return_workloads
\ No newline at end of file
+        return return_workloads
+
+    def _plan_workloads(self, record_share_util:FileShareUtil, record_count:int, total_bytes:int) -> WorkloadPlan:
+        """
+        Plan the container count for the load from the throughput of previous runs
+        (or the calibration default) and the deadline in plan_deadline_hours.
+        """
+        logger:Logger = self.get_logger()
+
+        planner = ThroughputPlanner(
+            self.configuration.container_count,
+            self.configuration.partition_request_overhead,
+            self.configuration.plan_bytes_per_second,
+            self.configuration.batch_multiplier)
+        planner.load_history(record_share_util, self.configuration.metrics_path)
+
+        plan = planner.plan(record_count, total_bytes, self.configuration.plan_deadline_hours * 3600)
+        logger.info("Plan: {} containers, batch_multiplier {}, {} records per manifest".format(
+            plan.container_count,
+            plan.batch_multiplier,
+            plan.manifest_size))
+        logger.info("Plan: {} throughput {} per second from {} runs, estimated completion {}".format(
+            plan.throughput_source,
+            int(plan.cost_per_second),
+            plan.history_runs,
+            plan.estimated_completion))
+
+        if not plan.meets_deadline:
+            logger.warn("Deadline of {} hours can not be met with {} containers".format(
+                self.configuration.plan_deadline_hours,
+                self.configuration.container_count))
+
+        return plan
+
+    def _spool_unprocessed(self, table_util:RecordStore, spool_file:str) -> typing.Tuple[int, int]:
+        """
+        Page through the unprocessed records in the storage table using a projected
+        query (RowKey and file_size), or the pending index when enabled, and write 
+        one RowKey and size per line to a local spool file.
+
+        The continuation token of every page is logged so a run over a very large
+        table can be checkpointed and inspected.
+
+        Parameters:
+
+        table_util:
+            Utility to talk with the storage table.
+        spool_file:
+            Local file to write the RowKeys into.
+
+        Returns:
+            Number of records written to the spool and their total bytes
+        """
+        logger:Logger = self.get_logger()
+
+        # Only stores that keep a pending index have one to read
+        if table_util.pending_shards:
+            # Remaining work comes from the pending index, built from a full scan once
+            # if the table pre-dates it.
+            if table_util.ensure_pending_index(
+                self.configuration.record_storage_table, 
+                self.configuration.record_storage_partition,
+                self.configuration.query_page_size):
+                logger.info("Pending index built for {}".format(self.configuration.record_storage_table))
+
+            pages = table_util.iterate_pending(
+                self.configuration.record_storage_table, 
+                self.configuration.record_storage_partition,
+                page_size=self.configuration.query_page_size)
+        else:
+            pages = table_util.iterate_unprocessed(
+                self.configuration.record_storage_table, 
+                select=["RowKey", "file_size"], 
+                page_size=self.configuration.query_page_size)
+
+        record_count = 0
+        total_bytes = 0
+        with open(spool_file, "w") as spool:
+            for page in pages:
+
+                for entity in page.entities:
+                    file_size = int(entity.get("file_size") or 0)
+                    spool.write("{}\t{}\n".format(entity["RowKey"], file_size))
+                    total_bytes += file_size
+                record_count += len(page.entities)
+
+                logger.debug("Spooled {} records, continuation : {}".format(
+                    record_count, 
+                    json.dumps(page.continuation_token)
+                ))
+
+        return record_count, total_bytes
+
+    def _read_spool(self, spool:typing.TextIO) -> typing.Generator[typing.Tuple[str, int], None, None]:
+        """Read (RowKey, file_size) back from a spool file"""
+        for line in spool:
+            row_key, file_size = line.rstrip("\n").split("\t")
+            yield row_key, int(file_size)
+
+    def _queue_workloads(self, work_queue:WorkQueue, spool_file:str, record_count:int) -> typing.List[str]:
+        """
+        Push the spooled records to the work queue in chunks of about work_queue_chunk
+        records. The chunks are built with the partitioner so with greedy or lpt each 
+        carries about the same estimated cost.
+
+        Returns:
+            Chunk ids pushed to the queue
+        """
+        logger:Logger = self.get_logger()
+
+        chunk_size = max(1, min(self.configuration.work_queue_chunk, WorkQueue.CHUNK_MAX))
+        partitioner = WorkloadPartitioner(
+            self.configuration.partition_strategy,
+            math.ceil(record_count / chunk_size),
+            self.configuration.partition_request_overhead,
+            chunk_size)
+
+        chunks:typing.List[typing.List[str]] = []
+        try:
+            with open(spool_file, "r") as spool:
+                for insert, row_key, file_size in partitioner.partition(self._read_spool(spool)):
+                    while insert >= len(chunks):
+                        chunks.append([])
+                    chunks[insert].append(row_key)
+        finally:
+            os.remove(spool_file)
+
+        # Chunks left from an earlier load would hand the same records out twice
+        work_queue.clear()
+
+        chunk_ids:typing.List[str] = []
+        for chunk in chunks:
+            if len(chunk):
+                chunk_ids.append(work_queue.push(chunk))
+
+        logger.info("Pushed {} records to the work queue in {} chunks".format(record_count, len(chunk_ids)))
+        return chunk_ids
@@ -3,26 +3,70 @@
 ##########################################################
 import os
 import json
-import math
+import queue
+import threading
+import itertools
 import multiprocessing
 import typing
-import time
 import uuid
 from utils.configuration.configutil import Config
-from utils.storage.storagetable import AzureTableStoreUtil
+from utils.storage.recordstore import RecordStore, RecordStoreFactory
 from utils.storage.record import Record
 from utils.storage.share import FileDetails, FileShareUtil
+from utils.storage.snapshot import DirectorySnapshot
+from utils.storage.workqueue import WorkQueueFactory
 from utils.generator.metadatagenerator import MetadataGenerator
+from utils.generator.manifestgenerator import ManifestGenerator
+from utils.executor.slidingwindow import SlidingWindowExecutor
 from utils.log.logutil import LogBase, Logger
-from joblib import Parallel, delayed
 
 
+class ScanResult:
+    """
+    Outcome of registering a single file found by the scan.
+    """
+    REGISTERED = "1"
+    DUPLICATE = "0"
+    CHANGED = "2"
+    FAILED = "-1"
+
+    def __init__(self, status:str, row_key:str = None, pending:bool = False, file_size:int = 0, error:str = None):
+        # One of REGISTERED, DUPLICATE, CHANGED or FAILED
+        self.status = status
+        # RowKey of the record tracking the file
+        self.row_key = row_key
+        # The record still has to be processed by a workload
+        self.pending = pending
+        # Size in bytes of the source file
+        self.file_size = file_size
+        # Why the file failed to register when FAILED
+        self.error = error
+
+class ScanPath:
+    """
+    A data_source_map path being scanned, with the files found and the tracking
+    information for it.
+    """
+    def __init__(self, path:str, files:typing.Iterable[FileDetails], snapshot:DirectorySnapshot):
+        self.path = path
+        # List or stream of files found under the path
+        self.files = files
+        # Snapshot of the previous scan, None when not incremental
+        self.snapshot = snapshot
+        # ScanResult status of every file processed
+        self.statuses:typing.List[str] = []
+        # Files skipped as unchanged since the snapshot
+        self.unchanged = 0
+
 class ScanAction(LogBase):
+    # Files buffered between the path listings and the workers
+    MERGE_BUFFER = 10000
+
     def __init__(self, configuration:Config):
         super().__init__("ScanAction", configuration.mounted_file_share_name, configuration.log_identity)
         self.configuration = configuration
 
-    def scan_customer_storage(self):
+    def scan_customer_storage(self, manifest_ready:typing.Callable[[str], None] = None) -> typing.List[str]:
         """
         Scans a storage account identified in the configuration with the data stored in the
         configuration settings (representing an Azure File Share)
@@ -34,9 +78,26 @@ class ScanAction(LogBase):
         And filters items based on 
         self.configuration.data_source_map
 
+        With self.configuration.scan_incremental only files added or changed since the
+        snapshot taken by the previous scan of a path are registered.
+
         It creates two items per file found
             - Record in an Azure Storage table tracking the file
             - Metadata record in Azure Storage File share for later use in uploading
+
+        With self.configuration.scan_manifests every record that still needs processing
+        is also written to a workload manifest as it is registered, so RoundRobin is not
+        needed to read them back from the table.
+
+        Parameters:
+
+        manifest_ready:
+            Optional callback with the share path of each manifest as it is uploaded
+            when scan_manifests is enabled
+
+        Returns:
+            Share paths of the manifests generated, or the chunk ids pushed when a work
+            queue is configured. Empty unless scan_manifests is enabled.
         """
 
         # Get our logger
@@ -64,76 +125,165 @@ class ScanAction(LogBase):
             self.configuration.record_account_share)
 
         ######################################################################
-        # Storage table to track files
-        table_util:AzureTableStoreUtil = AzureTableStoreUtil(
-            self.configuration.record_account, 
-            self.configuration.record_account_key)
+        # Record store (storage table) to track files
+        table_util:RecordStore = RecordStoreFactory.get_store(self.configuration)
 
         # Make sure output folders exist for metadata generation
         record_share_util.create_directory(self.configuration.record_metadata_path)
 
+        # Manifests written straight from the scan, if enabled
+        manifest_generator:ManifestGenerator = None
+        if self.configuration.scan_manifests:
+            manifest_generator = ManifestGenerator(
+                record_share_util,
+                self.configuration.workload_path,
+                self.configuration.container_count,
+                self.configuration.manifest_size,
+                manifest_ready,
+                WorkQueueFactory.get_queue(self.configuration),
+                self.configuration.manifest_format)
+
 
         ######################################################################
         # Filter messages from the storage based on the data_source_map
         logger.info("Source Map:")
         logger.info(self.configuration.data_source_map)
+        scan_paths:typing.Dict[str, ScanPath] = {}
         for path in self.configuration.data_source_map: 
 
-            # If the path is created, then it clearly has no files and should be skipped
-            created_directory = source_share_util.create_directory(path)
-            logger.info("Requested Path Exists ; {}: {}".format(path, not created_directory))
+            # A path ending in * is a prefix hint, i.e. datasets/well-logs/NLOG* lists only
+            # the entries of datasets/well-logs starting with NLOG
+            directory, name_prefix = self._get_prefix_hint(path)
+
+            # If the path does not exist it clearly has no files and should be skipped
+            path_exists = source_share_util.exists(directory)
+            logger.info("Requested Path Exists ; {}: {}".format(path, path_exists))
 
-            if created_directory:
+            if not path_exists:
                 print("Path does not exist in the file share, skipping")
                 continue
 
-            # Collect a list of files from the source folder
-            files = source_share_util.list_files(path)
-            files = [x for x in files if x.file_name.lower().split(".")[-1] in self.configuration.data_source_map[path]]
+            # Snapshot of the previous scan of this path, None when every file is registered
+            snapshot:DirectorySnapshot = None
+            if self.configuration.scan_incremental:
+                snapshot = DirectorySnapshot.load(record_share_util, self.configuration.snapshot_path, path)
+
+            # Collect the files from the source folder, when recursive this is a stream
+            # that is still being listed while the first files are processed.
+            extensions = self.configuration.data_source_map[path]
+            if self.configuration.scan_recursive:
+                files = source_share_util.crawl_files(
+                    directory, 
+                    extensions, 
+                    self.configuration.scan_list_workers, 
+                    self.configuration.query_page_size,
+                    name_prefix,
+                    snapshot is not None)
+            else:
+                files = source_share_util.list_files(directory, snapshot is not None)
+                files = [x for x in files if x.file_name.lower().split(".")[-1] in extensions]
+                if name_prefix:
+                    files = [x for x in files if x.file_name.startswith(name_prefix)]
+                logger.info("Files to process in path : {}: {}".format(path, len(files)))
+
+            scan_paths[path] = ScanPath(path, files, snapshot)
 
-            # Tracking information
-            current_batch = 0
-            max_batch = math.ceil(len(files)/n_jobs)
-            process_results:typing.List[str] = []
-            
-            ######################################################################
-            # For each file path (directory) process the files. 
-            logger.info("Files to process in path : {}: {}".format(path, len(files)))
-            for file_batch in self._batch(files, n_jobs):
+        ######################################################################
+        # Process the files of every path through one sliding window of workers, the
+        # paths are listed at the same time and a small path never waits on a large one.
+        # Files go to the workers scan_task_files at a time, the share and table utilities
+        # and the SAS shared by the files are then pickled once per chunk, not per file.
+        executor = SlidingWindowExecutor(n_jobs)
+        candidates = self._merge_paths(scan_paths)
+        tasks = (
+            (chunk, self._process_files, (chunk, record_share_util, table_util))
+            for chunk in iter(lambda: list(itertools.islice(candidates, self.configuration.scan_task_files)), [])
+        )
+
+        completed = 0
+        completed_chunks = 0
+        for outcome in executor.run(tasks):
+            chunk = outcome.context
+            if outcome.error:
+                logger.info("Generic Exception - {} files from {}".format(len(chunk), chunk[0][1].file_path))
+                logger.info(str(outcome.error))
+                continue
+
+            for (path, source_file, changed), result in zip(chunk, outcome.result):
+                scan_path = scan_paths[path]
+                scan_path.statuses.append(result.status)
 
-                current_batch += 1
-                batch_message = f"{path} : Processing records detected by scan - {current_batch} of {max_batch}" 
-                print(batch_message)
-                logger.info(batch_message)
+                if result.status == ScanResult.FAILED:
+                    logger.info("Generic Exception - {}/{}".format(source_file.file_path, source_file.file_name))
+                    logger.info(result.error)
+                    continue
 
-                try:
-                    process_results += Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._process_file)(path, record, record_share_util, table_util) for record in file_batch)
-                except Exception as ex:
-                    logger.info("Generic Exception")
-                    logger.info(str(ex))
+                # Only files that made it into the record store go in the snapshot
+                if scan_path.snapshot:
+                    scan_path.snapshot.record(source_file)
 
-                time.sleep(2)
+                if manifest_generator and result.pending:
+                    manifest_generator.add(result.row_key, result.file_size)
 
-            processed = process_results.count("1")
-            duplicate = process_results.count("0") 
+            completed += len(chunk)
+            completed_chunks += 1
+            if completed_chunks % (n_jobs * 10) == 0:
+                progress_message = f"Processed {completed} records detected by scan" 
+                print(progress_message)
+                logger.info(progress_message)
 
+        for scan_path in scan_paths.values():
             message = "{} : {} registered, {} duplicate".format(
-                path,
-                processed,
-                duplicate
+                scan_path.path,
+                scan_path.statuses.count(ScanResult.REGISTERED),
+                scan_path.statuses.count(ScanResult.DUPLICATE)
             )
 
+            if scan_path.snapshot:
+                scan_path.snapshot.save(record_share_util, self.configuration.snapshot_path)
+                message += ", {} changed, {} unchanged, {} of {} directories unchanged".format(
+                    scan_path.statuses.count(ScanResult.CHANGED),
+                    scan_path.unchanged,
+                    scan_path.snapshot.get_unchanged_directories(),
+                    len(scan_path.snapshot.current)
+                )
+
             logger.info(message)
             print(message)
 
+        if manifest_generator is None:
+            return []
+
+        workloads = manifest_generator.close()
+        logger.info("Scan generated {} workloads with {} records".format(len(workloads), manifest_generator.record_count))
+        return workloads
+
+    def _process_files(
+        self,
+        chunk:typing.List[typing.Tuple[str, FileDetails, bool]],
+        record_share_util:FileShareUtil,
+        table_util:RecordStore
+        ) -> typing.List[ScanResult]:
+        """
+        Process a chunk of (path, file, changed) with _process_file in a single worker 
+        task. A file that fails does not fail the rest of the chunk, it's result is FAILED.
+        """
+        return_results:typing.List[ScanResult] = []
+        for path, source_file, changed in chunk:
+            try:
+                return_results.append(self._process_file(path, source_file, record_share_util, table_util, changed))
+            except Exception as ex:
+                return_results.append(ScanResult(ScanResult.FAILED, error=str(ex)))
+        return return_results
 
     def _process_file(
         self, 
         path:str,
         source_file:FileDetails,
         record_share_util:FileShareUtil,
-        table_util:AzureTableStoreUtil 
-        ) -> str:
+        table_util:RecordStore,
+        changed:bool = False
+        ) -> ScanResult:
         """
         Batch process for each file. Checks to see if the record has already been recorded
         in the Azure Storage table. If so, it is ignored, if not:
@@ -147,22 +297,42 @@ class ScanAction(LogBase):
         path:
             The path in the external share for this file. 
         source_file:
-            Details about the source file from the external file share, including the SAS URL 
+            Details about the source file from the external file share, the SAS URL is
+            built from it when the record is written
         record_share_util:
             Azure Storage File Share to store metadata in
         table_util:
             Azure Storage Table to record the file
+        changed:
+            The file is in the snapshot of the previous scan with a different size, last
+            modified or ETag. An existing record is reset so the file is loaded again.
+
+        Returns:
+            ScanResult, REGISTERED for a new record, DUPLICATE if the file was already 
+            recorded and CHANGED if an existing record was reset for a changed file.
         """
-        return_value = "0"
 
-        file_name = "{}/{}".format(path, source_file.file_name)
+        file_name = "{}/{}".format(source_file.file_path, source_file.file_name)
         file_name_base = source_file.file_name.split(".")[0]
 
         # If the file exists in the table, then this is likely a re-run and we should skip. 
         # Customer work around is to delete the records in the storage table. 
         exists = table_util.search_table_filename(self.configuration.record_storage_table, file_name)
-        if len(exists) == 0:
-            return_value = "1"
+        if len(exists) and changed:
+            record:Record = exists[0]
+            record.file_size = source_file.file_size
+            record.source_sas = source_file.file_url
+            record.processed = False
+            record.processed_time = ""
+            record.code = ""
+            table_util.update_record(self.configuration.record_storage_table, record)
+            if table_util.pending_shards:
+                table_util.add_pending(self.configuration.record_storage_table, [record])
+            return ScanResult(ScanResult.CHANGED, record.RowKey, True, record.file_size)
+        elif len(exists):
+            # Duplicates that were never processed are still work to be done
+            return ScanResult(ScanResult.DUPLICATE, exists[0].RowKey, not exists[0].processed, exists[0].file_size)
+        else:
             # Create metadata file and upload it to the record share file share
             metadata = MetadataGenerator.generate_metadata(
                 self.configuration.acl_viewer, 
@@ -191,12 +361,54 @@ class ScanAction(LogBase):
         
             table_util.add_record(self.configuration.record_storage_table, r)        
 
-        return return_value
+            return ScanResult(ScanResult.REGISTERED, r.RowKey, True, r.file_size)
+
+    def _get_prefix_hint(self, path:str) -> typing.Tuple[str, str]:
+        """Split a data_source_map path into the directory to list and an optional
+        name prefix, the prefix is given by ending the path with *"""
+        leaf = os.path.split(path)[-1]
+        if leaf.endswith("*"):
+            return os.path.split(path)[0], leaf[:-1]
+        return path, None
+
+    def _get_candidates(self, scan_path:ScanPath) -> typing.Generator[typing.Tuple[FileDetails, bool], None, None]:
+        """Pair each file of a path with whether it changed since the snapshot. Files that 
+        have not changed go straight into the new snapshot and are counted in 
+        scan_path.unchanged instead of being processed."""
+        for source_file in scan_path.files:
+            if scan_path.snapshot is None:
+                yield source_file, False
+                continue
 
-    def _batch(self, items:typing.List[FileDetails], batch_size:int) -> typing.List[str]:
-        """Batch a list of file detailsbased on size of batch requested and returns a sub list
-        with that many items in it until it is exhausted"""
-        idx = 0
-        while idx < len(items):
-            yield items[idx: idx + batch_size]
-            idx += batch_size
+            status = scan_path.snapshot.compare(source_file)
+            if status == DirectorySnapshot.UNCHANGED:
+                scan_path.snapshot.record(source_file)
+                scan_path.unchanged += 1
+            else:
+                yield source_file, status == DirectorySnapshot.CHANGED
+
+    def _merge_paths(self, scan_paths:typing.Dict[str, ScanPath]) -> typing.Generator[typing.Tuple[str, FileDetails, bool], None, None]:
+        """Read the files of every path at the same time, each on it's own thread, into
+        a single stream of (path, file, changed)."""
+        merged = queue.Queue(maxsize=ScanAction.MERGE_BUFFER)
+
+        def read_path(scan_path:ScanPath) -> None:
+            try:
+                for source_file, changed in self._get_candidates(scan_path):
+                    merged.put((scan_path.path, source_file, changed))
+            except Exception as ex:
+                print("Listing {} failed - {}".format(scan_path.path, str(ex)))
+            finally:
+                merged.put(None)
+
+        readers = [threading.Thread(target=read_path, args=(x,), daemon=True) for x in scan_paths.values()]
+        for reader in readers:
+            reader.start()
+
+        remaining = len(readers)
+        while remaining:
+            item = merged.get()
+            if item is None:
+                remaining -= 1
+                continue
+            yield item
@@ -6,12 +6,17 @@ import json
 import typing
 import time
 import math
+import itertools
 import multiprocessing
 from datetime import datetime
 from utils.configuration.configutil import Config
-from utils.storage.storagetable import AzureTableStoreUtil
-from utils.storage.record import Record
+from utils.storage.recordstore import RecordStore, RecordStoreFactory
+from utils.storage.record import Record, RecordBatch
 from utils.storage.share import FileShareUtil
+from utils.storage.workqueue import WorkQueue, WorkQueueFactory, LeaseRenewer
+from utils.generator.manifestfile import ManifestReader
+from utils.generator.planner import RunMetrics
+from utils.executor.lanes import LaneExecutor, ExecutionLane
 from utils.requests.auth import Credential
 from utils.requests.retryrequest import RetryRequestResponse
 from utils.requests.fileservice import FileRequests, FileUploadUrlResponse, FileUploadMetadataResponse
@@ -70,6 +75,10 @@ class WorkloadAction(LogBase):
         Processes a group of records that have been fed into the process. The records come in a form
         of record id in the storage table. 
 
+        The records are either the static manifest in workflow_record or, when a work queue is
+        configured, chunks claimed from the queue until it is drained. A lease is held on each 
+        chunk while it is worked on, chunks of a container that dies go back to the queue 
+        when the lease runs out.
         """
         logger:Logger = self.get_logger()
 
@@ -85,48 +94,190 @@ class WorkloadAction(LogBase):
         logger.info(f"Batch Size: {n_jobs}")
 
         ######################################################################
-        # Storage table to collect and update records on files
-        table_util = AzureTableStoreUtil(
-            self.configuration.record_account, 
-            self.configuration.record_account_key)
+        # Record store (storage table) to collect and update records on files
+        table_util:RecordStore = RecordStoreFactory.get_store(self.configuration)
+
+        # Throughput of this run, saved for the planner in RoundRobin
+        metrics = RunMetrics()
+        metrics.container_id = self.configuration.log_identity
+        metrics.batch_multiplier = int(self.configuration.batch_multiplier)
+        metrics.cores = n_cores
+        start_time = time.time()
+
+        work_queue:WorkQueue = WorkQueueFactory.get_queue(self.configuration)
+        if work_queue is None:
+            ######################################################################
+            # Stream the record ID's in the table from the manifest. File is contained in the file 
+            # share associated with the container. This is mimicked locally by just setting
+            # file share to "./"
+            manifest = ManifestReader(self.configuration.workflow_record)
+            record_count = manifest.get_count()
+            if manifest.header:
+                logger.info("Manifest header {}".format(json.dumps(manifest.header)))
+            else:
+                # Legacy JSON list, the count is only known once it's loaded
+                workflow_items = list(manifest.read_row_keys())
+                record_count = len(workflow_items)
+
+            print("Workflow {} process {} records".format(self.configuration.workflow_record, record_count))
+            logger.info("{} processing {} records".format(self.configuration.workflow_record, record_count))
+
+            metrics.records, metrics.bytes = self._process_items(
+                manifest.read_row_keys() if manifest.header else workflow_items, 
+                table_util, 
+                n_jobs, 
+                record_count)
+            self._save_metrics(metrics, start_time)
+            return
 
         ######################################################################
-        # Load the file with the record ID's in the table.File is contained in the file 
-        # share associated with the container. This is mimicked locally by just setting
-        # file share to "./"
-        workflow_items:typing.List[str] = []
-        with open(self.configuration.workflow_record, "r") as workflow_tasks:
-            file_data = workflow_tasks.readlines()
-            file_data = "\n".join(file_data)
-            workflow_items = json.loads(file_data)
-
-        print("Workflow {} process {} records".format(self.configuration.workflow_record, len(workflow_items)))
-        logger.info("{} processing {} records".format(self.configuration.workflow_record, len(workflow_items)))
+        # Claim chunks from the work queue until there are none left
+        lease_seconds = self.configuration.work_queue_lease
+        max_attempts = max(1, self.configuration.work_queue_max_attempts)
+        chunk_count = 0
+        abandoned:typing.List[str] = []
+        while True:
+            chunk = work_queue.claim(self.configuration.log_identity, lease_seconds)
+            if chunk is None:
+                break
+
+            if chunk.attempts > max_attempts:
+                # Failed (or lost it's container) too many times, it's records stay 
+                # unprocessed in the table for the next load
+                logger.warn("Abandon chunk {} after {} attempts".format(chunk.chunk_id, chunk.attempts - 1))
+                if work_queue.complete(chunk, abandoned=True):
+                    abandoned.append(chunk.chunk_id)
+                continue
+
+            chunk_count += 1
+            print("Claimed chunk {} with {} records".format(chunk.chunk_id, len(chunk.row_keys)))
+            logger.info("Claimed chunk {} with {} records".format(chunk.chunk_id, len(chunk.row_keys)))
+
+            renewer = LeaseRenewer(work_queue, chunk, lease_seconds)
+            renewer.start()
+            try:
+                chunk_records, chunk_bytes = self._process_items(chunk.row_keys, table_util, n_jobs)
+                metrics.records += chunk_records
+                metrics.bytes += chunk_bytes
+            except Exception as ex:
+                logger.info("Generic Exception - Chunk {} attempt {}".format(chunk.chunk_id, chunk.attempts))
+                logger.info(str(ex))
+                renewer.stop()
+
+                if chunk.attempts >= max_attempts:
+                    logger.warn("Abandon chunk {} after {} attempts".format(chunk.chunk_id, chunk.attempts))
+                    if work_queue.complete(chunk, abandoned=True):
+                        abandoned.append(chunk.chunk_id)
+                    continue
+
+                # Back off before the chunk is handed out again, a failure across the
+                # board (credentials, OSDU down) is not retried in a tight loop
+                backoff = min(lease_seconds, self.configuration.work_queue_backoff * (2 ** (chunk.attempts - 1)))
+                logger.info("Release chunk {} in {} seconds".format(chunk.chunk_id, backoff))
+                time.sleep(backoff)
+                work_queue.release(chunk)
+                continue
+
+            renewer.stop()
+            # Records that failed stay unprocessed in the table for the next load. A chunk
+            # whose lease was lost belongs to someone else now and is left to them.
+            if renewer.lost or not work_queue.complete(chunk):
+                logger.warn("Lease on chunk {} was lost while processing it".format(chunk.chunk_id))
+
+        print("Work queue drained after {} chunks".format(chunk_count))
+        logger.info("Work queue drained after {} chunks".format(chunk_count))
+        if len(abandoned):
+            logger.warn("Abandoned chunks : {}".format(", ".join(abandoned)))
+        self._save_metrics(metrics, start_time)
+
+    def _save_metrics(self, metrics:RunMetrics, start_time:float) -> None:
+        """
+        Save the throughput of this run to the record share, runs that processed
+        nothing are not useful to the planner and are skipped.
+        """
+        logger:Logger = self.get_logger()
+
+        metrics.seconds = time.time() - start_time
+        metrics.finished = str(datetime.utcnow())
+        if metrics.records == 0:
+            return
+
+        logger.info("Run metrics: {} records, {} bytes in {} seconds".format(metrics.records, metrics.bytes, int(metrics.seconds)))
+        try:
+            metrics.save(
+                FileShareUtil(
+                    self.configuration.record_account,
+                    self.configuration.record_account_key,
+                    self.configuration.record_account_share),
+                self.configuration.metrics_path)
+        except Exception as ex:
+            logger.warn("Failed to save run metrics")
+            logger.warn(str(ex))
+
+    def _process_items(
+        self, 
+        workflow_items:typing.Iterable[str], 
+        table_util:RecordStore, 
+        n_jobs:int, 
+        record_count:int = None
+        ) -> typing.Tuple[int, int]:
+        """
+        Process a list of record ids (RowKey) through the three stages, find the records, 
+        upload them to OSDU and update the records with the outcome.
+
+        Parameters:
+
+        workflow_items:
+            Record ids to process, a list or a stream
+        table_util: 
+            Utility to talk with the storage table. 
+        n_jobs:
+            Batch size for the parallel stages
+        record_count:
+            Number of record ids when workflow_items is a stream, for progress messages
+
+        Returns:
+            Number of records succesfully processed and their total bytes
+        """
+        logger:Logger = self.get_logger()
 
         ######################################################################
         # FOr each id in the manifest, try and find the record in the storage table
-        record_list:typing.List[Record] = []
+        record_list:RecordBatch = RecordBatch(self.configuration.record_storage_table)
         current_batch = 0
-        max_batch = math.ceil(len(workflow_items)/n_jobs)
 
-        for record_id_batch in self._batch(workflow_items, n_jobs):
+        table_batch_size = self._get_table_batch_size(table_util, n_jobs)
+        if record_count is None:
+            record_count = len(workflow_items)
+        max_batch = math.ceil(record_count/table_batch_size)
+
+        for record_id_batch in self._batch(workflow_items, table_batch_size):
             current_batch += 1
             batch_message = f"1 of 3: Check duplicates batch - {current_batch} of {max_batch}" 
             print(batch_message)
             logger.info(batch_message)
 
             try:
-                record_list += Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._search_single_record)(record_id, table_util) for record_id in record_id_batch)
-                record_list = [x for x in record_list if x is not None]
+                if table_util.concurrent_bulk:
+                    # One bulk call, the record store keeps the lookups in flight itself
+                    found_records = table_util.get_records(
+                        self.configuration.record_storage_table, 
+                        record_id_batch, 
+                        self.configuration.record_storage_partition)
+                    found_records = [self._validate_record(record_id_batch[idx], found_records[idx], table_util) for idx in range(len(record_id_batch))]
+                else:
+                    found_records = Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._search_single_record)(record_id, table_util) for record_id in record_id_batch)
+                record_list.extend([x for x in found_records if x is not None])
             except Exception as ex:
                 logger.info("Generic Exception - Table Search")
                 logger.info(str(ex))
 
-            # Sleep time of 5 seconds fairly irrelevant since we are going to process a lot. Let
-            # Parallel clean up a bit...but we MAY want to put this whole loop into a thread and then
-            # we can watch the thread. If it times out (some large amount of time) we can kill the 
-            # thread, potentially restart or at least get container to stop with a logged error. 
-            time.sleep(2)
+            if not table_util.concurrent_bulk:
+                # Sleep time of 5 seconds fairly irrelevant since we are going to process a lot. Let
+                # Parallel clean up a bit...but we MAY want to put this whole loop into a thread and then
+                # we can watch the thread. If it times out (some large amount of time) we can kill the 
+                # thread, potentially restart or at least get container to stop with a logged error. 
+                time.sleep(2)
 
         ######################################################################
         # With the list of records retrieved from the storage table, ensure we
@@ -135,7 +286,7 @@ class WorkloadAction(LogBase):
         logger.info("Retrieved {} records from the table".format(len(record_list)))
         if len(record_list) == 0:
             logger.info("There are no files to process at this time.")
-            return
+            return 0, 0
 
         ######################################################################
         # Prepare the services we'll need for processing
@@ -153,9 +304,15 @@ class WorkloadAction(LogBase):
         # Batch process each record into OSDU 
         batch_results:typing.List[RecordUploadResult] = []
 
+        if self.configuration.execution_lanes:
+            batch_results = self._process_lanes(record_list, metadata_storage, file_requests, storage_requests)
+            record_list_batches = []
+        else:
+            record_list_batches = self._batch(record_list, n_jobs)
+
         current_batch = 0
         max_batch = math.ceil(len(record_list)/n_jobs)
-        for record_batch in self._batch(record_list, n_jobs):
+        for record_batch in record_list_batches:
             current_batch += 1
             batch_message = f"2 of 3: Uploading to OSDU batch - {current_batch} of {max_batch}" 
             print(batch_message)
@@ -178,36 +335,99 @@ class WorkloadAction(LogBase):
         # storage table for auditing purposes. 
         logger.info("Update records in storage table with {} results".format(len(batch_results)))
         current_batch = 0
-        max_batch = math.ceil(len(batch_results)/n_jobs)
+        table_batch_size = self._get_table_batch_size(table_util, n_jobs)
+        max_batch = math.ceil(len(batch_results)/table_batch_size)
        
-        for execution_results in self._batch(batch_results, n_jobs):
+        for execution_results in self._batch(batch_results, table_batch_size):
             current_batch += 1
             batch_message = f"3 of 3: Processing results batch - {current_batch} of {max_batch}" 
             print(batch_message)
             logger.info(batch_message)
 
             try:
-                Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._finalize_single_record)(execution_result, record_list, table_util) for execution_result in execution_results)
+                if table_util.concurrent_bulk:
+                    # One bulk call, the record store keeps the updates in flight itself
+                    updated_records = [self._apply_result(x, record_list.find(x.record_identity)) for x in execution_results]
+                    table_util.upsert_records(
+                        self.configuration.record_storage_table, 
+                        [x for x in updated_records if x is not None])
+                else:
+                    Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._finalize_single_record)(execution_result, record_list.find(execution_result.record_identity), table_util) for execution_result in execution_results)
             except Exception as ex:
                 logger.info("Generic Exception - Record Update")
                 logger.info(str(ex))
 
-            # Sleep time of 5 seconds fairly irrelevant since we are going to process a lot. Let
-            # Parallel clean up a bit...but we MAY want to put this whole loop into a thread and then
-            # we can watch the thread. If it times out (some large amount of time) we can kill the 
-            # thread, potentially restart or at least get container to stop with a logged error. 
-            time.sleep(2)
+            if not table_util.concurrent_bulk:
+                # Sleep time of 5 seconds fairly irrelevant since we are going to process a lot. Let
+                # Parallel clean up a bit...but we MAY want to put this whole loop into a thread and then
+                # we can watch the thread. If it times out (some large amount of time) we can kill the 
+                # thread, potentially restart or at least get container to stop with a logged error. 
+                time.sleep(2)
 
         # Dump out some info on how many were succesfully processed
         good = [x for x in batch_results if x.succeeded]
         print("{} records succesfully processed".format(len(good)))
         logger.info("{} records succesfully processed".format(len(good)))
 
+        good_bytes = 0
+        for result in good:
+            record = record_list.find(result.record_identity)
+            good_bytes += int(record.file_size) if record and record.file_size else 0
+
+        return len(good), good_bytes
+
+    def _process_lanes(
+        self,
+        record_list:RecordBatch,
+        metadata_storage:FileShareUtil,
+        file_requests:FileRequests,
+        storage_requests:StorageRequests
+        ) -> typing.List[RecordUploadResult]:
+        """
+        Process the records into OSDU in size class lanes (execution_lanes), each lane 
+        with it's own workers so small files keep moving while large files copy.
+
+        Returns:
+            RecordUploadResult of every record that completed
+        """
+        logger:Logger = self.get_logger()
+
+        lane_executor = LaneExecutor(ExecutionLane.parse(self.configuration.execution_lanes))
+        tasks = (
+            (
+                record.file_size, 
+                record.RowKey, 
+                self._process_single_record, 
+                (record, metadata_storage, file_requests, storage_requests)
+            ) for record in record_list
+        )
+
+        return_results:typing.List[RecordUploadResult] = []
+        lane_counts:typing.Dict[str, int] = {x.name : 0 for x in lane_executor.lanes}
+        for lane_name, outcome in lane_executor.run(tasks):
+            if outcome.error:
+                logger.info("Generic Exception - Processing single record {} in lane {}".format(outcome.context, lane_name))
+                logger.info(str(outcome.error))
+                continue
+
+            return_results.append(outcome.result)
+            lane_counts[lane_name] += 1
+            if len(return_results) % 100 == 0:
+                lane_message = "2 of 3: Uploaded to OSDU - {} of {} ({})".format(
+                    len(return_results), 
+                    len(record_list),
+                    ", ".join(["{} {}".format(x, lane_counts[x]) for x in lane_counts]))
+                print(lane_message)
+                logger.info(lane_message)
+
+        logger.info("Lanes complete - {}".format(json.dumps(lane_counts)))
+        return return_results
+
     def _finalize_single_record(
         self, 
         execution_result:RecordUploadResult, 
-        record_list:typing.List[Record], 
-        table_util:AzureTableStoreUtil
+        orig_record:Record, 
+        table_util:RecordStore
         ) -> None:
         """
         Batch processor for records that have been through the flow. If a record is
@@ -219,19 +439,38 @@ class WorkloadAction(LogBase):
 
         execution_result: 
             The object used to track processing information.
-        record_list: 
-            Records representing records in the storage table that we started with
+        orig_record: 
+            The record in the storage table that we started with, None if it
+            could not be found.
         table_util: 
             Utility to talk with the storage table. 
 
         Returns 
             None
         """
+        orig_record = self._apply_result(execution_result, orig_record)
+        if orig_record:
+            table_util.update_record(self.configuration.record_storage_table, orig_record)
+
+    def _apply_result(self, execution_result:RecordUploadResult, orig_record:Record) -> Record:
+        """
+        Update a record with the outcome of processing it, who did it, at what time, 
+        and the metadata id in OSDU or the failure code.
+
+        Parameters:
+
+        execution_result: 
+            The object used to track processing information.
+        orig_record: 
+            The record in the storage table that we started with, None if it
+            could not be found.
+
+        Returns 
+            The updated record, None if orig_record is None
+        """
         logger:Logger = self.get_logger()
         
-        find_record = [x for x in record_list if x.RowKey == execution_result.record_identity]
-        if len(find_record):
-            orig_record = find_record[0]
+        if orig_record:
             orig_record.processed_time = str(datetime.utcnow())
             if execution_result.succeeded:
                 orig_record.container_id = self.configuration.log_identity
@@ -243,10 +482,9 @@ class WorkloadAction(LogBase):
                 orig_record.code = execution_result.status_code
                 logger.warn("Record {} failed to process".format(execution_result.record_identity))
 
-            table_util.update_record(self.configuration.record_storage_table, orig_record)
-
+        return orig_record
 
-    def _search_single_record(self, record_id:str, table_util:AzureTableStoreUtil) -> Record:
+    def _search_single_record(self, record_id:str, table_util:RecordStore) -> Record:
         """
         Batch processor for searching for a record in table storage.
 
@@ -260,24 +498,46 @@ class WorkloadAction(LogBase):
         Returns 
             Record if found, None otherwise
         """
+        records = table_util.search_table_id(self.configuration.record_storage_table, record_id)
+        return self._validate_record(record_id, records[0] if records else None, table_util)
+
+    def _validate_record(self, record_id:str, record:Record, table_util:RecordStore) -> Record:
+        """
+        Validate a record retrieved from table storage is there and has not already
+        been processed.
+
+        Parameters:
+
+        record_id: 
+            Record id found in the workflow manifest
+        record:
+            Record retrieved from table storage, None if not found
+        table_util: 
+            Utility to talk with the storage table. 
+
+        Returns 
+            Record if it needs processing, None otherwise
+        """
         logger:Logger = self.get_logger()
 
-        failed_load = True
         return_item:Record = None
-        records = table_util.search_table_id(self.configuration.record_storage_table, record_id)
-        if records:
-            if len(records):
-                failed_load = False
-                # Validate that it's not a re-run and the record has not been processed.
-                if records[0].processed == False:
-                    return_item = records[0]
-                else:
-                    logger.info("File {} previously processed on {}".format(
-                        records[0].file_name,
-                        records[0].processed_time
-                    ))
-
-        if failed_load:
+        if record:
+            # Validate that it's not a re-run and the record has not been processed.
+            if record.processed == False:
+                return_item = record
+            else:
+                logger.info("File {} previously processed on {}".format(
+                    record.file_name,
+                    record.processed_time
+                ))
+                # A stale pending entry is left behind if a previous run stopped
+                # between updating the record and clearing the index.
+                if table_util.pending_shards:
+                    table_util.remove_pending(
+                        self.configuration.record_storage_table, 
+                        [(record.RowKey, record.PartitionKey)]
+                    )
+        else:
             logger.warn("Table record {} not loaded".format(record_id))
             
         return return_item
@@ -371,7 +631,7 @@ class WorkloadAction(LogBase):
             if file_size_mb == 0:
                 file_size_mb = 1
 
-            if file_requests.transfer_file(file_size_mb, upload_response.url, record.source_sas):
+            if file_requests.transfer_file(file_size_mb, upload_response.url, record.source_sas, int(record.file_size or 0)):
                 ################################################################
                 # Upload the metadata to OSDU
                 upload_meta_response:FileUploadMetadataResponse = file_requests.upload_metadata(functional_meta)
@@ -401,10 +661,29 @@ class WorkloadAction(LogBase):
 
         return return_result
 
+    def _get_table_batch_size(self, table_util:RecordStore, n_jobs:int) -> int:
+        """
+        Records handed to the record store at a time. Stores with a concurrent bulk
+        path take much larger batches than the joblib fan out.
+        """
+        if table_util.concurrent_bulk:
+            return max(n_jobs, self.configuration.query_page_size)
+        return n_jobs
+
     def _batch(self, items:list, batch_size:int) -> typing.List[str]:
         """list is generic because it uses different types, batches up 
         a list based on size of batch requested and returns a sub list
-        with that many items in it until it is exhausted"""
+        with that many items in it until it is exhausted. A stream (no 
+        len) is batched as it is read."""
+        if not hasattr(items, "__len__"):
+            iterator = iter(items)
+            while True:
+                batch = list(itertools.islice(iterator, batch_size))
+                if not len(batch):
+                    break
+                yield batch
+            return
+
         idx = 0
         while idx < len(items):
             yield items[idx: idx + batch_size]
@@ -8,6 +8,9 @@ export DATA_SOURCE_ACCOUNT_SHARE="tnodataset"
 
 # Location of data in source, format:
 # path:extension||path:extension.....
+#
+# A path ending in * only picks up entries of the parent directory starting with 
+# that prefix, i.e. datasets/well-logs/NLOG*:las
 
 # Pattern, it will scan all files in the filter. However, you can run once to filter for a larger
 # number of records to get it into the tables, then reduce it to a small number as it will still
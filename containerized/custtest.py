@@ -19,6 +19,8 @@ from actions.workloadaction import WorkloadAction
 #    system where that code can reach it. 
 #
 import os
+import typing
+import threading
 from utils.storage.share import FileShareUtil
 
 def verify_required_environment(expected_entries:list):
@@ -115,13 +117,40 @@ def load_container_execute():
     scan = ScanAction(configuration)
     round_robin = RoundRobin(configuration)
 
-    # Scan storage and create metadata/table records for files
-    scan.scan_customer_storage()
+    # With scan_manifests a workload is launched as soon as the first manifest is 
+    # uploaded and runs while the scan carries on registering files. Locally the 
+    # workload runs on a thread in place of it's own ACI instance.
+    early_workloads:typing.List[threading.Thread] = []
+    def manifest_ready(manifest_path:str):
+        if len(early_workloads):
+            # DEBUG - Only one workload is run locally, as below
+            return
+
+        print("*** Launch Workload Container - Replace with ACI Instance ***")
+        os.environ["WORKFLOW_RECORD"] = get_workloads_locally(configuration, [manifest_path])[0]
+        early_workloads.append(threading.Thread(target=workload_container_execute))
+        early_workloads[0].start()
+
+    # Scan storage and create metadata/table records for files, with scan_manifests
+    # the scan also writes the workload manifests as it goes
+    workloads = scan.scan_customer_storage(manifest_ready if configuration.scan_manifests and not configuration.work_queue else None)
     # Generate workload manifests 
-    workloads = round_robin.create_workloads()
-
-    if len(workloads) == 0:
+    if not configuration.scan_manifests:
+        workloads = round_robin.create_workloads()
+
+    if len(early_workloads):
+        # Workload started while the scan was running, wait for it to finish
+        for workload in early_workloads:
+            workload.join()
+        print("***** Stopping with one workload *****")
+    elif len(workloads) == 0:
         print("Scan detected no work to be completed this run")
+    elif configuration.work_queue:
+        # Workloads are chunks on the work queue, the workload container claims them
+        # itself so there is nothing to download.
+        print("*** Launch Workload Container - Replace with ACI Instance ***")
+        os.environ["WORKFLOW_RECORD"] = ""
+        workload_container_execute()
     else:
         # DEBUG - This should just execute the workload conainer, but we need to 
         # get the files locally. 
@@ -31,8 +31,73 @@ class Config:
         self.container_count = config.get("LOAD", "container_count")
         self.record_storage_table:str = config.get("LOAD", "storage_table")
         self.record_storage_partition:str = config.get("LOAD", "storage_table_partition")
+        # Entities per page when paging through the storage table
+        self.query_page_size:int = int(config.get("LOAD", "query_page_size", fallback="1000"))
+        # Record store used to track files, azure (storage table) or sqlite (local file)
+        self.record_store:str = config.get("LOAD", "record_store", fallback="azure")
+        self.record_store_path:str = config.get("LOAD", "record_store_path", fallback="./records.db")
+        # Concurrent table operations per process for the async table client, 0 keeps
+        # the synchronous client with joblib workers
+        self.table_concurrency:int = int(config.get("LOAD", "table_concurrency", fallback="0"))
+        # Shards in the pending work index of the storage table, 0 disables it
+        self.pending_shards:int = int(config.get("LOAD", "pending_shards", fallback="0"))
+        # Scan walks every directory below a data_source_map path with this many
+        # concurrent directory listings
+        self.scan_recursive:bool = config.get("LOAD", "scan_recursive", fallback="false").lower() == "true"
+        self.scan_list_workers:int = int(config.get("LOAD", "scan_list_workers", fallback="16"))
+        self.scan_task_files:int = max(1, int(config.get("LOAD", "scan_task_files", fallback="50")))
+        # Scan only registers files added or changed since the directory snapshot
+        # of the previous scan, snapshots are kept on the record share
+        self.scan_incremental:bool = config.get("LOAD", "scan_incremental", fallback="false").lower() == "true"
+        # Scan writes workload manifests of manifest_size records as it registers them
+        # instead of RoundRobin reading every unprocessed record back from the table
+        self.scan_manifests:bool = config.get("LOAD", "scan_manifests", fallback="false").lower() == "true"
+        self.manifest_size:int = int(config.get("LOAD", "manifest_size", fallback="1000"))
+        # Workload manifest format, ndjson (gzip newline delimited with a header) or the legacy json list
+        self.manifest_format:str = config.get("LOAD", "manifest_format", fallback="ndjson")
+        # How RoundRobin spreads records over the containers, roundrobin, greedy or lpt,
+        # with the cost of a record being it's size plus a fixed request overhead (bytes)
+        self.partition_strategy:str = config.get("LOAD", "partition_strategy", fallback="roundrobin")
+        self.partition_request_overhead:int = int(config.get("LOAD", "partition_request_overhead", fallback="16777216"))
+        self.partition_max_records:int = int(config.get("LOAD", "partition_max_records", fallback="0"))
+        # Work queue the workloads claim chunks of records from, table or local, when 
+        # not set each workload container gets a static manifest (WORKFLOW_RECORD)
+        self.work_queue:str = config.get("LOAD", "work_queue", fallback="")
+        self.work_queue_chunk:int = int(config.get("LOAD", "work_queue_chunk", fallback="500"))
+        self.work_queue_lease:int = int(config.get("LOAD", "work_queue_lease", fallback="300"))
+        # Claims of a chunk before it is abandoned, and the seconds to back off after
+        # a failed chunk (doubling with each attempt, at most the lease)
+        self.work_queue_max_attempts:int = int(config.get("LOAD", "work_queue_max_attempts", fallback="3"))
+        self.work_queue_backoff:int = int(config.get("LOAD", "work_queue_backoff", fallback="30"))
+        # Plan the container count to finish within this many hours, 0 keeps the flat
+        # 1000 records per container. Throughput comes from the run metrics on the
+        # record share, or plan_bytes_per_second per container without any history.
+        self.plan_deadline_hours:float = float(config.get("LOAD", "plan_deadline_hours", fallback="0"))
+        self.plan_bytes_per_second:int = int(config.get("LOAD", "plan_bytes_per_second", fallback="52428800"))
+        # How files reach OSDU, copy (by the storage service), relay (streamed through 
+        # the container, for sources the OSDU storage can't reach) or auto (copy, relay
+        # if the copy fails)
+        self.transfer_mode:str = config.get("LOAD", "transfer_mode", fallback="copy").lower()
+        # Files of at least transfer_block_threshold bytes are copied to OSDU as blocks of
+        # transfer_block_size staged transfer_block_concurrency at a time, smaller files 
+        # (or a threshold of 0) use a single whole blob copy
+        self.transfer_block_threshold:int = int(config.get("LOAD", "transfer_block_threshold", fallback="268435456"))
+        self.transfer_block_size:int = int(config.get("LOAD", "transfer_block_size", fallback="104857600"))
+        self.transfer_block_concurrency:int = int(config.get("LOAD", "transfer_block_concurrency", fallback="8"))
+        # Bytes of relayed blocks held in memory across every process of the container
+        self.transfer_relay_buffer:int = int(config.get("LOAD", "transfer_relay_buffer", fallback="2147483648"))
+        # Network limit of the container in bytes per second each way, 0 is unlimited,
+        # with shaper_control_share of it held back for OSDU API calls
+        self.shaper_bytes_per_second:int = int(config.get("LOAD", "shaper_bytes_per_second", fallback="0"))
+        self.shaper_control_share:float = float(config.get("LOAD", "shaper_control_share", fallback="0.1"))
+        # Size class lanes the workload uploads records in, name:max_bytes:workers 
+        # separated by commas (max_bytes of 0 takes anything). Empty processes every 
+        # record in the same batches.
+        self.execution_lanes:str = config.get("LOAD", "execution_lanes", fallback="")
         self.workload_path = config.get("WORKLOADS", "work_path")
         self.record_metadata_path:str = config.get("WORKLOADS", "meta_path")
+        self.snapshot_path:str = config.get("WORKLOADS", "snapshot_path", fallback="snapshots")
+        self.metrics_path:str = config.get("WORKLOADS", "metrics_path", fallback="metrics")
 
         # Platform name is required on load to build ACL/Legal tag and on workflow 
         # to build up the URI's required for the API calls. 
@@ -148,8 +213,9 @@ class Config:
         """
         return_config = Config(ini_file)
 
-        # Workflow record is ONLY used in the workflow schema  
-        return_config.workflow_record = return_config._get_environment("WORKFLOW_RECORD")
+        # Workflow record is ONLY used in the workflow schema, and not at all when the 
+        # records are claimed from a work queue
+        return_config.workflow_record = return_config._get_environment("WORKFLOW_RECORD", not return_config.work_queue)
 
         # Credentials only needed for API calls
         return_config.platform_tenant = return_config._get_environment("PLATFORM_TENANT")
@@ -0,0 +1,3 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
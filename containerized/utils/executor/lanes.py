@@ -0,0 +1,105 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import queue
+import threading
+import typing
+from joblib.externals.loky import ProcessPoolExecutor
+from utils.executor.slidingwindow import SlidingWindowExecutor, TaskOutcome
+
+class ExecutionLane:
+    """
+    A size class of work with it's own workers. Tasks up to max_size bytes go to the
+    first lane that fits them, a max_size of 0 takes anything.
+    """
+    def __init__(self, name:str, max_size:int, max_workers:int):
+        self.name = name
+        self.max_size = int(max_size)
+        self.max_workers = max(1, int(max_workers))
+
+    @staticmethod
+    def parse(lanes:str) -> typing.List[object]:
+        """
+        Parse lanes from a setting of name:max_size:workers separated by commas, i.e.
+
+            small:16777216:64,large:0:8
+
+        Lanes are ordered smallest max_size first with the unlimited lane last.
+        """
+        return_lanes:typing.List[ExecutionLane] = []
+        for lane in [x.strip() for x in lanes.split(",") if x.strip()]:
+            parts = lane.split(":")
+            if len(parts) != 3:
+                raise Exception("Lane setting must be name:max_size:workers - {}".format(lane))
+            return_lanes.append(ExecutionLane(parts[0], parts[1], parts[2]))
+
+        return_lanes.sort(key=lambda x: x.max_size if x.max_size else float("inf"))
+        return return_lanes
+
+    def fits(self, size:int) -> bool:
+        return self.max_size == 0 or int(size) <= self.max_size
+
+class LaneExecutor:
+    """
+    Runs tasks in size class lanes at the same time, so a lane of large files that
+    take minutes each never holds up the lane of small files that take a second.
+
+    Each lane is a SlidingWindowExecutor on it's own process pool with the lane's
+    workers, outcomes from every lane come back on one stream as they complete.
+    """
+    def __init__(self, lanes:typing.List[ExecutionLane]):
+        if not len(lanes):
+            raise Exception("At least one execution lane is required")
+        self.lanes = lanes
+
+    def get_lane(self, size:int) -> ExecutionLane:
+        """Lane for a task of size bytes, the last lane takes anything too big for the rest"""
+        for lane in self.lanes:
+            if lane.fits(size):
+                return lane
+        return self.lanes[-1]
+
+    def run(
+        self,
+        tasks:typing.Iterable[typing.Tuple[int, typing.Any, typing.Callable, tuple]]
+        ) -> typing.Generator[typing.Tuple[str, TaskOutcome], None, None]:
+        """
+        Run tasks in their lanes.
+
+        Parameters:
+
+        tasks:
+            Iterable of (size, context, function, args), see SlidingWindowExecutor
+
+        Returns:
+            Generator of (lane name, TaskOutcome) as each task completes
+        """
+        lane_tasks:typing.Dict[str, list] = {x.name : [] for x in self.lanes}
+        for size, context, function, args in tasks:
+            lane_tasks[self.get_lane(size).name].append((context, function, args))
+
+        outcomes = queue.Queue()
+
+        def run_lane(lane:ExecutionLane) -> None:
+            executor = ProcessPoolExecutor(max_workers=lane.max_workers)
+            try:
+                for outcome in SlidingWindowExecutor(lane.max_workers, executor=executor).run(lane_tasks[lane.name]):
+                    outcomes.put((lane.name, outcome))
+            except Exception as ex:
+                # Lane pool failed, the records it did not finish stay unprocessed
+                outcomes.put((lane.name, TaskOutcome(None, error=ex)))
+            finally:
+                executor.shutdown(wait=True)
+                outcomes.put(None)
+
+        runners = [threading.Thread(target=run_lane, args=(x,), daemon=True) for x in self.lanes if len(lane_tasks[x.name])]
+        for runner in runners:
+            runner.start()
+
+        remaining = len(runners)
+        while remaining:
+            item = outcomes.get()
+            if item is None:
+                remaining -= 1
+                continue
+            yield item
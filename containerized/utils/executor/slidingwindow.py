@@ -0,0 +1,94 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import typing
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
+from joblib.externals.loky import get_reusable_executor
+
+class TaskOutcome:
+    """
+    Result of a single task run through the SlidingWindowExecutor. Exactly one of
+    result or error is set.
+    """
+    def __init__(self, context:typing.Any, result:typing.Any = None, error:Exception = None):
+        # Whatever the caller attached to the task when it was submitted
+        self.context = context
+        self.result = result
+        self.error = error
+
+class SlidingWindowExecutor:
+    """
+    Keeps a process pool saturated from a stream of tasks. Up to window tasks are in
+    flight at once and a new one is submitted as soon as any finishes, so there is
+    no waiting on the slowest task of a batch and no idle time between batches.
+
+    Uses the same loky process pool as joblib so tasks are pickled the same way as
+    they are with Parallel/delayed. The reusable pool is shared by the whole process, 
+    to run more than one window at once give each it's own executor.
+
+    If no task completes for timeout seconds (as the Parallel timeout) the tasks in
+    flight are failed with a TimeoutError, the pool workers are killed and the run 
+    stops. Tasks not yet submitted are left unrun.
+    """
+    # Seconds to wait on the tasks in flight before they are failed
+    TIMEOUT = 600.0
+
+    def __init__(self, max_workers:int, window:int = None, executor:Executor = None, timeout:float = TIMEOUT):
+        self.max_workers = max(1, int(max_workers))
+        # Tasks in flight, enough queued that a worker never waits for the next one
+        self.window = max(self.max_workers, int(window) if window else self.max_workers * 2)
+        # Pool to run on, None is the reusable loky pool
+        self.executor = executor
+        self.timeout = timeout
+
+    def run(
+        self,
+        tasks:typing.Iterable[typing.Tuple[typing.Any, typing.Callable, tuple]]
+        ) -> typing.Generator[TaskOutcome, None, None]:
+        """
+        Run a stream of tasks, yielding each outcome as it completes (not in the order
+        submitted).
+
+        Parameters:
+
+        tasks:
+            Iterable of (context, function, args). The context stays in this process
+            and is handed back on the TaskOutcome.
+
+        Returns:
+            Generator of TaskOutcome
+        """
+        executor = self.executor if self.executor else get_reusable_executor(max_workers=self.max_workers)
+        in_flight:typing.Dict[Future, typing.Any] = {}
+        task_iterator = iter(tasks)
+        exhausted = False
+
+        while True:
+            while not exhausted and len(in_flight) < self.window:
+                try:
+                    context, function, args = next(task_iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(function, *args)] = context
+
+            if not len(in_flight):
+                break
+
+            done, _ = wait(list(in_flight.keys()), timeout=self.timeout, return_when=FIRST_COMPLETED)
+            if not len(done):
+                # Workers stuck on a task are not waited on
+                executor.shutdown(wait=False, kill_workers=True)
+                for future in list(in_flight.keys()):
+                    yield TaskOutcome(
+                        in_flight.pop(future), 
+                        error=TimeoutError("No task completed in {} seconds".format(self.timeout)))
+                break
+
+            for future in done:
+                context = in_flight.pop(future)
+                try:
+                    outcome = TaskOutcome(context, result=future.result())
+                except Exception as ex:
+                    outcome = TaskOutcome(context, error=ex)
+                yield outcome
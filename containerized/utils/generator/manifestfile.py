@@ -0,0 +1,139 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import gzip
+import json
+import shutil
+import typing
+
+class ManifestWriter:
+    """
+    Writes a workload manifest in the compact format, gzip compressed newline
+    delimited JSON with a header line:
+
+        {"schema": 1, "count": 2, "total_bytes": 300}
+        {"RowKey": "...", "file_size": 100}
+        {"RowKey": "...", "file_size": 200}
+
+    Records are streamed to a body file as they are written. On close the header,
+    which needs the final count, is written as its own gzip member and the body
+    member is appended after it. Concatenated members are a single valid gzip
+    stream, so nothing is decompressed or held in memory to put the header first.
+
+    With format JSON the legacy manifest, a JSON list of RowKeys, is written instead.
+    """
+    SCHEMA = 1
+    NDJSON = "ndjson"
+    JSON = "json"
+
+    def __init__(self, file_name:str, manifest_format:str = NDJSON):
+        self.file_name = file_name
+        self.manifest_format = manifest_format.lower()
+        if self.manifest_format not in [ManifestWriter.NDJSON, ManifestWriter.JSON]:
+            raise Exception("Unknown manifest format - {}".format(manifest_format))
+
+        # Records and bytes written so far
+        self.count = 0
+        self.total_bytes = 0
+
+        if self.manifest_format == ManifestWriter.NDJSON:
+            self._body_file = "{}.body".format(file_name)
+            self._output = gzip.open(self._body_file, "wt")
+        else:
+            self._output = open(file_name, "w")
+
+    @staticmethod
+    def get_file_name(base_name:str, manifest_format:str = NDJSON) -> str:
+        """Manifest file name for a base name, i.e. workload0"""
+        if manifest_format.lower() == ManifestWriter.JSON:
+            return "{}.json".format(base_name)
+        return "{}.ndjson.gz".format(base_name)
+
+    def write(self, row_key:str, file_size:int = 0) -> None:
+        """
+        Add a record to the manifest.
+        """
+        if self.manifest_format == ManifestWriter.NDJSON:
+            self._output.write(json.dumps({"RowKey" : row_key, "file_size" : int(file_size)}, separators=(",", ":")))
+            self._output.write("\n")
+        else:
+            self._output.write("[\n" if self.count == 0 else ",\n")
+            self._output.write("    {}".format(json.dumps(row_key)))
+
+        self.count += 1
+        self.total_bytes += int(file_size)
+
+    def close(self) -> None:
+        """
+        Finish the manifest file.
+        """
+        if self.manifest_format == ManifestWriter.JSON:
+            self._output.write("\n]" if self.count else "[]")
+            self._output.close()
+            return
+
+        self._output.close()
+        header = {"schema" : ManifestWriter.SCHEMA, "count" : self.count, "total_bytes" : self.total_bytes}
+        with gzip.open(self.file_name, "wt") as header_output:
+            header_output.write(json.dumps(header, separators=(",", ":")))
+            header_output.write("\n")
+
+        with open(self.file_name, "ab") as manifest, open(self._body_file, "rb") as body:
+            shutil.copyfileobj(body, manifest)
+        os.remove(self._body_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ManifestReader:
+    """
+    Reads a workload manifest in either the compact (gzip newline delimited JSON)
+    or the legacy (JSON list) format. Compact manifests are read lazily one record
+    at a time.
+    """
+    GZIP_MAGIC = b"\x1f\x8b"
+
+    def __init__(self, file_name:str):
+        self.file_name = file_name
+        # Header of a compact manifest, None for a legacy manifest
+        self.header:dict = None
+
+        with open(file_name, "rb") as manifest:
+            self.compact = manifest.read(2) == ManifestReader.GZIP_MAGIC
+
+        if self.compact:
+            with gzip.open(file_name, "rt") as manifest:
+                self.header = json.loads(manifest.readline())
+
+    def get_count(self) -> int:
+        """Number of records in the manifest, None if unknown before reading it"""
+        return self.header.get("count") if self.header else None
+
+    def read(self) -> typing.Generator[typing.Tuple[str, int], None, None]:
+        """
+        Yield (RowKey, file_size) for each record, size is 0 for legacy manifests.
+        """
+        if not self.compact:
+            with open(self.file_name, "r") as manifest:
+                for row_key in json.load(manifest):
+                    yield row_key, 0
+            return
+
+        with gzip.open(self.file_name, "rt") as manifest:
+            # Skip the header
+            manifest.readline()
+            for line in manifest:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record["RowKey"], record.get("file_size", 0)
+
+    def read_row_keys(self) -> typing.Generator[str, None, None]:
+        """
+        Yield the RowKey of each record.
+        """
+        for row_key, file_size in self.read():
+            yield row_key
@@ -0,0 +1,98 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import typing
+from utils.storage.share import FileShareUtil
+from utils.storage.workqueue import WorkQueue
+from utils.generator.manifestfile import ManifestWriter
+
+class ManifestGenerator:
+    """
+    Builds workload manifests from a stream of record RowKeys. Records go into the
+    current manifest until it holds manifest_size of them, then it is uploaded to
+    the record share and the next one is started, so the first manifests can be
+    picked up while records are still arriving.
+
+    Manifests are assigned to the workload containers in turn and named
+    workload{container}-{sequence} in the same manifest_format that RoundRobin
+    produces. With a work queue each full manifest is pushed to the queue as a 
+    chunk instead.
+    """
+    def __init__(
+        self,
+        share_util:FileShareUtil,
+        workload_path:str,
+        container_count:int,
+        manifest_size:int,
+        manifest_ready:typing.Callable[[str], None] = None,
+        work_queue:WorkQueue = None,
+        manifest_format:str = ManifestWriter.NDJSON
+        ):
+        # Record share and folder the manifests are uploaded to
+        self.share_util = share_util
+        self.workload_path = workload_path
+        # Containers the manifests are spread over
+        self.container_count = max(1, int(container_count))
+        self.manifest_format = manifest_format
+        # Queue to push chunks to instead of uploading manifests
+        self.work_queue = work_queue
+        # RowKeys per manifest
+        self.manifest_size = max(1, int(manifest_size))
+        if self.work_queue:
+            self.manifest_size = min(self.manifest_size, WorkQueue.CHUNK_MAX)
+            # Chunks left from an earlier load would hand the same records out twice
+            self.work_queue.clear()
+        # Optional callback with the share path of each manifest as it is uploaded
+        self.manifest_ready = manifest_ready
+        # Manifests uploaded so far (share paths), or chunk ids pushed
+        self.manifests:typing.List[str] = []
+        # Total records written to manifests
+        self.record_count = 0
+        # (RowKey, file_size) in the current manifest
+        self._current:typing.List[typing.Tuple[str, int]] = []
+
+    def add(self, row_key:str, file_size:int = 0) -> None:
+        """
+        Add a record to the current manifest, uploading it when it is full.
+        """
+        self._current.append((row_key, file_size))
+        self.record_count += 1
+        if len(self._current) >= self.manifest_size:
+            self._flush()
+
+    def close(self) -> typing.List[str]:
+        """
+        Upload the last, partially filled, manifest and return the share paths of
+        every manifest generated.
+        """
+        if len(self._current):
+            self._flush()
+        return self.manifests
+
+    def _flush(self) -> None:
+        """Write the current manifest locally, upload it and start a new one"""
+        if self.work_queue:
+            self.manifests.append(self.work_queue.push([x[0] for x in self._current]))
+            self._current = []
+            return
+
+        sequence = len(self.manifests)
+        file_name = ManifestWriter.get_file_name(
+            "workload{}-{}".format(sequence % self.container_count, sequence),
+            self.manifest_format)
+
+        with ManifestWriter(file_name, self.manifest_format) as manifest:
+            for row_key, file_size in self._current:
+                manifest.write(row_key, file_size)
+
+        self.share_util.create_directory(self.workload_path)
+        self.share_util.upload_file(self.workload_path, file_name)
+        os.remove(file_name)
+
+        manifest_path = os.path.join(self.workload_path, file_name)
+        self.manifests.append(manifest_path)
+        self._current = []
+
+        if self.manifest_ready:
+            self.manifest_ready(manifest_path)
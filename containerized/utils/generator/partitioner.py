@@ -0,0 +1,132 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import heapq
+import itertools
+import typing
+
+class WorkloadPartitioner:
+    """
+    Splits records into workload buckets so each bucket carries about the same
+    estimated cost, where the cost of a record is the size of the file plus a fixed
+    overhead for the requests every record needs regardless of size (metadata,
+    file API calls, table updates).
+
+    Strategies:
+        roundrobin - record n goes to bucket n % buckets, ignores size
+        greedy     - each record goes to the cheapest bucket in the order they arrive
+        lpt        - longest processing time first, records are sorted largest first
+                     and then placed greedily. Sorting is done in windows of 
+                     max_records (LPT_WINDOW when there is no limit) records so 
+                     memory stays bounded however many records are spooled.
+
+    When max_records is set no bucket takes more than that many records, once every
+    bucket is full a new bucket is opened.
+    """
+    ROUND_ROBIN = "roundrobin"
+    GREEDY = "greedy"
+    LPT = "lpt"
+    # Records sorted together by lpt when max_records is not set
+    LPT_WINDOW = 100000
+
+    def __init__(self, strategy:str, bucket_count:int, request_overhead:int = 0, max_records:int = 0):
+        self.strategy = strategy.lower()
+        if self.strategy not in [WorkloadPartitioner.ROUND_ROBIN, WorkloadPartitioner.GREEDY, WorkloadPartitioner.LPT]:
+            raise Exception("Unknown partition strategy - {}".format(strategy))
+
+        # Buckets to start with, may grow when max_records is hit
+        self.bucket_count = max(1, int(bucket_count))
+        # Cost in bytes added to every record
+        self.request_overhead = int(request_overhead)
+        # Maximum records in a bucket, 0 is no limit
+        self.max_records = int(max_records)
+        # Estimated cost and record count per bucket
+        self.bucket_costs:typing.List[int] = []
+        self.bucket_records:typing.List[int] = []
+
+    def get_cost(self, file_size:int) -> int:
+        """Estimated cost of a single record"""
+        return (int(file_size) if file_size else 0) + self.request_overhead
+
+    def partition(self, records:typing.Iterable[typing.Tuple[str, int]]) -> typing.Generator[typing.Tuple[int, str, int], None, None]:
+        """
+        Assign records to buckets.
+
+        Parameters:
+
+        records:
+            (RowKey, file_size) for every record to assign
+
+        Returns:
+            Generator of (bucket index, RowKey, file_size)
+        """
+        self.bucket_costs = [0] * self.bucket_count
+        self.bucket_records = [0] * self.bucket_count
+
+        if self.strategy == WorkloadPartitioner.ROUND_ROBIN:
+            yield from self._round_robin(records)
+            return
+
+        if self.strategy == WorkloadPartitioner.LPT:
+            records = self._sort_windows(records, self.max_records if self.max_records else WorkloadPartitioner.LPT_WINDOW)
+
+        yield from self._greedy(records)
+
+    def _round_robin(self, records:typing.Iterable[typing.Tuple[str, int]]) -> typing.Generator[typing.Tuple[int, str, int], None, None]:
+        """Cycle through the buckets, moving on to new buckets as they fill"""
+        first_open = 0
+        count = 0
+        for row_key, file_size in records:
+            open_buckets = len(self.bucket_costs) - first_open
+            bucket = first_open + (count % open_buckets)
+            count += 1
+
+            self._add(bucket, file_size)
+            yield bucket, row_key, file_size
+
+            if self.max_records and self.bucket_records[bucket] >= self.max_records:
+                # Round robin fills the buckets evenly, so once one is full the whole
+                # open set is, start a new set
+                if bucket == len(self.bucket_costs) - 1:
+                    first_open = len(self.bucket_costs)
+                    self._open_buckets(self.bucket_count)
+                    count = 0
+
+    def _greedy(self, records:typing.Iterable[typing.Tuple[str, int]]) -> typing.Generator[typing.Tuple[int, str, int], None, None]:
+        """Place each record in the bucket with the lowest cost so far"""
+        # Heap of (cost, bucket) for buckets that still have room
+        heap = [(0, idx) for idx in range(len(self.bucket_costs))]
+        heapq.heapify(heap)
+
+        for row_key, file_size in records:
+            if not len(heap):
+                bucket = self._open_buckets(1)
+                heap.append((0, bucket))
+
+            cost, bucket = heapq.heappop(heap)
+            self._add(bucket, file_size)
+            yield bucket, row_key, file_size
+
+            if not self.max_records or self.bucket_records[bucket] < self.max_records:
+                heapq.heappush(heap, (self.bucket_costs[bucket], bucket))
+
+    def _sort_windows(self, records:typing.Iterable[typing.Tuple[str, int]], window:int) -> typing.Generator[typing.Tuple[str, int], None, None]:
+        """Sort records largest first, window records at a time"""
+        iterator = iter(records)
+        while True:
+            chunk = list(itertools.islice(iterator, window))
+            if not len(chunk):
+                return
+            chunk.sort(key=lambda x: int(x[1]) if x[1] else 0, reverse=True)
+            yield from chunk
+
+    def _add(self, bucket:int, file_size:int) -> None:
+        self.bucket_costs[bucket] += self.get_cost(file_size)
+        self.bucket_records[bucket] += 1
+
+    def _open_buckets(self, count:int) -> int:
+        """Open new empty buckets, returns the index of the first"""
+        first = len(self.bucket_costs)
+        self.bucket_costs += [0] * count
+        self.bucket_records += [0] * count
+        return first
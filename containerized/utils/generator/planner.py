@@ -0,0 +1,194 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import json
+import math
+import typing
+from datetime import datetime, timedelta
+from utils.storage.share import FileShareUtil
+
+class RunMetrics:
+    """
+    Throughput of a single workload container run, written to the record share by
+    the workload and read back by the planner.
+    """
+    def __init__(self):
+        self.container_id:str = None
+        self.records:int = 0
+        self.bytes:int = 0
+        self.seconds:float = 0.0
+        self.batch_multiplier:int = 0
+        self.cores:int = 0
+        self.finished:str = None
+
+    def get_cost_per_second(self, request_overhead:int) -> float:
+        """Cost (bytes plus request overhead per record) moved per second"""
+        if self.seconds <= 0:
+            return 0.0
+        return (self.bytes + self.records * request_overhead) / self.seconds
+
+    def save(self, share_util:FileShareUtil, metrics_path:str) -> None:
+        """Upload the metrics as run-{container_id}.json"""
+        file_name = "run-{}.json".format(self.container_id)
+        with open(file_name, "w") as metrics_output:
+            metrics_output.write(json.dumps(self.__dict__, indent=4))
+
+        share_util.create_directory(metrics_path)
+        share_util.upload_file(metrics_path, file_name)
+        os.remove(file_name)
+
+    @staticmethod
+    def from_dict(values:dict) -> object:
+        return_metrics = RunMetrics()
+        for key in values:
+            if hasattr(return_metrics, key):
+                setattr(return_metrics, key, values[key])
+        return return_metrics
+
+class WorkloadPlan:
+    """
+    Output of the planner, written as plan.json next to the workload manifests.
+    """
+    def __init__(self):
+        # Workload containers to run
+        self.container_count:int = 1
+        # Suggested batch_multiplier for the workload containers
+        self.batch_multiplier:int = 1
+        # Records per manifest
+        self.manifest_size:int = 0
+        # Inputs
+        self.record_count:int = 0
+        self.total_bytes:int = 0
+        self.deadline_seconds:float = 0.0
+        # Throughput used for the estimate, cost per second per container, and
+        # where it came from (history or calibration)
+        self.cost_per_second:float = 0.0
+        self.throughput_source:str = None
+        self.history_runs:int = 0
+        # Estimated run time of the containers and wall clock completion (UTC)
+        self.estimated_seconds:float = 0.0
+        self.estimated_completion:str = None
+        # True when the deadline can be met within the container limit
+        self.meets_deadline:bool = True
+
+    def save(self, share_util:FileShareUtil, workload_path:str) -> str:
+        """Upload the plan as plan.json to the workload path, returns the share path"""
+        file_name = "plan.json"
+        with open(file_name, "w") as plan_output:
+            plan_output.write(json.dumps(self.__dict__, indent=4))
+
+        share_util.create_directory(workload_path)
+        share_util.upload_file(workload_path, file_name)
+        os.remove(file_name)
+        return os.path.join(workload_path, file_name)
+
+class ThroughputPlanner:
+    """
+    Works out how many workload containers are needed to finish a load by a deadline.
+
+    The throughput of a single container is taken from the metrics of previous runs
+    on the record share, measured in cost per second where cost is file bytes plus a
+    fixed overhead per record (the same cost the partitioner balances on). With no
+    history the calibration default is used.
+
+    The container count is the smallest that meets the deadline, limited to
+    max_containers and to at least min_records records per container.
+    """
+    # Most recent runs read from the share
+    HISTORY_MAX = 50
+
+    def __init__(
+        self,
+        max_containers:int,
+        request_overhead:int,
+        calibration_bytes_per_second:int,
+        batch_multiplier:int,
+        min_records:int = 1000
+        ):
+        self.max_containers = max(1, int(max_containers))
+        self.request_overhead = int(request_overhead)
+        self.calibration_bytes_per_second = int(calibration_bytes_per_second)
+        self.batch_multiplier = int(batch_multiplier)
+        self.min_records = max(1, int(min_records))
+        # Runs loaded with load_history
+        self.history:typing.List[RunMetrics] = []
+
+    def load_history(self, share_util:FileShareUtil, metrics_path:str) -> int:
+        """
+        Read the metrics of previous runs from the record share, returns the number
+        of runs loaded. A missing folder is no history.
+        """
+        self.history = []
+        if not share_util.exists(metrics_path):
+            return 0
+
+        run_files = [x for x in share_util.list_files(metrics_path, True) if x.file_name.endswith(".json")]
+        # Newest first when the listing carries timestamps
+        run_files.sort(key=lambda x: str(x.last_modified), reverse=True)
+
+        local_folder = "metrics_download"
+        for run_file in run_files[:ThroughputPlanner.HISTORY_MAX]:
+            local_file = os.path.join(local_folder, run_file.file_name)
+            try:
+                share_util.download_file(local_folder, metrics_path, run_file.file_name)
+                with open(local_file, "r") as metrics_input:
+                    self.history.append(RunMetrics.from_dict(json.load(metrics_input)))
+            except Exception as ex:
+                print("Skipping run metrics {} - {}".format(run_file.file_name, str(ex)))
+            finally:
+                if os.path.exists(local_file):
+                    os.remove(local_file)
+
+        return len(self.history)
+
+    def plan(self, record_count:int, total_bytes:int, deadline_seconds:float) -> WorkloadPlan:
+        """
+        Plan a load of record_count records totalling total_bytes to finish within
+        deadline_seconds.
+        """
+        return_plan = WorkloadPlan()
+        return_plan.record_count = int(record_count)
+        return_plan.total_bytes = int(total_bytes)
+        return_plan.deadline_seconds = float(deadline_seconds)
+        return_plan.batch_multiplier = self.batch_multiplier
+
+        useful_runs = [x for x in self.history if x.get_cost_per_second(self.request_overhead) > 0]
+        if len(useful_runs):
+            # Time weighted, total cost over total seconds of all runs
+            total_cost = sum([x.bytes + x.records * self.request_overhead for x in useful_runs])
+            total_seconds = sum([x.seconds for x in useful_runs])
+            return_plan.cost_per_second = total_cost / total_seconds
+            return_plan.throughput_source = "history"
+            return_plan.history_runs = len(useful_runs)
+            return_plan.batch_multiplier = self._get_best_multiplier(useful_runs)
+        else:
+            return_plan.cost_per_second = float(self.calibration_bytes_per_second)
+            return_plan.throughput_source = "calibration"
+
+        load_cost = return_plan.total_bytes + return_plan.record_count * self.request_overhead
+        container_seconds = load_cost / return_plan.cost_per_second
+
+        needed = math.ceil(container_seconds / deadline_seconds) if deadline_seconds > 0 else self.max_containers
+        useful = math.ceil(return_plan.record_count / self.min_records)
+        return_plan.container_count = max(1, min(needed, self.max_containers, useful))
+        return_plan.meets_deadline = needed <= self.max_containers
+
+        return_plan.manifest_size = math.ceil(return_plan.record_count / return_plan.container_count)
+        return_plan.estimated_seconds = container_seconds / return_plan.container_count
+        return_plan.estimated_completion = str(datetime.utcnow() + timedelta(seconds=return_plan.estimated_seconds))
+        return return_plan
+
+    def _get_best_multiplier(self, runs:typing.List[RunMetrics]) -> int:
+        """batch_multiplier of the runs with the best throughput per core"""
+        by_multiplier:typing.Dict[int, typing.List[float]] = {}
+        for run in runs:
+            if run.batch_multiplier and run.cores:
+                if run.batch_multiplier not in by_multiplier:
+                    by_multiplier[run.batch_multiplier] = []
+                by_multiplier[run.batch_multiplier].append(run.get_cost_per_second(self.request_overhead) / run.cores)
+
+        if not len(by_multiplier):
+            return self.batch_multiplier
+
+        return max(by_multiplier, key=lambda x: sum(by_multiplier[x]) / len(by_multiplier[x]))
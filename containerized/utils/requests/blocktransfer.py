@@ -0,0 +1,139 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import base64
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from azure.storage.blob import BlobClient, BlobBlock
+from azure.storage.fileshare import ShareFileClient
+from utils.requests.shaper import BandwidthShaper
+
+class BlockTransfer:
+    """
+    Copies a large file into a block blob as a set of blocks staged in parallel and
+    then committed, rather than as one whole blob copy.
+
+    The source (a SAS URL) is split into ranges of block_size bytes, each range is
+    staged on the target with up to max_concurrency ranges in flight, then the block 
+    list is committed. 
+
+    copy - each range is staged with stage_block_from_url, the storage service reads
+           the source itself and no file data passes through this process.
+    relay - each range is downloaded from the source share and staged from memory,
+            for when the target storage can not reach the source. At most 
+            max_concurrency blocks are held in memory and nothing is written to disk.
+
+    Relayed blocks are held in memory, max_concurrency blocks of block_size per file.
+    get_relay_transfer sizes both from a byte budget for the whole container, so 
+    every process relaying at once stays within it.
+
+    When the target does not allow block staging the HttpResponseError of the first
+    failed block is raised so the caller can fall back to another mode. Blocks staged 
+    but never committed are discarded by the service.
+    """
+    # Smallest relay block, below this the request overhead outweighs the data
+    RELAY_BLOCK_MIN = 4 * 1024 * 1024
+
+    def __init__(self, block_size:int, max_concurrency:int, shaper:BandwidthShaper = None):
+        self.block_size = max(1, int(block_size))
+        self.max_concurrency = max(1, int(max_concurrency))
+        # Relayed data is charged to the shaper, a copy never passes through here
+        self.shaper = shaper
+
+    @staticmethod
+    def get_relay_transfer(
+        buffer_bytes:int, 
+        processes:int, 
+        block_size:int, 
+        max_concurrency:int, 
+        shaper:BandwidthShaper = None
+        ) -> object:
+        """
+        BlockTransfer for relaying in one of processes processes that together hold at
+        most buffer_bytes of blocks in memory. Concurrency is cut back first, then the
+        block size, down to one block of RELAY_BLOCK_MIN per process.
+        """
+        per_process = max(1, int(buffer_bytes) // max(1, int(processes)))
+        concurrency = max(1, min(int(max_concurrency), per_process // BlockTransfer.RELAY_BLOCK_MIN))
+        relay_block = max(BlockTransfer.RELAY_BLOCK_MIN, min(int(block_size), per_process // concurrency))
+        return BlockTransfer(relay_block, concurrency, shaper)
+
+    @staticmethod
+    def get_block_id(index:int) -> str:
+        """Block ids must be base64 and the same length for every block of a blob"""
+        return base64.b64encode("{:08d}".format(index).encode("utf-8")).decode("utf-8")
+
+    def get_ranges(self, file_size:int) -> typing.List[typing.Tuple[int, int]]:
+        """(offset, length) of each block of a file"""
+        return [(offset, min(self.block_size, file_size - offset)) for offset in range(0, file_size, self.block_size)]
+
+    def copy(self, target_url:str, source_url:str, file_size:int) -> int:
+        """
+        Copy the source to the target as blocks staged from the source URL.
+
+        Parameters:
+        target_url:
+            Signed URL of the target blob
+        source_url:
+            SAS URL of the source the target account can read
+        file_size:
+            Size of the source in bytes
+
+        Returns:
+            Number of blocks committed
+        """
+        target_blob = BlobClient.from_blob_url(target_url)
+
+        def stage(index:int, offset:int, length:int) -> None:
+            target_blob.stage_block_from_url(
+                BlockTransfer.get_block_id(index),
+                source_url,
+                source_offset=offset,
+                source_length=length)
+
+        return self._transfer(target_blob, int(file_size), stage)
+
+    def relay(self, target_url:str, source_url:str, file_size:int) -> int:
+        """
+        Copy the source to the target by downloading ranges of the source file share
+        and staging them on the target from memory.
+
+        Parameters:
+        target_url:
+            Signed URL of the target blob
+        source_url:
+            SAS URL of the source file in the file share
+        file_size:
+            Size of the source in bytes, 0 reads it from the source
+
+        Returns:
+            Number of blocks committed
+        """
+        target_blob = BlobClient.from_blob_url(target_url)
+        source_file = ShareFileClient.from_file_url(source_url)
+        if not file_size:
+            file_size = source_file.get_file_properties().size
+
+        def stage(index:int, offset:int, length:int) -> None:
+            if self.shaper:
+                self.shaper.ingress(length)
+            data = source_file.download_file(offset=offset, length=length).readall()
+            if self.shaper:
+                self.shaper.egress(len(data))
+            target_blob.stage_block(BlockTransfer.get_block_id(index), data, length=len(data))
+
+        return self._transfer(target_blob, int(file_size), stage)
+
+    def _transfer(self, target_blob:BlobClient, file_size:int, stage:typing.Callable[[int, int, int], None]) -> int:
+        """Stage every range of the file with up to max_concurrency at once, then commit"""
+        ranges = self.get_ranges(file_size)
+        if not len(ranges):
+            target_blob.upload_blob(b"", blob_type="BlockBlob", overwrite=True)
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(ranges))) as executor:
+            # list() so the first failure is raised here
+            list(executor.map(lambda x: stage(x, *ranges[x]), range(len(ranges))))
+
+        target_blob.commit_block_list([BlobBlock(block_id=BlockTransfer.get_block_id(x)) for x in range(len(ranges))])
+        return len(ranges)
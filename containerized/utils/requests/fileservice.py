@@ -4,10 +4,15 @@
 import os
 import requests
 import time
+import multiprocessing
 from utils.log.logutil import LogBase, Logger
 from utils.configuration.configutil import Config
 from utils.requests.retryrequest import RequestsRetryCommand, RetryRequestResponse
+from utils.requests.blocktransfer import BlockTransfer
+from utils.executor.lanes import ExecutionLane
+from utils.requests.shaper import BandwidthShaper
 from azure.storage.blob import BlobClient
+from azure.core.exceptions import HttpResponseError
 
 class UploadUrl:
     """
@@ -47,6 +52,11 @@ class FileRequests(LogBase):
         super().__init__("FileRequests", configuration.mounted_file_share_name, configuration.log_identity, True)
         self.configuration:Config = configuration
         self.token:str = access_token
+        # Shared network limit for the container, None when unlimited
+        self.shaper:BandwidthShaper = BandwidthShaper.get_shaper(
+            configuration.log_identity,
+            configuration.shaper_bytes_per_second,
+            configuration.shaper_control_share)
 
     def get_upload_url(self) -> FileUploadUrlResponse:
         """
@@ -61,7 +71,8 @@ class FileRequests(LogBase):
         response:RetryRequestResponse = RequestsRetryCommand.make_request(
             requests.get,
             url,
-            headers=headers
+            headers=headers,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
@@ -81,14 +92,25 @@ class FileRequests(LogBase):
 
         return FileUploadUrlResponse(return_value, response)
 
-    def transfer_file(self, file_size_mb:int, url:UploadUrl, sas_url:str) -> bool:
+    def transfer_file(self, file_size_mb:int, url:UploadUrl, sas_url:str, file_size:int = 0) -> bool:
         """
         Transfer a file from one Azure Storage Account location (url.SignedUrl - OSDU) to 
         another location (sas_url)
 
-        The SAS Url from OSDU does not allow us to query the blob properties, so we have to 
-        make an assumption that we can transfer an MB in 1 second. In reality, the caller is
-        assuming 2MBS. Best shot, but probably should review. 
+        With transfer_mode copy (the default) the storage service copies the file. Files 
+        of at least transfer_block_threshold bytes are copied as blocks staged in parallel 
+        and committed, the blob is complete when this returns. If the target will not 
+        accept staged blocks, and for smaller files, a single whole blob copy is started 
+        instead.
+
+        With transfer_mode relay the file is streamed through this container, ranges are
+        downloaded from the source share and staged on the target from memory. Use it 
+        when the OSDU storage can not reach the source. transfer_mode auto copies and 
+        relays any file the block copy fails on.
+
+        The SAS Url from OSDU does not allow us to query the blob properties, so for a whole
+        blob copy we have to make an assumption that we can transfer an MB in 1 second. In 
+        reality, the caller is assuming 2MBS. Best shot, but probably should review. 
 
         Parameters:
         file_size_mb:
@@ -97,10 +119,37 @@ class FileRequests(LogBase):
             retrieved from getUploadUrl
         sas_url: 
             the blob to move
+        file_size:
+            Size of the file in bytes, 0 if not known which always uses a whole blob copy
 
         Returns:
             True
         """
+        logger:Logger = self.get_logger()
+
+        block_transfer = BlockTransfer(
+            self.configuration.transfer_block_size, 
+            self.configuration.transfer_block_concurrency,
+            self.shaper)
+
+        mode = self.configuration.transfer_mode
+        if mode == "relay":
+            blocks = self._get_relay_transfer().relay(url.SignedURL, sas_url, file_size)
+            logger.debug(f"Relay of {file_size} bytes in {blocks} blocks")
+            return True
+
+        threshold = self.configuration.transfer_block_threshold
+        if file_size and ((threshold and int(file_size) >= threshold) or mode == "auto"):
+            try:
+                blocks = block_transfer.copy(url.SignedURL, sas_url, file_size)
+                logger.debug(f"Block copy of {file_size} bytes in {blocks} blocks")
+                return True
+            except HttpResponseError as ex:
+                if mode == "auto":
+                    logger.warn(f"Block copy failed, relaying the file : {ex.status_code} {ex.reason}")
+                    self._get_relay_transfer().relay(url.SignedURL, sas_url, file_size)
+                    return True
+                logger.warn(f"Block copy not possible, using whole blob copy : {ex.status_code} {ex.reason}")
 
         # Get blob client on target
         target_blob = BlobClient.from_blob_url(url.SignedURL)
@@ -116,6 +165,22 @@ class FileRequests(LogBase):
 
         return True
 
+    def _get_relay_transfer(self) -> BlockTransfer:
+        """
+        BlockTransfer for relaying, sized so every workload process relaying at once 
+        holds at most transfer_relay_buffer bytes of blocks between them.
+        """
+        processes = int(self.configuration.batch_multiplier) * multiprocessing.cpu_count()
+        if self.configuration.execution_lanes:
+            processes = sum([x.max_workers for x in ExecutionLane.parse(self.configuration.execution_lanes)])
+
+        return BlockTransfer.get_relay_transfer(
+            self.configuration.transfer_relay_buffer,
+            processes,
+            self.configuration.transfer_block_size,
+            self.configuration.transfer_block_concurrency,
+            self.shaper)
+
     def upload_file(self, url:UploadUrl, file_path:str) -> bool:
         """
         Upload a local file with a signed OSDU URL from a local file. 
@@ -164,7 +229,8 @@ class FileRequests(LogBase):
             requests.post,
             url,
             headers=headers,
-            json=metadata
+            json=metadata,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
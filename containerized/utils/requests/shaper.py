@@ -0,0 +1,109 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import time
+import struct
+import tempfile
+
+class TokenBucket:
+    """
+    Byte rate token bucket shared by every process in the container.
+
+    The bucket state (tokens, last refill time) lives in a small file in the temp
+    directory guarded by a file lock, so joblib/loky workers that are started fresh
+    share it without anything being inherited. A bucket pickles as it's settings and
+    re-opens the file in the worker.
+
+    A caller takes what it needs even when that puts the bucket in debt and then
+    sleeps the debt off, so a block larger than the burst still goes through at the
+    bucket rate.
+
+    File locking is POSIX only, fcntl is imported the first time a bucket with a rate
+    is used so an unlimited shaper (or none at all) works on any platform.
+    """
+    STATE = struct.Struct("dd")
+
+    def __init__(self, name:str, rate:float, burst:float = None):
+        self.name = name
+        # Bytes per second, 0 or less is unlimited
+        self.rate = float(rate)
+        # Most tokens that build up while idle, a second of rate by default
+        self.burst = float(burst) if burst else self.rate
+        self.path = os.path.join(tempfile.gettempdir(), "{}.bucket".format(name))
+        self._fd:int = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_fd"] = None
+        return state
+
+    def acquire(self, amount:int) -> float:
+        """
+        Take amount bytes from the bucket, waiting until they are available.
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self.rate <= 0 or amount <= 0:
+            return 0.0
+
+        # Only needed once there is a rate to enforce
+        import fcntl
+
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            now = time.time()
+            state = os.pread(self._fd, TokenBucket.STATE.size, 0)
+            tokens, last = TokenBucket.STATE.unpack(state) if len(state) == TokenBucket.STATE.size else (self.burst, now)
+            tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate) - amount
+            os.pwrite(self._fd, TokenBucket.STATE.pack(tokens, now), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        wait = -tokens / self.rate if tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class BandwidthShaper:
+    """
+    Limits the network use of the container to bytes_per_second in each direction,
+    with control_share of it reserved for control plane calls (OSDU API requests) so
+    file transfers can never starve them.
+
+    egress - file data sent
+    ingress - file data received
+    control - request and response bodies of API calls
+
+    A control_share of 0 leaves API calls unshaped.
+    """
+    # Most of the bandwidth that can be held back for control plane calls
+    CONTROL_SHARE_MAX = 0.5
+
+    def __init__(self, name:str, bytes_per_second:int, control_share:float):
+        control_rate = float(bytes_per_second) * min(max(float(control_share), 0.0), BandwidthShaper.CONTROL_SHARE_MAX)
+        data_rate = float(bytes_per_second) - control_rate
+
+        self.egress_bucket = TokenBucket("{}-egress".format(name), data_rate)
+        self.ingress_bucket = TokenBucket("{}-ingress".format(name), data_rate)
+        self.control_bucket = TokenBucket("{}-control".format(name), control_rate)
+
+    @staticmethod
+    def get_shaper(name:str, bytes_per_second:int, control_share:float) -> object:
+        """Shaper for the settings, None when bytes_per_second is 0 (unlimited)"""
+        if not bytes_per_second or int(bytes_per_second) <= 0:
+            return None
+        return BandwidthShaper("shaper-{}".format(name), int(bytes_per_second), control_share)
+
+    def egress(self, amount:int) -> float:
+        return self.egress_bucket.acquire(amount)
+
+    def ingress(self, amount:int) -> float:
+        return self.ingress_bucket.acquire(amount)
+
+    def control(self, amount:int) -> float:
+        return self.control_bucket.acquire(amount)
@@ -6,6 +6,7 @@ import typing
 from utils.log.logutil import LogBase, Logger
 from utils.configuration.configutil import Config
 from utils.requests.retryrequest import RequestsRetryCommand, RetryRequestResponse
+from utils.requests.shaper import BandwidthShaper
 
 
 class StorageFileVersionResponse:
@@ -26,6 +27,11 @@ class StorageRequests(LogBase):
         super().__init__("StorageRequests", configuration.mounted_file_share_name, configuration.log_identity, True)
         self.configuration = configuration
         self.token = access_token
+        # Shared network limit for the container, None when unlimited
+        self.shaper:BandwidthShaper = BandwidthShaper.get_shaper(
+            configuration.log_identity,
+            configuration.shaper_bytes_per_second,
+            configuration.shaper_control_share)
 
     def get_file_versions(self, file_identifier:str) -> StorageFileVersionResponse:
         """
@@ -44,7 +50,8 @@ class StorageRequests(LogBase):
         response:RetryRequestResponse = RequestsRetryCommand.make_request(
             requests.get,
             url,
-            headers=headers
+            headers=headers,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
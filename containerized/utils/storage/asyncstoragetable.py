@@ -0,0 +1,143 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import typing
+import asyncio
+from utils.storage.record import Record
+from utils.storage.storagetable import AzureTableStoreUtil
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import UpdateMode
+from azure.data.tables.aio import TableClient as AioTableClient
+
+class AsyncAzureTableStoreUtil(AzureTableStoreUtil):
+    """
+    Azure Storage Table record store that runs the bulk calls (get, upsert and delete)
+    on the SDK aio clients. A single process keeps up to `concurrency` table
+    operations in flight instead of one joblib worker process per operation.
+
+    Single record calls are inherited from AzureTableStoreUtil.
+    """
+    # Bulk calls run concurrently in this process
+    concurrent_bulk = True
+
+    def __init__(self, account_name:str, account_key:str, pending_shards:int = 0, concurrency:int = 64):
+        super().__init__(account_name, account_key, pending_shards)
+        # Maximum table operations in flight at one time
+        self.concurrency:int = max(1, int(concurrency))
+
+    def get_records(self, table_name:str, row_keys:typing.List[str], partition_key:str = None) -> typing.List[Record]:
+        """
+        Get many records by RowKey. With a partition key these are point reads,
+        otherwise a RowKey query per record. The returned list lines up with
+        row_keys and holds None for any record that was not found.
+
+        Params:
+        table_name    - required: Yes  Storage Table to search
+        row_keys      - required: Yes  RowKeys of the records to find
+        partition_key - required: No   Partition the records are in
+        """
+        async def get_single(table_client:AioTableClient, row_key:str) -> Record:
+            entity = None
+            if partition_key:
+                try:
+                    entity = await table_client.get_entity(partition_key=partition_key, row_key=row_key)
+                except ResourceNotFoundError:
+                    return None
+            else:
+                query_filter = AzureTableStoreUtil._get_query_filter_id(row_key)
+                async for result in table_client.query_entities(query_filter):
+                    entity = result
+                    break
+
+            if entity is None:
+                return None
+            return Record.from_entity(table_name, AzureTableStoreUtil._normalize_entity(entity))
+
+        results = asyncio.run(self._gather(table_name, get_single, row_keys))
+
+        return_records = []
+        for idx in range(len(results)):
+            if isinstance(results[idx], Exception):
+                print("Record lookup failed - {}".format(row_keys[idx]))
+                print(str(results[idx]))
+                return_records.append(None)
+            else:
+                return_records.append(results[idx])
+
+        return return_records
+
+    def upsert_records(self, table_name:str, records:typing.List[Record]) -> None:
+        """
+        Replace many records in the storage table concurrently, then clear the
+        processed ones from the pending index.
+
+        Params:
+        table_name - required: Yes  Storage Table to update
+        records    - required: Yes  Records to update
+        """
+        async def upsert_single(table_client:AioTableClient, record:Record) -> None:
+            await table_client.upsert_entity(mode=UpdateMode.REPLACE, entity=record.get_entity())
+
+        results = asyncio.run(self._gather(table_name, upsert_single, records))
+
+        updated:typing.List[Record] = []
+        for idx in range(len(results)):
+            if isinstance(results[idx], Exception):
+                print("Record update failed - {}".format(records[idx].RowKey))
+                print(str(results[idx]))
+            else:
+                updated.append(records[idx])
+
+        if self.pending_shards:
+            self.remove_pending(table_name, [(x.RowKey, x.PartitionKey) for x in updated if x.processed])
+
+    def delete_records(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
+        """
+        Delete records from a table concurrently
+
+        Parameters:
+        table_name - name of table to remove.
+        records - List of tuples that are (RowKey,PartitionKey)
+        """
+        async def delete_single(table_client:AioTableClient, pair:typing.Tuple[str,str]) -> None:
+            await table_client.delete_entity(row_key=pair[0], partition_key=pair[1])
+
+        results = asyncio.run(self._gather(table_name, delete_single, records))
+        for idx in range(len(results)):
+            if isinstance(results[idx], Exception) and not isinstance(results[idx], ResourceNotFoundError):
+                print("Record delete failed - {}".format(records[idx][0]))
+                print(str(results[idx]))
+
+        if self.pending_shards:
+            self.remove_pending(table_name, records)
+
+    async def _gather(self, table_name:str, operation:typing.Callable, items:list) -> list:
+        """
+        Run an async operation for every item with at most self.concurrency in flight
+        on a single table client. A fixed set of workers pull the next item as soon
+        as they finish one, so a slow call never holds up the rest.
+
+        Parameters:
+        table_name - Table to open the client on
+        operation - async function taking (table_client, item)
+        items - Items to run the operation over
+
+        Returns:
+        Results in the same order as items, exceptions are returned, not raised.
+        """
+        return_results = [None] * len(items)
+        positions = iter(range(len(items)))
+
+        async with AioTableClient.from_connection_string(conn_str=self.connection_string, table_name=table_name) as table_client:
+
+            async def worker():
+                # Workers share one iterator, safe as they all run on this event loop
+                for idx in positions:
+                    try:
+                        return_results[idx] = await operation(table_client, items[idx])
+                    except Exception as ex:
+                        return_results[idx] = ex
+
+            await asyncio.gather(*[worker() for _ in range(min(self.concurrency, len(items)))])
+
+        return return_results
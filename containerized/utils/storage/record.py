@@ -2,15 +2,33 @@
 # Copyright (c) Microsoft Corporation.
 ##########################################################
 import uuid
+import typing
+from array import array
 
 class Record:
     """
-    Storage Table record per file to upload. 
+    Storage Table record per file to upload.
     """
-    def __init__(self, partition_key:str):
+    # Fields stored in the table, in entity order.
+    FIELDS = (
+        "PartitionKey",
+        "RowKey",
+        "processed_time",
+        "code",
+        "file_name",
+        "file_size",
+        "source_sas",
+        "metadata",
+        "container_id",
+        "meta_id",
+        "processed"
+    )
+    __slots__ = ("table_name",) + FIELDS
+
+    def __init__(self, partition_key:str, row_key:str = None):
         self.table_name = None
         self.PartitionKey = partition_key
-        self.RowKey = str(uuid.uuid4())
+        self.RowKey = row_key if row_key is not None else str(uuid.uuid4())
         # Timestamp when the file was processed
         self.processed_time = ""
         # Status code if the processing failed
@@ -32,31 +50,237 @@ class Record:
 
     def get_entity(self):
         """
-        Entity is everyting in self.__dict__ EXCEPT the 
+        Entity is every field in Record.FIELDS, which is everything EXCEPT the
         table name. This is used to pass to the storage API for creating
-        or updating a table record. 
+        or updating a table record.
         """
-        entity = {}
-        for prop in self.__dict__:
-            if prop != 'table_name':
-                entity[prop] = self.__dict__[prop]
-
-        return entity
+        return {field: getattr(self, field) for field in Record.FIELDS}
 
     @staticmethod
     def from_entity(table:str, obj:dict) -> object:
         """
         Create an instance of Record from a dictionary of data retrieved
-        from the table storage API
+        from the table storage API. Properties that are not a Record field
+        are ignored.
         """
 
         record = obj
         if isinstance(record,list):
             record = record[0]
 
-        return_obj = Record(None)
+        return_obj = Record(None, "")
         return_obj.table_name = table
 
         for val in record:
-            setattr(return_obj, val, record[val])
-        return return_obj
\ No newline at end of file
+            if val in Record.FIELDS:
+                setattr(return_obj, val, record[val])
+        return return_obj
+
+class StringPool:
+    """
+    Interns strings into a list so columns can hold small integer ids for values
+    that repeat heavily, such as directories and SAS tokens.
+    """
+    def __init__(self):
+        self.values:typing.List[str] = []
+        self._ids:typing.Dict[str, int] = {}
+
+    def __getstate__(self):
+        # The lookup is rebuilt on demand, no need to ship it to workers
+        return {"values" : self.values}
+
+    def __setstate__(self, state):
+        self.values = state["values"]
+        self._ids = None
+
+    def add(self, value:str) -> int:
+        if self._ids is None:
+            self._ids = {v: i for i, v in enumerate(self.values)}
+
+        if value not in self._ids:
+            self._ids[value] = len(self.values)
+            self.values.append(value)
+        return self._ids[value]
+
+    def get(self, value_id:int) -> str:
+        return self.values[value_id]
+
+class RecordBatch:
+    """
+    Columnar collection of Records. Numbers and flags are held in arrays and
+    paths, URLs and the other repeating values are split into an interned prefix
+    and a leaf, so a batch of hundreds of thousands of records takes a fraction
+    of the memory of a list of Record objects and pickles to workers as a handful
+    of arrays.
+
+    Indexing or iterating a batch returns Record objects, slicing returns a new
+    RecordBatch.
+    """
+    # Metadata files are named after the record RowKey by the scan
+    METADATA_LEAF = "{}.json"
+
+    def __init__(self, table_name:str = None):
+        self.table_name = table_name
+        self._pool = StringPool()
+        # Columns, one entry per record
+        self._partition = array("l")
+        self._row_key:typing.List[str] = []
+        # Held as given (datetime or string, int or string code) so they round trip
+        self._processed_time:typing.List[typing.Any] = []
+        self._code:typing.List[typing.Any] = []
+        self._file_dir = array("l")
+        self._file_leaf:typing.List[str] = []
+        self._file_size = array("q")
+        self._sas_dir = array("l")
+        self._sas_leaf:typing.List[typing.Optional[str]] = []
+        self._sas_query = array("l")
+        self._metadata_dir = array("l")
+        self._metadata_leaf:typing.List[typing.Optional[str]] = []
+        self._container_id = array("l")
+        self._meta_id:typing.List[str] = []
+        self._processed = array("b")
+        # RowKey to position, built on first find()
+        self._positions:typing.Dict[str, int] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_positions"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self._row_key)
+
+    def __iter__(self) -> typing.Iterator[Record]:
+        for idx in range(len(self)):
+            yield self._get_record(idx)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return_batch = RecordBatch(self.table_name)
+            for pos in range(*idx.indices(len(self))):
+                return_batch.append(self._get_record(pos))
+            return return_batch
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("RecordBatch index out of range")
+        return self._get_record(idx)
+
+    def append(self, record:Record) -> None:
+        """
+        Add a record to the end of the batch.
+        """
+        if self._positions is not None:
+            self._positions[record.RowKey] = len(self)
+
+        self._partition.append(self._pool.add(record.PartitionKey or ""))
+        self._row_key.append(record.RowKey)
+        self._processed_time.append(record.processed_time)
+        self._code.append(record.code)
+
+        file_dir, file_leaf = RecordBatch._split(record.file_name or "")
+        self._file_dir.append(self._pool.add(file_dir))
+        self._file_leaf.append(file_leaf)
+
+        self._file_size.append(int(record.file_size) if record.file_size else 0)
+
+        sas = record.source_sas or ""
+        sas_query = ""
+        if "?" in sas:
+            sas, sas_query = sas.split("?", 1)
+            sas_query = "?" + sas_query
+        # Leaves that can be derived (URL leaf is the file name, metadata is the
+        # RowKey) are stored as None.
+        sas_dir, sas_leaf = RecordBatch._split(sas)
+        self._sas_dir.append(self._pool.add(sas_dir))
+        self._sas_leaf.append(None if sas_leaf == file_leaf else sas_leaf)
+        self._sas_query.append(self._pool.add(sas_query))
+
+        metadata_dir, metadata_leaf = RecordBatch._split(record.metadata or "")
+        self._metadata_dir.append(self._pool.add(metadata_dir))
+        self._metadata_leaf.append(None if metadata_leaf == RecordBatch.METADATA_LEAF.format(record.RowKey) else metadata_leaf)
+
+        self._container_id.append(self._pool.add(record.container_id or ""))
+        self._meta_id.append(record.meta_id or "")
+        self._processed.append(1 if record.processed else 0)
+
+    def extend(self, records:typing.Iterable[Record]) -> None:
+        """
+        Add a series of records to the end of the batch.
+        """
+        for record in records:
+            self.append(record)
+
+    def find(self, row_key:str) -> Record:
+        """
+        Find a record by it's RowKey, returns None if it is not in the batch.
+        """
+        if self._positions is None:
+            self._positions = {key: idx for idx, key in enumerate(self._row_key)}
+
+        if row_key in self._positions:
+            return self._get_record(self._positions[row_key])
+        return None
+
+    def get_entities(self) -> typing.Generator[dict, None, None]:
+        """
+        Get every record in the batch as a table entity.
+        """
+        for idx in range(len(self)):
+            yield self._get_record(idx).get_entity()
+
+    @staticmethod
+    def from_entities(table:str, entities:typing.Iterable[dict]) -> object:
+        """
+        Create a RecordBatch from dictionaries retrieved from the table storage API.
+        """
+        return_batch = RecordBatch(table)
+        for entity in entities:
+            return_batch.append(Record.from_entity(table, entity))
+        return return_batch
+
+    @staticmethod
+    def from_records(table:str, records:typing.Iterable[Record]) -> object:
+        """
+        Create a RecordBatch from a series of Record objects.
+        """
+        return_batch = RecordBatch(table)
+        return_batch.extend(records)
+        return return_batch
+
+    def _get_record(self, idx:int) -> Record:
+        """
+        Rebuild the Record at a position in the batch.
+        """
+        return_obj = Record(self._pool.get(self._partition[idx]), self._row_key[idx])
+        return_obj.table_name = self.table_name
+        return_obj.processed_time = self._processed_time[idx]
+        return_obj.code = self._code[idx]
+        return_obj.file_name = self._pool.get(self._file_dir[idx]) + self._file_leaf[idx]
+        return_obj.file_size = self._file_size[idx]
+        sas_leaf = self._sas_leaf[idx]
+        if sas_leaf is None:
+            sas_leaf = self._file_leaf[idx]
+        return_obj.source_sas = "{}{}{}".format(
+            self._pool.get(self._sas_dir[idx]),
+            sas_leaf,
+            self._pool.get(self._sas_query[idx]))
+
+        metadata_leaf = self._metadata_leaf[idx]
+        if metadata_leaf is None:
+            metadata_leaf = RecordBatch.METADATA_LEAF.format(self._row_key[idx])
+        return_obj.metadata = self._pool.get(self._metadata_dir[idx]) + metadata_leaf
+        return_obj.container_id = self._pool.get(self._container_id[idx])
+        return_obj.meta_id = self._meta_id[idx]
+        return_obj.processed = self._processed[idx] == 1
+        return return_obj
+
+    @staticmethod
+    def _split(value:str) -> typing.Tuple[str, str]:
+        """
+        Split a path or URL into the prefix up to and including the last / and
+        the leaf after it.
+        """
+        idx = value.rfind("/")
+        return value[:idx + 1], value[idx + 1:]
@@ -0,0 +1,193 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import abc
+import typing
+from utils.storage.record import Record
+
+class TablePage:
+    """
+    A single page of results from a paged table query. The continuation token
+    is a small dictionary that can be persisted (JSON) and handed back to the
+    query to resume on the following page. A token of None means there are no
+    more pages.
+    """
+    def __init__(self, entities:typing.List[dict], continuation_token:dict):
+        # Entities on this page, only the selected properties are present
+        self.entities:typing.List[dict] = entities
+        # Token to get the page AFTER this one
+        self.continuation_token:dict = continuation_token
+
+class RecordStore(abc.ABC):
+    """
+    Interface for the store that tracks a Record per file through the load. Actions
+    only talk to this interface so the ledger can be an Azure Storage Table or a
+    local database.
+
+    Implementations that keep a separate pending index set pending_shards to a
+    non zero value, otherwise remaining work is found with iterate_unprocessed.
+    Every abstract method must be implemented, a store missing one fails when it is
+    created rather than part way through a run.
+    """
+    # Number of pending index shards, 0 when there is no separate index
+    pending_shards:int = 0
+    # True when the bulk calls (get_records, upsert_records, delete_records) work
+    # on many records concurrently or in one transaction, and should be preferred
+    # over fanning single record calls out to worker processes.
+    concurrent_bulk:bool = False
+
+    def search_unprocessed(self, table_name:str) -> typing.List[Record]:
+        """
+        Search the table for all records that are not processed yet.
+        """
+        return_records = []
+        for page in self.iterate_unprocessed(table_name):
+            for raw in page.entities:
+                return_records.append(Record.from_entity(table_name, raw))
+
+        return return_records
+
+    @abc.abstractmethod
+    def iterate_unprocessed(
+        self,
+        table_name:str,
+        select:typing.List[str] = None,
+        page_size:int = None,
+        continuation_token:dict = None
+        ) -> typing.Generator[TablePage, None, None]:
+        """
+        Page through all records that are not processed yet.
+        """
+        pass
+
+    def iterate_pending(
+        self,
+        table_name:str,
+        partition_key:str,
+        page_size:int = None
+        ) -> typing.Generator[TablePage, None, None]:
+        """
+        Page through the pending index for a record partition. A store without a
+        pending index pages through the unprocessed records instead.
+        """
+        yield from self.iterate_unprocessed(table_name, select=["RowKey", "file_size"], page_size=page_size)
+
+    def ensure_pending_index(self, table_name:str, partition_key:str, page_size:int = None) -> bool:
+        """
+        Make sure the pending index exists, returns True if it had to be built.
+        """
+        return False
+
+    def add_pending(self, table_name:str, records:typing.List[Record]) -> None:
+        """
+        Add records to the pending index.
+        """
+        pass
+
+    def remove_pending(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
+        """
+        Remove (RowKey,PartitionKey) pairs from the pending index.
+        """
+        pass
+
+    @abc.abstractmethod
+    def search_table_id(self, table_name:str, recordid:str) -> typing.List[Record]:
+        """
+        Search the table for a specific record (RowKey).
+        """
+        pass
+
+    def get_records(self, table_name:str, row_keys:typing.List[str], partition_key:str = None) -> typing.List[Record]:
+        """
+        Get many records by RowKey. The returned list lines up with row_keys and 
+        holds None for any record that was not found.
+        """
+        return_records = []
+        for row_key in row_keys:
+            records = self.search_table_id(table_name, row_key)
+            return_records.append(records[0] if len(records) else None)
+        return return_records
+
+    @abc.abstractmethod
+    def search_table_filename(self, table_name:str, file_name:str) -> typing.List[Record]:
+        """
+        Search the table for a specific record by file name.
+        """
+        pass
+
+    @abc.abstractmethod
+    def add_record(self, table_name:str, entity:Record) -> None:
+        """
+        Add a new record to the table.
+        """
+        pass
+
+    @abc.abstractmethod
+    def update_record(self, table_name:str, entity:Record) -> None:
+        """
+        Replace a record in the table.
+        """
+        pass
+
+    def upsert_records(self, table_name:str, records:typing.List[Record]) -> None:
+        """
+        Replace many records in the table. Implementations with a bulk path
+        should override this.
+        """
+        for record in records:
+            self.update_record(table_name, record)
+
+    def delete_record(self, table_name:str, row_key:str, partition:str) -> None:
+        """
+        Delete a record from the table.
+        """
+        self.delete_records(table_name, [(row_key, partition)])
+
+    @abc.abstractmethod
+    def delete_records(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
+        """
+        Delete (RowKey,PartitionKey) pairs from the table.
+        """
+        pass
+
+class RecordStoreFactory:
+    """
+    Creates the RecordStore identified in the configuration. Implementations are
+    imported on demand so a local store does not need the Azure SDK.
+    """
+    AZURE = "azure"
+    SQLITE = "sqlite"
+
+    @staticmethod
+    def get_store(configuration) -> RecordStore:
+        """
+        Get the record store selected with configuration.record_store
+
+        Parameters:
+
+        configuration:
+            Instance of Config
+
+        Returns:
+            Instance of RecordStore
+        """
+        store_type = str(configuration.record_store).lower()
+
+        if store_type == RecordStoreFactory.SQLITE:
+            from utils.storage.sqlitestore import SqliteRecordStore
+            return SqliteRecordStore(configuration.record_store_path)
+        elif store_type == RecordStoreFactory.AZURE and configuration.table_concurrency > 0:
+            from utils.storage.asyncstoragetable import AsyncAzureTableStoreUtil
+            return AsyncAzureTableStoreUtil(
+                configuration.record_account,
+                configuration.record_account_key,
+                configuration.pending_shards,
+                configuration.table_concurrency)
+        elif store_type == RecordStoreFactory.AZURE:
+            from utils.storage.storagetable import AzureTableStoreUtil
+            return AzureTableStoreUtil(
+                configuration.record_account,
+                configuration.record_account_key,
+                configuration.pending_shards)
+
+        raise Exception("Unknown record store - {}".format(configuration.record_store))
@@ -3,6 +3,11 @@
 ##########################################################
 import typing
 import os
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from azure.storage.fileshare import (
     ShareServiceClient, 
@@ -13,16 +18,55 @@ from azure.storage.fileshare import (
     AccountSasPermissions
 )
 from azure.storage.fileshare._models import FileProperties
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+class ShareLocation:
+    """
+    Base URL and SAS token of a share, held once and referenced by every FileDetails
+    listed from it rather than copied into each one.
+    """
+    __slots__ = ("base_url", "sas_token")
+
+    def __init__(self, base_url:str, sas_token:str):
+        self.base_url = base_url
+        self.sas_token = sas_token
+
+    def get_url(self, file_path:str, file_name:str) -> str:
+        """Full SAS URL of a file in the share"""
+        file_url = "{}/{}/{}?{}".format(self.base_url, file_path, file_name, self.sas_token) if file_path \
+            else "{}/{}?{}".format(self.base_url, file_name, self.sas_token)
+
+        # Windows path breaks URL pattern
+        return file_url.replace("\\", "/")
 
 class FileDetails:
-    def __init__(self):
-        self.file_name=None
-        self.file_path=None
-        self.file_url=None
-        self.file_size=0
+    """
+    A file found in a share listing. Kept small as there can be millions of them, the
+    directory path is interned and the SAS URL is only built when asked for through 
+    file_url.
+    """
+    __slots__ = ("file_name", "file_path", "file_size", "last_modified", "etag", "location")
+
+    def __init__(self, location:ShareLocation = None):
+        self.file_name:str = None
+        self.file_path:str = None
+        self.file_size:int = 0
+        # Only populated when the listing asked for extended information
+        self.last_modified = None
+        self.etag:str = None
+        # Share the file was listed from, shared by all files of the listing
+        self.location = location
+
+    @property
+    def file_url(self) -> str:
+        """SAS URL of the file, built on demand"""
+        return self.location.get_url(self.file_path, self.file_name)
 
 class FileShareUtil:
-    def __init__(self, account_name:str, account_key:str, share_name:str):
+    # Seconds a directory known to exist is trusted without asking the service again
+    NAMESPACE_TTL = 300
+
+    def __init__(self, account_name:str, account_key:str, share_name:str, namespace_ttl:int = NAMESPACE_TTL):
         # Storage account with share
         self.account_name = account_name
         # Storage account key 
@@ -51,67 +95,181 @@ class FileShareUtil:
             expiry=datetime.utcnow() + timedelta(hours=24),
             protocol="https"
         )
+        # Shared by every FileDetails listed through this utility
+        self.location = ShareLocation(self.file_url, self.account_sas_token)
+
+        # Directories known to exist, path to the time the entry expires. Shared by
+        # the crawler threads, single dictionary operations are safe under the GIL.
+        self.namespace_ttl = namespace_ttl
+        self._namespace:typing.Dict[str, float] = {}
 
         # self.service:ShareServiceClient = ShareServiceClient.from_connection_string(conn_str=self.connection_str)
 
     # Download see this, we need more information
     # https://docs.microsoft.com/en-us/python/api/overview/azure/storage-file-share-readme?view=azure-python
 
+    def exists(self, directory_path:str) -> bool:
+        """Check if a directory exists with a single properties call, or none at 
+        all if it was seen recently."""
+        path = self._normalize_path(directory_path)
+        if not path or self._is_known(path):
+            return True
+
+        directory_client = ShareDirectoryClient.from_connection_string(
+            conn_str=self.connection_str, 
+            share_name=self.share_name, 
+            directory_path=path)
+        try:
+            directory_client.get_directory_properties()
+        except ResourceNotFoundError:
+            return False
+
+        self._remember(path)
+        return True
+
     def create_directory(self, directory_path:str) -> bool:
         """Creates a directory if not there, return if true means something
-        was created, otherwise it already existed."""
-        path_parts = os.path.split(directory_path)
-        base_path = ""
-        something_created = False
-
-        current_directories = self._list_directories(base_path)
+        was created, otherwise it already existed.
+        
+        Each missing level is created directly, a level that is already there is
+        reported by the service as a conflict, so no directory listings are needed."""
+        path = self._normalize_path(directory_path)
+        if not path or self.exists(path):
+            return False
 
-        if len(path_parts) > 1:
-            if not len(path_parts[0]):
-                path_parts = path_parts[1:]
+        something_created = False
+        base_path = ""
+        for part in path.split("/"):
+            base_path = "{}/{}".format(base_path, part) if base_path else part
+            if self._is_known(base_path):
+                continue
 
-        for path in path_parts:
-            sub_folders = [x.directory_path for x in current_directories]
-            if path not in sub_folders:
-                something_created = True
-                current_client = ShareDirectoryClient.from_connection_string(
-                                    conn_str=self.connection_str, 
-                                    share_name=self.share_name, 
-                                    directory_path=os.path.join(base_path, path))
+            current_client = ShareDirectoryClient.from_connection_string(
+                                conn_str=self.connection_str, 
+                                share_name=self.share_name, 
+                                directory_path=base_path)
+            try:
                 current_client.create_directory()
+                something_created = True
+            except ResourceExistsError:
+                pass
 
-            base_path = os.path.join(base_path, path)
-            current_directories = self._list_directories(base_path)
+            self._remember(base_path)
 
         return something_created
 
-    def list_files(self, directory:str) -> typing.List[FileDetails]:
+    def list_files(self, directory:str, extended_info:bool = False) -> typing.List[FileDetails]:
         """
-        List all of the files in a directory in the file share
+        List all of the files in a directory in the file share, optionally with the
+        last modified and ETag of each file.
         """
         return_list:typing.List[FileDetails] = []
-        content = self._list_content(directory)
+        content = self._list_content(directory, extended_info)
         if content:
             file_list = [x for x in content if not x.is_directory] 
             for share_file in file_list:
-                detail = FileDetails()
-                detail.file_name = share_file.name
-                detail.file_size = share_file.size
-                detail.file_path = directory
-                detail.file_url = os.path.join(
-                    self.file_url, 
-                    detail.file_path,
-                    detail.file_name)
-                detail.file_url += "?{}".format(self.account_sas_token)
-
-                # Windows path breaks URL pattern
-                if "\\" in detail.file_url:
-                    detail.file_url = detail.file_url.replace("\\", "/")
-                
-                return_list.append(detail)
+                return_list.append(self._get_file_details(directory, share_file))
 
         return return_list
 
+    def crawl_files(
+        self, 
+        directory:str, 
+        extensions:typing.List[str] = None, 
+        max_workers:int = 16, 
+        page_size:int = None,
+        name_starts_with:str = None,
+        extended_info:bool = False
+        ) -> typing.Generator[FileDetails, None, None]:
+        """
+        Walk a directory and every directory below it, breadth first, with up to 
+        max_workers directory listings in flight at once. Files are yielded as each 
+        page of a listing arrives so callers can start work while the walk is still
+        in progress.
+
+        Parameters:
+        directory:
+            Directory in the share to start from
+        extensions:
+            Lower case file extensions (no dot) to keep, None keeps every file
+        max_workers:
+            Concurrent directory listings
+        page_size:
+            Entries per listing page, None uses the service default
+        name_starts_with:
+            Server side prefix filter applied to the entries of the starting directory
+        extended_info:
+            Include last modified and ETag of each file in the listing
+
+        Returns:
+            Generator of FileDetails
+        """
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def list_directory(path:str, prefix:str) -> None:
+            # Put (files, directories, error) for each page, then None once the 
+            # directory is complete.
+            try:
+                parent_dir:ShareDirectoryClient = ShareDirectoryClient.from_connection_string(
+                    conn_str=self.connection_str, 
+                    share_name=self.share_name, 
+                    directory_path=path)
+
+                listing_args = {}
+                if extended_info:
+                    listing_args["include"] = ["timestamps", "Etag"]
+                    listing_args["include_extended_info"] = True
+
+                listing = parent_dir.list_directories_and_files(
+                    name_starts_with=prefix, 
+                    results_per_page=page_size, 
+                    **listing_args)
+                for page in listing.by_page():
+                    if stop.is_set():
+                        break
+
+                    files:typing.List[FileDetails] = []
+                    directories:typing.List[str] = []
+                    for item in page:
+                        if item.is_directory:
+                            directories.append("{}/{}".format(path, item.name) if path else item.name)
+                        elif extensions is None or item.name.lower().split(".")[-1] in extensions:
+                            files.append(self._get_file_details(path, item))
+                    results.put((files, directories, None))
+
+                # Listing worked so the directory exists, saves an exists() call later
+                self._remember(path)
+            except Exception as ex:
+                results.put(([], [], ex))
+            finally:
+                results.put(None)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            executor.submit(list_directory, directory, name_starts_with)
+            outstanding = 1
+
+            while outstanding:
+                item = results.get()
+                if item is None:
+                    outstanding -= 1
+                    continue
+
+                files, directories, error = item
+                if error:
+                    print("Directory listing failed - {}".format(str(error)))
+
+                for sub_directory in directories:
+                    executor.submit(list_directory, sub_directory, None)
+                    outstanding += 1
+
+                yield from files
+        finally:
+            # Caller may stop early, don't keep walking the tree
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def upload_file(self, folder:str, file:str) -> bool:
         raw_file_name = os.path.split(file)[-1]
 
@@ -144,30 +302,43 @@ class FileShareUtil:
             data = file_client.download_file()
             data.readinto(file_handle)
 
-    def _list_directories(self, directory) -> typing.List[ShareDirectoryClient]:
-        """Get a list of just directories."""
-        return_content:typing.List[ShareDirectoryClient] = []
-        content = self._list_content(directory)
-        directories = [x.name for x in content if x.is_directory]
+    def _get_file_details(self, directory:str, share_file:FileProperties) -> FileDetails:
+        """Build the FileDetails for a file listed in a directory"""
+        detail = FileDetails(self.location)
+        detail.file_name = share_file.name
+        detail.file_size = share_file.size
+        # Every file of a directory shares the one path string
+        detail.file_path = sys.intern(directory) if directory else directory
+        detail.last_modified = share_file.get("last_modified")
+        detail.etag = share_file.get("etag")
+        return detail
 
-        for dir_name in directories:
-            return_content.append(
-                ShareDirectoryClient.from_connection_string(
-                    conn_str=self.connection_str, 
-                    share_name=self.share_name, 
-                    directory_path=dir_name)
-            )
-        
-        return return_content
+    def _normalize_path(self, directory_path:str) -> str:
+        """Share path with / separators and no leading, trailing or repeated separators"""
+        parts = directory_path.replace("\\", "/").split("/") if directory_path else []
+        return "/".join([x for x in parts if x])
+
+    def _is_known(self, path:str) -> bool:
+        """True if the directory was seen to exist within the namespace TTL"""
+        expires = self._namespace.get(path)
+        return expires is not None and expires > time.monotonic()
 
-    def _list_content(self, directory) -> typing.List[FileProperties]:
+    def _remember(self, path:str) -> None:
+        """Cache that a directory exists, and so do all of it's parents"""
+        path = self._normalize_path(path)
+        expires = time.monotonic() + self.namespace_ttl
+        while path:
+            self._namespace[path] = expires
+            path = path.rpartition("/")[0]
+
+    def _list_content(self, directory, extended_info:bool = False) -> typing.List[FileProperties]:
         """Get a list of directory children and files in a directory"""
         parent_dir:ShareDirectoryClient = ShareDirectoryClient.from_connection_string(
             conn_str=self.connection_str, 
             share_name=self.share_name, 
             directory_path=directory)
         
-        parent_dir.directory_path
-
+        if extended_info:
+            return list(parent_dir.list_directories_and_files(include=["timestamps", "Etag"], include_extended_info=True))
         return list(parent_dir.list_directories_and_files())
 
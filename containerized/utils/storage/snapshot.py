@@ -0,0 +1,113 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import gzip
+import json
+import typing
+import hashlib
+from utils.storage.share import FileDetails, FileShareUtil
+
+class DirectorySnapshot:
+    """
+    Compact record of what a scan saw in each directory of a data_source_map path
+    so the next scan of the same path only registers added or changed files.
+
+    The snapshot is a gzip JSON document kept on the record file share:
+
+        { "directory" : { "file name" : [size, fingerprint] } }
+
+    The fingerprint is a short hash of the last modified time and ETag of the file.
+    A file is only added to the new snapshot once it has been registered, so a file
+    that failed in one scan is picked up again by the next one.
+    """
+    ADDED = "added"
+    CHANGED = "changed"
+    UNCHANGED = "unchanged"
+
+    def __init__(self, path:str):
+        # data_source_map path this snapshot covers
+        self.path = path
+        # Snapshot from the last scan, and the one being built by this scan
+        self.previous:typing.Dict[str, typing.Dict[str, list]] = {}
+        self.current:typing.Dict[str, typing.Dict[str, list]] = {}
+
+    @staticmethod
+    def get_snapshot_name(path:str) -> str:
+        """Name of the snapshot file for a data_source_map path"""
+        safe_name = "".join([x if x.isalnum() or x in "-_" else "_" for x in path.strip("/")])
+        return "{}.json.gz".format(safe_name)
+
+    @staticmethod
+    def load(share_util:FileShareUtil, snapshot_path:str, path:str) -> object:
+        """
+        Load the snapshot for a path from the record share, a path that has not been
+        scanned before gets an empty snapshot and every file is treated as added.
+
+        Parameters:
+        share_util - Record share the snapshots are kept on
+        snapshot_path - Folder on the share holding the snapshots
+        path - data_source_map path being scanned
+        """
+        return_snapshot = DirectorySnapshot(path)
+        snapshot_file = DirectorySnapshot.get_snapshot_name(path)
+        local_folder = "snapshot_download"
+
+        try:
+            share_util.download_file(local_folder, snapshot_path, snapshot_file)
+            with gzip.open(os.path.join(local_folder, snapshot_file), "rt") as snapshot_input:
+                return_snapshot.previous = json.load(snapshot_input)
+        except Exception as ex:
+            print("No snapshot loaded for {} - {}".format(path, str(ex)))
+        finally:
+            if os.path.exists(os.path.join(local_folder, snapshot_file)):
+                os.remove(os.path.join(local_folder, snapshot_file))
+
+        return return_snapshot
+
+    def save(self, share_util:FileShareUtil, snapshot_path:str) -> None:
+        """
+        Upload the snapshot built by this scan to the record share, replacing the
+        previous one.
+        """
+        snapshot_file = DirectorySnapshot.get_snapshot_name(self.path)
+        with gzip.open(snapshot_file, "wt") as snapshot_output:
+            json.dump(self.current, snapshot_output, separators=(",", ":"))
+
+        share_util.create_directory(snapshot_path)
+        share_util.upload_file(snapshot_path, snapshot_file)
+        os.remove(snapshot_file)
+
+    def compare(self, source_file:FileDetails) -> str:
+        """
+        Compare a listed file against the previous snapshot, returns ADDED, CHANGED
+        or UNCHANGED.
+        """
+        entries = self.previous.get(source_file.file_path)
+        if entries is None or source_file.file_name not in entries:
+            return DirectorySnapshot.ADDED
+
+        if entries[source_file.file_name] == self._get_entry(source_file):
+            return DirectorySnapshot.UNCHANGED
+        return DirectorySnapshot.CHANGED
+
+    def record(self, source_file:FileDetails) -> None:
+        """
+        Add a file to the snapshot being built by this scan.
+        """
+        # setdefault so the listing and result threads can both record safely
+        self.current.setdefault(source_file.file_path, {})[source_file.file_name] = self._get_entry(source_file)
+
+    def get_unchanged_directories(self) -> int:
+        """
+        Number of directories in the current snapshot that match the previous one
+        exactly, used for reporting.
+        """
+        return len([x for x in self.current if self.previous.get(x) == self.current[x]])
+
+    def _get_entry(self, source_file:FileDetails) -> list:
+        """Snapshot entry for a file, size and fingerprint of last modified and ETag"""
+        fingerprint = hashlib.blake2b(
+            "{}|{}".format(source_file.last_modified, source_file.etag).encode("utf-8"),
+            digest_size=6).hexdigest()
+        return [int(source_file.file_size), fingerprint]
@@ -0,0 +1,282 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import re
+import typing
+import sqlite3
+from utils.storage.record import Record
+from utils.storage.recordstore import RecordStore, TablePage
+
+class SqliteRecordStore(RecordStore):
+    """
+    Local record store backed by a SQLite database file. Used for local development,
+    benchmarking without network noise and single node loads.
+
+    The database runs in WAL mode so readers do not block the writer, and indexes
+    on file_name and processed keep the scan dedup and the unprocessed lookups
+    from scanning the whole table.
+
+    Connections are opened per process, the store is pickled to joblib workers
+    without one and each worker opens its own on first use.
+    """
+
+    # Column name and SQLite type for each Record field
+    COLUMNS = [
+        ("PartitionKey", "TEXT NOT NULL"),
+        ("RowKey", "TEXT NOT NULL"),
+        ("processed_time", "TEXT"),
+        ("code", "TEXT"),
+        ("file_name", "TEXT"),
+        ("file_size", "INTEGER"),
+        ("source_sas", "TEXT"),
+        ("metadata", "TEXT"),
+        ("container_id", "TEXT"),
+        ("meta_id", "TEXT"),
+        ("processed", "INTEGER NOT NULL DEFAULT 0")
+    ]
+    COLUMN_NAMES = [x[0] for x in COLUMNS]
+    # Table names follow the Azure Storage Table rules
+    TABLE_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9]{2,62}$")
+    # Default page size when none is supplied
+    PAGE_SIZE = 1000
+    # Seconds a writer waits on a locked database before failing
+    BUSY_TIMEOUT = 60.0
+    # Maximum parameters in a single IN (...) lookup
+    LOOKUP_MAX = 500
+    # Bulk calls run as single statements/transactions
+    concurrent_bulk = True
+
+    def __init__(self, db_path:str):
+        # Path to the database file
+        self.db_path = db_path
+        # Per process connection, see _get_connection
+        self._connection:sqlite3.Connection = None
+        self._connection_pid:int = None
+        # Tables already created by this process
+        self._tables:typing.List[str] = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_connection_pid"] = None
+        state["_tables"] = []
+        return state
+
+    def iterate_unprocessed(
+        self,
+        table_name:str,
+        select:typing.List[str] = None,
+        page_size:int = None,
+        continuation_token:dict = None
+        ) -> typing.Generator[TablePage, None, None]:
+        """
+        Page through all records that are not processed yet using keyset paging on
+        (PartitionKey, RowKey). The continuation token has the same shape as the
+        Azure Storage Table token.
+
+        Params:
+        table_name         - required: Yes  Table to search
+        select             - required: No   Columns to return, None returns all
+        page_size          - required: No   Maximum records per page
+        continuation_token - required: No   Token from a previous TablePage to resume from
+
+        Returns:
+        Generator of TablePage objects
+        """
+        columns = self._get_columns(select)
+        page_size = int(page_size) if page_size else SqliteRecordStore.PAGE_SIZE
+        token = continuation_token
+
+        connection = self._get_table(table_name)
+        while True:
+            query = 'SELECT {}, PartitionKey AS _pk, RowKey AS _rk FROM "{}" WHERE processed = 0'.format(
+                ", ".join(columns),
+                table_name)
+            parameters = []
+            if token:
+                query += " AND (PartitionKey, RowKey) > (?, ?)"
+                parameters = [token["PartitionKey"], token["RowKey"]]
+            query += " ORDER BY PartitionKey, RowKey LIMIT ?"
+            parameters.append(page_size)
+
+            rows = connection.execute(query, parameters).fetchall()
+
+            token = None
+            if len(rows) == page_size:
+                token = {"PartitionKey" : rows[-1]["_pk"], "RowKey" : rows[-1]["_rk"]}
+
+            if len(rows):
+                yield TablePage([self._row_to_entity(x, columns) for x in rows], token)
+
+            if token is None:
+                break
+
+    def search_table_id(self, table_name:str, recordid:str) -> typing.List[Record]:
+        """
+        Search the table for a specific record (RowKey).
+        """
+        return self._search(table_name, "RowKey = ?", [recordid])
+
+    def get_records(self, table_name:str, row_keys:typing.List[str], partition_key:str = None) -> typing.List[Record]:
+        """
+        Get many records by RowKey with IN (...) lookups. The returned list lines up
+        with row_keys and holds None for any record that was not found.
+        """
+        found:typing.Dict[str, Record] = {}
+        for idx in range(0, len(row_keys), SqliteRecordStore.LOOKUP_MAX):
+            lookup = row_keys[idx: idx + SqliteRecordStore.LOOKUP_MAX]
+            condition = "RowKey IN ({})".format(", ".join(["?"] * len(lookup)))
+            if partition_key:
+                condition += " AND PartitionKey = ?"
+                lookup = lookup + [partition_key]
+
+            for record in self._search(table_name, condition, lookup):
+                found[record.RowKey] = record
+
+        return [found.get(x) for x in row_keys]
+
+    def search_table_filename(self, table_name:str, file_name:str) -> typing.List[Record]:
+        """
+        Search the table for a specific record by file name.
+        """
+        return self._search(table_name, "file_name = ?", [file_name])
+
+    def add_record(self, table_name:str, entity:Record) -> None:
+        """
+        Add a record to the table, an existing record with the same keys is
+        left as is, matching the create behavior of the storage table.
+        """
+        entity.table_name = table_name
+        connection = self._get_table(table_name)
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT INTO "{}" ({}) VALUES ({})'.format(
+                        table_name,
+                        ", ".join(SqliteRecordStore.COLUMN_NAMES),
+                        ", ".join(["?"] * len(SqliteRecordStore.COLUMN_NAMES))),
+                    self._record_to_row(entity)
+                )
+        except sqlite3.IntegrityError as ex:
+            print("Entity create failed - {}".format(entity.file_name))
+            print(str(ex))
+
+    def update_record(self, table_name:str, entity:Record) -> None:
+        """
+        Replace a record in the table, creating it if not present.
+        """
+        self.upsert_records(table_name, [entity])
+
+    def upsert_records(self, table_name:str, records:typing.List[Record]) -> None:
+        """
+        Replace many records in the table in a single transaction.
+        """
+        connection = self._get_table(table_name)
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(
+                    table_name,
+                    ", ".join(SqliteRecordStore.COLUMN_NAMES),
+                    ", ".join(["?"] * len(SqliteRecordStore.COLUMN_NAMES))),
+                [self._record_to_row(x) for x in records]
+            )
+
+    def delete_records(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
+        """
+        Delete (RowKey,PartitionKey) pairs from the table in a single transaction.
+        """
+        connection = self._get_table(table_name)
+        with connection:
+            connection.executemany(
+                'DELETE FROM "{}" WHERE RowKey = ? AND PartitionKey = ?'.format(table_name),
+                records
+            )
+
+    def _search(self, table_name:str, condition:str, parameters:list) -> typing.List[Record]:
+        """
+        Return the records matching a condition as Record objects.
+        """
+        connection = self._get_table(table_name)
+        rows = connection.execute(
+            'SELECT {} FROM "{}" WHERE {}'.format(
+                ", ".join(SqliteRecordStore.COLUMN_NAMES),
+                table_name,
+                condition),
+            parameters
+        ).fetchall()
+
+        return [Record.from_entity(table_name, self._row_to_entity(x, SqliteRecordStore.COLUMN_NAMES)) for x in rows]
+
+    def _get_columns(self, select:typing.List[str]) -> typing.List[str]:
+        """
+        Validate a projection against the known columns.
+        """
+        if not select:
+            return SqliteRecordStore.COLUMN_NAMES
+
+        for column in select:
+            if column not in SqliteRecordStore.COLUMN_NAMES:
+                raise Exception("Unknown column {}".format(column))
+        return select
+
+    def _record_to_row(self, record:Record) -> tuple:
+        """
+        Flatten a record into the column order of the table.
+        """
+        entity = record.get_entity()
+        row = [entity.get(x) for x in SqliteRecordStore.COLUMN_NAMES]
+        row[SqliteRecordStore.COLUMN_NAMES.index("processed")] = 1 if entity.get("processed") else 0
+        return tuple(row)
+
+    def _row_to_entity(self, row:sqlite3.Row, columns:typing.List[str]) -> dict:
+        """
+        Turn a row into the same dictionary shape the storage table returns.
+        """
+        entity = {}
+        for column in columns:
+            entity[column] = row[column]
+        if "processed" in entity:
+            entity["processed"] = bool(entity["processed"])
+        return entity
+
+    def _get_table(self, table_name:str) -> sqlite3.Connection:
+        """
+        Get the connection for this process and make sure the table and it's
+        indexes exist.
+        """
+        if not SqliteRecordStore.TABLE_NAME.match(table_name):
+            raise Exception("Invalid table name {}".format(table_name))
+
+        connection = self._get_connection()
+        if table_name not in self._tables:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({}, PRIMARY KEY (PartitionKey, RowKey))'.format(
+                    table_name,
+                    ", ".join(["{} {}".format(x[0], x[1]) for x in SqliteRecordStore.COLUMNS])
+                ))
+                connection.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_file_name" ON "{0}" (file_name)'.format(table_name))
+                connection.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_processed" ON "{0}" (processed, PartitionKey, RowKey)'.format(table_name))
+            self._tables.append(table_name)
+
+        return connection
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        Open (once per process) a connection to the database in WAL mode.
+        """
+        if self._connection is None or self._connection_pid != os.getpid():
+            folder = os.path.dirname(self.db_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+
+            connection = sqlite3.connect(self.db_path, timeout=SqliteRecordStore.BUSY_TIMEOUT)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            self._connection = connection
+            self._connection_pid = os.getpid()
+            self._tables = []
+
+        return self._connection
@@ -3,44 +3,97 @@
 ##########################################################
 import typing
 import datetime
+import zlib
 from utils.storage.record import Record
+from utils.storage.recordstore import RecordStore, TablePage
 from azure.data.tables import TableServiceClient, TableClient, UpdateMode
 from azure.data.tables._entity import EntityProperty
 from azure.data.tables._deserialize import TablesEntityDatetime
 
-class AzureTableStoreUtil:
+class AzureTableStoreUtil(RecordStore):
     """
     Class encapsulating the calls to an Azure Storage Table 
     """
 
     CONN_STR = "DefaultEndpointsProtocol=https;AccountName={};AccountKey={};EndpointSuffix=core.windows.net"
-
-    def __init__(self, account_name:str, account_key:str):
+    # Partition of the pending index shards, {record partition}pending{shard}
+    PENDING_PARTITION = "{}pending{}"
+    # Partition/row of the marker entity written once the pending index is built
+    PENDING_MARKER_PARTITION = "{}pendingmeta"
+    PENDING_MARKER_ROW = "index"
+    # Service limit of operations in a single entity group transaction
+    TRANSACTION_MAX = 100
+
+    def __init__(self, account_name:str, account_key:str, pending_shards:int = 0):
         self.connection_string = AzureTableStoreUtil.CONN_STR.format(
             account_name,
             account_key
         )
+        # Number of pending index shards, 0 disables the pending index
+        self.pending_shards:int = int(pending_shards) if pending_shards else 0
+
+    def iterate_unprocessed(
+        self, 
+        table_name:str, 
+        select:typing.List[str] = None, 
+        page_size:int = None, 
+        continuation_token:dict = None
+        ) -> typing.Generator[TablePage, None, None]:
+        """
+        Page through all records that are not processed yet without holding 
+        more than a single page in memory. 
+
+        Params:
+        table_name         - required: Yes  Storage Table to search
+        select             - required: No   Properties to return ($select), None returns all
+        page_size          - required: No   Maximum entities per page, service limit is 1000
+        continuation_token - required: No   Token from a previous TablePage to resume from
+
+        Returns:
+        Generator of TablePage objects
+        """
+        # Make sure the table exists before querying it
+        with self._create_table(table_name):
+            pass
 
-    def search_unprocessed(self, table_name:str) -> typing.List[Record]:
+        query_filter = AzureTableStoreUtil._get_query_filter_unprocessed()
+        yield from self.query_pages(table_name, query_filter, select, page_size, continuation_token)
+
+    def query_pages(
+        self, 
+        table_name:str, 
+        query_filter:str, 
+        select:typing.List[str] = None, 
+        page_size:int = None, 
+        continuation_token:dict = None
+        ) -> typing.Generator[TablePage, None, None]:
         """
-        Search the table for all records that are not processed yet. This will help
-        if we ever need to re-run a container to retry failed records. 
+        Execute a query against the table and yield the results one page at a time.
+
         Params:
-        table_name - required: Yes  Storage Table to search
+        table_name         - required: Yes  Storage Table to search
+        query_filter       - required: Yes  OData filter to execute
+        select             - required: No   Properties to return ($select), None returns all
+        page_size          - required: No   Maximum entities per page, service limit is 1000
+        continuation_token - required: No   Token from a previous TablePage to resume from
 
         Returns:
-        List of Record objects for each record that has not been processed
+        Generator of TablePage objects
         """
-        return_records = []
-        with self._create_table(table_name) as log_table:
-            with self._get_table_client(table_name) as table_client:
-                query_filter = AzureTableStoreUtil._get_query_filter_unprocessed()
+        query_args = {}
+        if select:
+            query_args["select"] = select
+        if page_size:
+            query_args["results_per_page"] = int(page_size)
 
-                raw_records = self._parse_query_results(table_client, query_filter)
-                for raw in raw_records:
-                    return_records.append(Record.from_entity(table_name, raw))
+        with self._get_table_client(table_name) as table_client:
+            pages = table_client.query_entities(query_filter, **query_args).by_page(
+                continuation_token=continuation_token
+            )
 
-        return return_records
+            for page in pages:
+                entities = [AzureTableStoreUtil._normalize_entity(x) for x in page]
+                yield TablePage(entities, pages.continuation_token)
 
     def search_table_id(self, table_name:str, recordid:str) -> typing.List[Record]:
         """
@@ -83,6 +136,118 @@ class AzureTableStoreUtil:
 
         return return_records
 
+    def iterate_pending(
+        self, 
+        table_name:str, 
+        partition_key:str, 
+        page_size:int = None
+        ) -> typing.Generator[TablePage, None, None]:
+        """
+        Page through the pending index for a record partition. Unlike iterate_unprocessed
+        this is a set of partition queries, so the cost follows the amount of remaining
+        work and not the history of the table. 
+
+        Entities on each page carry RowKey (the record id) and file_size. Continuation
+        tokens are scoped to the shard being read.
+
+        Params:
+        table_name    - required: Yes  Storage Table to search
+        partition_key - required: Yes  Partition of the records being tracked
+        page_size     - required: No   Maximum entities per page, service limit is 1000
+
+        Returns:
+        Generator of TablePage objects
+        """
+        for shard in range(self.pending_shards):
+            query_filter = "PartitionKey eq '{}'".format(
+                AzureTableStoreUtil.PENDING_PARTITION.format(partition_key, shard)
+            )
+            yield from self.query_pages(table_name, query_filter, ["RowKey", "file_size"], page_size)
+
+    def ensure_pending_index(self, table_name:str, partition_key:str, page_size:int = None) -> bool:
+        """
+        Make sure the pending index exists for a partition. Tables that were populated
+        before the index was enabled are scanned once, with the old full table query, 
+        to seed the index and a marker entity is written so it never happens again.
+
+        Params:
+        table_name    - required: Yes  Storage Table to search
+        partition_key - required: Yes  Partition of the records being tracked
+        page_size     - required: No   Maximum entities per page when seeding
+
+        Returns:
+        True if the index had to be built, False if it was already there
+        """
+        marker_partition = AzureTableStoreUtil.PENDING_MARKER_PARTITION.format(partition_key)
+
+        with self._create_table(table_name) as table_client:
+            query_filter = "PartitionKey eq '{}' and RowKey eq '{}'".format(
+                marker_partition, 
+                AzureTableStoreUtil.PENDING_MARKER_ROW
+            )
+            if len(self._parse_query_results(table_client, query_filter)):
+                return False
+
+        for page in self.iterate_unprocessed(table_name, ["PartitionKey", "RowKey", "file_size"], page_size):
+            records = [x for x in page.entities if x["PartitionKey"] == partition_key]
+            self.add_pending(table_name, [Record.from_entity(table_name, x) for x in records])
+
+        with self._get_table_client(table_name) as table_client:
+            table_client.upsert_entity(
+                mode=UpdateMode.REPLACE, 
+                entity={
+                    "PartitionKey" : marker_partition,
+                    "RowKey" : AzureTableStoreUtil.PENDING_MARKER_ROW,
+                    "shards" : self.pending_shards
+                }
+            )
+
+        return True
+
+    def add_pending(self, table_name:str, records:typing.List[Record]) -> None:
+        """
+        Add records to the pending index. Entries are grouped by shard and written
+        with entity group transactions of up to TRANSACTION_MAX entries.
+
+        Params:
+        table_name - required: Yes  Storage Table holding the records
+        records    - required: Yes  Records that have work outstanding
+        """
+        if not self.pending_shards:
+            return
+
+        operations = []
+        for record in records:
+            operations.append(("upsert", {
+                "PartitionKey" : self._get_pending_partition(record.PartitionKey, record.RowKey),
+                "RowKey" : record.RowKey,
+                "file_size" : record.file_size
+            }))
+
+        self._submit_pending(table_name, operations)
+
+    def remove_pending(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
+        """
+        Remove records from the pending index. Entries are grouped by shard and removed
+        with entity group transactions of up to TRANSACTION_MAX entries. Entries that 
+        are already gone are ignored.
+
+        Params:
+        table_name - required: Yes  Storage Table holding the records
+        records    - required: Yes  List of tuples that are (RowKey,PartitionKey)
+        """
+        if not self.pending_shards:
+            return
+
+        operations = []
+        for pair in records:
+            operations.append(("delete", {
+                "PartitionKey" : self._get_pending_partition(pair[1], pair[0]),
+                "RowKey" : pair[0]
+            }))
+
+        self._submit_pending(table_name, operations)
+
     def update_record(self, table_name:str, entity:Record) -> None:
         """
         Update a record in the storage table. Creates the table if not already
@@ -97,18 +262,32 @@ class AzureTableStoreUtil:
         with self._get_table_client(table_name) as table_client:
             table_client.upsert_entity(mode=UpdateMode.REPLACE, entity=entity.get_entity())
 
-    def delete_record(self, table_name:str, row_key:str, partition:str) -> None:
+        if self.pending_shards and entity.processed:
+            self.remove_pending(table_name, [(entity.RowKey, entity.PartitionKey)])
+
+    def upsert_records(self, table_name:str, records:typing.List[Record]) -> None:
         """
-        Delete a record from the storage table. 
+        Replace many records in the storage table using entity group transactions
+        of up to TRANSACTION_MAX records per partition.
 
         Params:
-        table_name - required: Yes  Storage Table to search
-        row_key    - required: Yes  RowKey of the record to delete
-        partition  - required: Yes  Partition ID to use
-
-        Returns:
+        table_name - required: Yes  Storage Table to update
+        records    - required: Yes  Records to update 
         """
-        self.delete_records(table_name, [(row_key, partition)])
+        partitions:typing.Dict[str, typing.List[tuple]] = {}
+        for record in records:
+            if record.PartitionKey not in partitions:
+                partitions[record.PartitionKey] = []
+            partitions[record.PartitionKey].append(("upsert", record.get_entity(), {"mode" : UpdateMode.REPLACE}))
+
+        with self._get_table_client(table_name) as table_client:
+            for partition in partitions:
+                operations = partitions[partition]
+                for idx in range(0, len(operations), AzureTableStoreUtil.TRANSACTION_MAX):
+                    table_client.submit_transaction(operations[idx: idx + AzureTableStoreUtil.TRANSACTION_MAX])
+
+        if self.pending_shards:
+            self.remove_pending(table_name, [(x.RowKey, x.PartitionKey) for x in records if x.processed])
 
     def delete_records(self, table_name:str, records:typing.List[typing.Tuple[str,str]]) -> None:
         """
@@ -125,6 +304,9 @@ class AzureTableStoreUtil:
                     partition_key=pair[1]
                     )
 
+        if self.pending_shards:
+            self.remove_pending(table_name, records)
+
     def add_record(self, table_name:str, entity:Record):
         """
         Add a record to a table
@@ -133,15 +315,18 @@ class AzureTableStoreUtil:
         table_name - Name of table to add to
         entity - Dictionary of non list/dict data
         """
+        created = False
         with self._create_table(table_name) as log_table:
             try:
                 entity.table_name = table_name
                 resp = log_table.create_entity(entity=entity.get_entity())
+                created = True
             
             except ConnectionResetError as ex:
                 # Saw this in testing...we should definitley retry it.
                 try:
                     resp = log_table.create_entity(entity=entity.get_entity())
+                    created = True
                 except Exception as ex:
                     print("Entity create failed retry- {}".format(entity.file_name))
                     print(str(ex))
@@ -150,6 +335,47 @@ class AzureTableStoreUtil:
                 print("Entity create failed - {}".format(entity.file_name))
                 print(str(ex))
 
+        if created and self.pending_shards and not entity.processed:
+            self.add_pending(table_name, [entity])
+
+    def _get_pending_partition(self, partition_key:str, row_key:str) -> str:
+        """
+        Get the pending index partition (shard) a record belongs in. 
+        """
+        shard = zlib.crc32(row_key.encode("utf-8")) % self.pending_shards
+        return AzureTableStoreUtil.PENDING_PARTITION.format(partition_key, shard)
+
+    def _submit_pending(self, table_name:str, operations:typing.List[tuple]) -> None:
+        """
+        Submit pending index operations as entity group transactions. A transaction
+        can only target a single partition, so operations are grouped by shard first.
+        If a transaction fails (i.e. deleting an entry that was never indexed) the 
+        operations in it are retried one at a time. 
+        """
+        shards:typing.Dict[str, typing.List[tuple]] = {}
+        for operation in operations:
+            partition = operation[1]["PartitionKey"]
+            if partition not in shards:
+                shards[partition] = []
+            shards[partition].append(operation)
+
+        with self._get_table_client(table_name) as table_client:
+            for partition in shards:
+                shard_operations = shards[partition]
+                for idx in range(0, len(shard_operations), AzureTableStoreUtil.TRANSACTION_MAX):
+                    transaction = shard_operations[idx: idx + AzureTableStoreUtil.TRANSACTION_MAX]
+                    try:
+                        table_client.submit_transaction(transaction)
+                    except Exception:
+                        for operation in transaction:
+                            try:
+                                table_client.submit_transaction([operation])
+                            except Exception as ex:
+                                # Removing an entry that is not there is expected
+                                if operation[0] != "delete":
+                                    print("Pending index update failed - {}".format(operation[1]["RowKey"]))
+                                    print(str(ex))
+
     @staticmethod
     def _get_query_filter_unprocessed() -> str:
         """
@@ -197,25 +423,33 @@ class AzureTableStoreUtil:
         results = table_client.query_entities(query)
         if results:
             for result in results:
-                entity_record = {}
-            
-                for key in result:
-                    value = result[key]
-
-                    if isinstance(result[key], EntityProperty): 
-                        value = result[key].value
-                    if isinstance(result[key], TablesEntityDatetime):
-                        value = datetime.datetime.fromisoformat(str(result[key]))
-
-                    entity_record[key] = value
-                
-                return_records.append(entity_record)
+                return_records.append(AzureTableStoreUtil._normalize_entity(result))
         else:
             message = "Failed to get results for query: {}".format(query)
             print(message)
 
         return return_records
 
+    @staticmethod
+    def _normalize_entity(result:dict) -> dict:
+        """
+        Convert an entity returned from the table API into a plain dictionary,
+        unwrapping typed properties and table date times. 
+        """
+        entity_record = {}
+    
+        for key in result:
+            value = result[key]
+
+            if isinstance(result[key], EntityProperty): 
+                value = result[key].value
+            if isinstance(result[key], TablesEntityDatetime):
+                value = datetime.datetime.fromisoformat(str(result[key]))
+
+            entity_record[key] = value
+
+        return entity_record
+
     def _create_table(self, table_name:str) -> TableClient:
         """
         Ensure a table exists in the table storage 
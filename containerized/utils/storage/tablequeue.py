@@ -0,0 +1,136 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import json
+import time
+import uuid
+import typing
+from datetime import datetime
+from utils.storage.workqueue import WorkChunk, WorkQueue
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableServiceClient, TableClient, UpdateMode
+
+class TableWorkQueue(WorkQueue):
+    """
+    Work queue kept in an Azure Storage Table, one entity per chunk in the partition
+    named after the queue. Claims, renewals and completion are conditional updates on
+    the entity ETag so only one container can win or complete a chunk, the ETag 
+    returned by the update is the lease token.
+
+    Chunks are created rather than upserted and their ids carry a uuid, so two loads
+    pushing at the same time can never overwrite each other's chunks.
+    """
+    CONN_STR = "DefaultEndpointsProtocol=https;AccountName={};AccountKey={};EndpointSuffix=core.windows.net"
+    # Candidate chunks read per claim attempt
+    CLAIM_PAGE = 10
+
+    def __init__(self, account_name:str, account_key:str, table_name:str, queue_name:str):
+        self.connection_string = TableWorkQueue.CONN_STR.format(account_name, account_key)
+        self.table_name = table_name
+        self.queue_name = queue_name
+        # Chunk ids sort in the order they were pushed, run prefix and sequence, with
+        # the uuid of this pusher to keep them unique
+        self._run_prefix = "{}-{}".format(datetime.utcnow().strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex)
+        self._sequence = 0
+        self._table_ready = False
+
+    def clear(self) -> None:
+        query_filter = "PartitionKey eq '{}'".format(self.queue_name)
+        with self._get_client() as table_client:
+            for entity in table_client.query_entities(query_filter, select=["PartitionKey", "RowKey"]):
+                try:
+                    table_client.delete_entity(partition_key=entity["PartitionKey"], row_key=entity["RowKey"])
+                except ResourceNotFoundError:
+                    pass
+
+    def push(self, row_keys:typing.List[str]) -> str:
+        chunk_id = "{}-{:08d}".format(self._run_prefix, self._sequence)
+        self._sequence += 1
+
+        with self._get_client() as table_client:
+            table_client.create_entity(entity={
+                "PartitionKey" : self.queue_name,
+                "RowKey" : chunk_id,
+                "row_keys" : json.dumps(row_keys),
+                "record_count" : len(row_keys),
+                "owner" : "",
+                "lease_expires" : 0.0,
+                "attempts" : 0,
+                "completed" : False,
+                "abandoned" : False
+            })
+        return chunk_id
+
+    def claim(self, owner:str, lease_seconds:int) -> WorkChunk:
+        query_filter = "PartitionKey eq '{}' and completed eq false and lease_expires lt {}".format(
+            self.queue_name,
+            float(time.time()))
+
+        with self._get_client() as table_client:
+            pages = table_client.query_entities(query_filter, results_per_page=TableWorkQueue.CLAIM_PAGE).by_page()
+            for page in pages:
+                for entity in page:
+                    attempts = int(entity.get("attempts", 0)) + 1
+                    update = {
+                        "PartitionKey" : entity["PartitionKey"],
+                        "RowKey" : entity["RowKey"],
+                        "owner" : owner,
+                        "lease_expires" : float(time.time() + lease_seconds),
+                        "attempts" : attempts
+                    }
+                    try:
+                        response = table_client.update_entity(
+                            entity=update,
+                            mode=UpdateMode.MERGE,
+                            etag=entity.metadata["etag"],
+                            match_condition=MatchConditions.IfNotModified)
+                    except (ResourceModifiedError, ResourceNotFoundError):
+                        # Another container won this one, try the next
+                        continue
+
+                    return WorkChunk(entity["RowKey"], json.loads(entity["row_keys"]), response["etag"], attempts)
+        return None
+
+    def renew(self, chunk:WorkChunk, lease_seconds:int) -> bool:
+        return self._update_lease(chunk, float(time.time() + lease_seconds))
+
+    def complete(self, chunk:WorkChunk, abandoned:bool = False) -> bool:
+        return self._update_chunk(chunk, {"completed" : True, "abandoned" : abandoned})
+
+    def release(self, chunk:WorkChunk) -> None:
+        self._update_lease(chunk, 0.0)
+
+    def _update_lease(self, chunk:WorkChunk, lease_expires:float) -> bool:
+        """Conditionally move the lease expiry of a chunk held with chunk.lease_token"""
+        return self._update_chunk(chunk, {"lease_expires" : lease_expires})
+
+    def _update_chunk(self, chunk:WorkChunk, properties:dict) -> bool:
+        """Conditionally merge properties into a chunk held with chunk.lease_token"""
+        entity = {
+            "PartitionKey" : self.queue_name,
+            "RowKey" : chunk.chunk_id
+        }
+        entity.update(properties)
+
+        with self._get_client() as table_client:
+            try:
+                response = table_client.update_entity(
+                    entity=entity,
+                    mode=UpdateMode.MERGE,
+                    etag=chunk.lease_token,
+                    match_condition=MatchConditions.IfNotModified)
+            except (ResourceModifiedError, ResourceNotFoundError):
+                return False
+
+        chunk.lease_token = response["etag"]
+        return True
+
+    def _get_client(self) -> TableClient:
+        """Table client for the queue table, creating the table on first use"""
+        if not self._table_ready:
+            with TableServiceClient.from_connection_string(conn_str=self.connection_string) as table_service:
+                table_service.create_table_if_not_exists(self.table_name)
+            self._table_ready = True
+
+        return TableClient.from_connection_string(conn_str=self.connection_string, table_name=self.table_name)
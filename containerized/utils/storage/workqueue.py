@@ -0,0 +1,235 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import abc
+import time
+import uuid
+import typing
+import threading
+
+class WorkChunk:
+    """
+    A chunk of record RowKeys claimed from a work queue. The lease token proves the
+    claim and changes every time the lease is renewed.
+    """
+    def __init__(self, chunk_id:str, row_keys:typing.List[str], lease_token:str = None, attempts:int = 1):
+        self.chunk_id = chunk_id
+        self.row_keys:typing.List[str] = row_keys
+        self.lease_token = lease_token
+        # Times the chunk has been claimed, including this claim
+        self.attempts = attempts
+
+class WorkQueue(abc.ABC):
+    """
+    Interface for a queue of record chunks that workload containers claim under a
+    lease. A chunk whose lease runs out without being completed goes back to the
+    pool, so a container that finishes early keeps picking up work instead of
+    sitting idle while others work through a static manifest.
+
+    A load clears the queue before it pushes, chunks of earlier loads are never 
+    handed out next to the new ones. A chunk that is claimed too many times can be
+    completed as abandoned so it is not handed out again, it's records stay 
+    unprocessed in the record store for the next load.
+    """
+    # Service limit on a table string property is 32K characters, keep a chunk well under it
+    CHUNK_MAX = 800
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """
+        Remove every chunk from the queue, called by a load before it pushes.
+        """
+        pass
+
+    @abc.abstractmethod
+    def push(self, row_keys:typing.List[str]) -> str:
+        """
+        Add a chunk of RowKeys to the queue, returns the chunk id.
+        """
+        pass
+
+    @abc.abstractmethod
+    def claim(self, owner:str, lease_seconds:int) -> WorkChunk:
+        """
+        Claim the next available chunk, None when there is nothing left to claim.
+        """
+        pass
+
+    @abc.abstractmethod
+    def renew(self, chunk:WorkChunk, lease_seconds:int) -> bool:
+        """
+        Extend the lease on a claimed chunk, False if the lease was lost.
+        """
+        pass
+
+    @abc.abstractmethod
+    def complete(self, chunk:WorkChunk, abandoned:bool = False) -> bool:
+        """
+        Mark a chunk held with chunk.lease_token as done so it is never handed out 
+        again, abandoned marks a chunk that was given up on. False if the lease was 
+        lost, the chunk is then left to whoever holds it now.
+        """
+        pass
+
+    @abc.abstractmethod
+    def release(self, chunk:WorkChunk) -> None:
+        """
+        Give up the lease on a chunk so another container can claim it right away.
+        """
+        pass
+
+    def push_all(self, row_keys:typing.Iterable[str], chunk_size:int) -> typing.List[str]:
+        """
+        Push a stream of RowKeys as chunks of chunk_size, returns the chunk ids.
+        """
+        chunk_size = max(1, min(int(chunk_size), WorkQueue.CHUNK_MAX))
+        chunk_ids:typing.List[str] = []
+        current:typing.List[str] = []
+        for row_key in row_keys:
+            current.append(row_key)
+            if len(current) >= chunk_size:
+                chunk_ids.append(self.push(current))
+                current = []
+
+        if len(current):
+            chunk_ids.append(self.push(current))
+        return chunk_ids
+
+class LocalWorkQueue(WorkQueue):
+    """
+    In process stand in for the table backed queue, used for local runs and testing
+    where the load and workload run in the same process. Queues are shared by name
+    across instances in the process.
+    """
+    _queues:typing.Dict[str, typing.Dict[str, dict]] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, queue_name:str):
+        self.queue_name = queue_name
+        with LocalWorkQueue._lock:
+            if queue_name not in LocalWorkQueue._queues:
+                LocalWorkQueue._queues[queue_name] = {}
+            self._chunks = LocalWorkQueue._queues[queue_name]
+
+    def clear(self) -> None:
+        with LocalWorkQueue._lock:
+            self._chunks.clear()
+
+    def push(self, row_keys:typing.List[str]) -> str:
+        chunk_id = str(uuid.uuid4())
+        with LocalWorkQueue._lock:
+            self._chunks[chunk_id] = {
+                "row_keys" : list(row_keys),
+                "owner" : None,
+                "lease_expires" : 0.0,
+                "lease_token" : None,
+                "attempts" : 0,
+                "completed" : False,
+                "abandoned" : False
+            }
+        return chunk_id
+
+    def claim(self, owner:str, lease_seconds:int) -> WorkChunk:
+        now = time.time()
+        with LocalWorkQueue._lock:
+            for chunk_id, chunk in self._chunks.items():
+                if not chunk["completed"] and chunk["lease_expires"] < now:
+                    chunk["owner"] = owner
+                    chunk["lease_expires"] = now + lease_seconds
+                    chunk["lease_token"] = str(uuid.uuid4())
+                    chunk["attempts"] += 1
+                    return WorkChunk(chunk_id, list(chunk["row_keys"]), chunk["lease_token"], chunk["attempts"])
+        return None
+
+    def renew(self, chunk:WorkChunk, lease_seconds:int) -> bool:
+        with LocalWorkQueue._lock:
+            current = self._chunks.get(chunk.chunk_id)
+            if current is None or current["lease_token"] != chunk.lease_token:
+                return False
+            current["lease_expires"] = time.time() + lease_seconds
+            current["lease_token"] = str(uuid.uuid4())
+            chunk.lease_token = current["lease_token"]
+        return True
+
+    def complete(self, chunk:WorkChunk, abandoned:bool = False) -> bool:
+        with LocalWorkQueue._lock:
+            current = self._chunks.get(chunk.chunk_id)
+            if current is None or current["lease_token"] != chunk.lease_token:
+                return False
+            current["completed"] = True
+            current["abandoned"] = abandoned
+        return True
+
+    def release(self, chunk:WorkChunk) -> None:
+        with LocalWorkQueue._lock:
+            current = self._chunks.get(chunk.chunk_id)
+            if current is not None and current["lease_token"] == chunk.lease_token:
+                current["lease_expires"] = 0.0
+                current["lease_token"] = None
+
+class LeaseRenewer(threading.Thread):
+    """
+    Background thread that keeps the lease on a claimed chunk alive while the
+    chunk is worked on, renewing at a third of the lease time.
+    """
+    def __init__(self, work_queue:WorkQueue, chunk:WorkChunk, lease_seconds:int):
+        super().__init__(daemon=True)
+        self.work_queue = work_queue
+        self.chunk = chunk
+        self.lease_seconds = lease_seconds
+        # Set once a renewal fails, the chunk may now be claimed by someone else
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(max(1, self.lease_seconds / 3)):
+            try:
+                if not self.work_queue.renew(self.chunk, self.lease_seconds):
+                    self.lost = True
+                    return
+            except Exception as ex:
+                # Transient failure, the next attempt is still inside the lease
+                print("Lease renewal failed - {}".format(str(ex)))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class WorkQueueFactory:
+    """
+    Creates the WorkQueue identified in the configuration, or None when workloads
+    are handed out as static manifests. The table queue is imported on demand so
+    the local queue does not need the Azure SDK.
+    """
+    TABLE = "table"
+    LOCAL = "local"
+
+    @staticmethod
+    def get_queue(configuration) -> WorkQueue:
+        """
+        Get the work queue selected with configuration.work_queue
+
+        Parameters:
+
+        configuration:
+            Instance of Config
+
+        Returns:
+            Instance of WorkQueue or None
+        """
+        queue_type = str(configuration.work_queue).lower() if configuration.work_queue else ""
+        queue_name = "{}work".format(configuration.record_storage_partition)
+
+        if queue_type == "":
+            return None
+        elif queue_type == WorkQueueFactory.LOCAL:
+            return LocalWorkQueue(queue_name)
+        elif queue_type == WorkQueueFactory.TABLE:
+            from utils.storage.tablequeue import TableWorkQueue
+            return TableWorkQueue(
+                configuration.record_account,
+                configuration.record_account_key,
+                "{}queue".format(configuration.record_storage_table),
+                queue_name)
+
+        raise Exception("Unknown work queue - {}".format(configuration.work_queue))
@@ -5,7 +5,9 @@ import os
 import typing
 from utils.configuration.config import Config
 from utils.requests.auth import Credential
-from utils.uploader import FileUploader, UploadResults
+from utils.uploader import UploadResults
+from utils.scheduler import UploadScheduler
+from utils.ledger import UploadLedger
 from utils.logutil import LoggingUtils, ActivityLog
 from utils.fileshare.mount import FileClass, Mount
 
@@ -24,15 +26,23 @@ print("Mount path exists: ", os.path.exists(config.file_share_mount))
 
 activity_log = ActivityLog(config.file_share_mount, "dataload", config.log_identity)
 
+# Small files first so most records land early, large well logs and documents
+# fill in behind them
 classes:typing.List[FileClass] = [
-    FileClass(["markers"], "csv"),
-    FileClass(["trajectories"], "csv"),
-    FileClass(["documents"], "pdf"),
-    FileClass(["well-logs"], "las"),
+    FileClass(["markers"], "csv", 2),
+    FileClass(["trajectories"], "csv", 2),
+    FileClass(["documents"], "pdf", 1),
+    FileClass(["well-logs"], "las", 1),
 ]
 
+# Files uploaded by earlier runs are left out
+ledger:UploadLedger = None
+if config.upload_ledger:
+    ledger = UploadLedger(os.path.join(config.file_share_mount, config.upload_ledger), config.file_share_mount)
+    activity_log.add_activity("Ledger {} lists {} uploaded files".format(config.upload_ledger, len(ledger)))
+
 activity_log.add_activity("Filter share mount for files : {}".format(config.file_share_mount))
-Mount.load_files(classes, config.file_share_mount)
+Mount.load_files(classes, config.file_share_mount, ledger, config.walk_workers)
 activity_log.add_activity("Finished filtering share mount")
 
 
@@ -44,21 +54,22 @@ config.logger.info("Acquire credentials")
 appCred = Credential(config)
 
 ################################################
-# Upload files in batches of files
+# Upload files of every class together
 ################################################
+activity_log.add_activity("Upload files from {} classes".format(len(classes)))
+scheduler = UploadScheduler(classes, config, appCred, ledger)
+class_results:typing.Dict[str, UploadResults] = scheduler.upload_files()
+
 report:typing.List[str] = []
 for c in classes:
 
-    config.logger.info("Upload Files - {}".format(c.parent_dir))
-    report.append("Starting {} - {} files".format(c.parent_dir, len(c.files)))
-
+    config.logger.info("Uploaded Files - {}".format(c.parent_dir))
+    report.append("Class {} - {} files, {} already uploaded".format(c.parent_dir, len(c.files), c.skipped_files))
 
     if len(c.files):
-        activity_log.add_activity("Upload files from {} : {}".format(c.parent_dir, len(c.files)))
-    
-        uploader = FileUploader(c.files, config, appCred)
-        results:UploadResults = uploader.upload_files()
+        results:UploadResults = class_results[c.identity]
 
+        activity_log.add_activity("Uploaded files from {} : {}".format(c.parent_dir, len(c.files)))
         activity_log.add_activity("Succesful Uploads: {}".format(len(results.success)))
         activity_log.add_activity("Failed Uploads: {}".format(len(results.failed)))
 
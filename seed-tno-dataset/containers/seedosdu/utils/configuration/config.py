@@ -36,6 +36,47 @@ class Config:
         self.aclViewer = config.get("REQUEST", "acl_viewer").format(self.dataPartition)
 
         self.batch_multiplier = int(config.get("LOAD", "batch_multiplier")) 
+        # Directories of the share mount scanned at once when filtering for files
+        self.walk_workers = int(config.get("LOAD", "walk_workers", fallback="16"))
+
+        # Blob uploads, block size grows with the file between the min and max, 
+        # max_concurrency blocks are sent at once with read_ahead blocks read from
+        # the mount ahead of them, all within max_buffer bytes of memory per file
+        self.upload_block_size_min = int(config.get("UPLOAD", "block_size_min", fallback="4194304"))
+        self.upload_block_size_max = int(config.get("UPLOAD", "block_size_max", fallback="33554432"))
+        self.upload_max_concurrency = int(config.get("UPLOAD", "max_concurrency", fallback="8"))
+        self.upload_read_ahead = int(config.get("UPLOAD", "read_ahead", fallback="16"))
+        self.upload_max_buffer = int(config.get("UPLOAD", "max_buffer", fallback="268435456"))
+        # Network limit of the container in bytes per second each way, 0 is unlimited,
+        # with control_share of it held back for OSDU API calls
+        self.upload_bytes_per_second = int(config.get("UPLOAD", "bytes_per_second", fallback="0"))
+        self.upload_control_share = float(config.get("UPLOAD", "control_share", fallback="0.1"))
+        # Size class lanes, name:max_bytes:workers separated by commas, each with it's
+        # own process pool. Empty uploads every file in the same batches.
+        self.upload_lanes = config.get("UPLOAD", "lanes", fallback="")
+        # Times a file is tried before it is failed, and seconds with no file finishing
+        # before the files in flight are failed
+        self.upload_max_attempts = int(config.get("UPLOAD", "max_attempts", fallback="3"))
+        self.upload_task_timeout = float(config.get("UPLOAD", "task_timeout", fallback="600"))
+        # Ledger of uploaded files on the share mount, a rerun skips what it lists. Empty
+        # keeps the ledger in memory for the run only.
+        self.upload_ledger = config.get("UPLOAD", "ledger", fallback="")
+        # upload sends each file from the mount, copy has storage copy it from the share
+        # behind the mount (SHARE_ACCOUNT, SHARE_ACCOUNT_KEY and SHARE_NAME) and only
+        # uploads from the mount when the copy fails. Copies that are not done in 
+        # copy_timeout seconds are aborted.
+        self.upload_mode = config.get("UPLOAD", "mode", fallback="upload").lower()
+        self.upload_copy_timeout = float(config.get("UPLOAD", "copy_timeout", fallback="3600"))
+        if self.upload_mode not in ["upload", "copy"]:
+            raise Exception("Upload mode must be upload or copy - {}".format(self.upload_mode))
+
+        self.share_account:str = None
+        self.share_account_key:str = None
+        self.share_name:str = None
+        if self.upload_mode == "copy":
+            self.share_account = self._get_environment("SHARE_ACCOUNT")
+            self.share_account_key = self._get_environment("SHARE_ACCOUNT_KEY")
+            self.share_name = self._get_environment("SHARE_NAME")
 
         self.log_name = config.get("LOGGING", "log_name")
         # If this setting is true, use a UUID to define the log and not the date
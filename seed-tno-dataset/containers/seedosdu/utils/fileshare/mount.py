@@ -1,9 +1,11 @@
 import os
 import typing
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.ledger import UploadLedger
 
 class FileClass:
-    def __init__(self, parent_dir:typing.List[str], data_extension:str):
+    def __init__(self, parent_dir:typing.List[str], data_extension:str, priority:int = 0):
         """
         Parameters:
 
@@ -19,6 +21,9 @@ class FileClass:
                     path
 
         data_extension: The lower case file extension, i.e. pdf, without a dot 
+
+        priority: Classes with a higher priority are uploaded first, classes with the
+                  same priority are uploaded side by side
         """
         # Identity
         self.identity = str(uuid.uuid4())
@@ -31,71 +36,154 @@ class FileClass:
 
         # File extensions to look for. 
         self.data_extension = data_extension
-        self.supported_paths = []
-        self.loaded_paths = []
+        self.priority = priority
+        self.supported_paths:typing.Set[str] = set()
+        self.loaded_paths:typing.Set[str] = set()
         self.files = []
+        # Files found that the ledger has as already uploaded
+        self.skipped_files = 0
 
     @staticmethod
     def correct_dir_path(path:str, char_replace = '\\', char_replacement = '/') -> str:
         return path.replace(char_replace, char_replacement)
 
+class PathTrie:
+    """
+    Full parent_dir paths of the classes, one node per directory name below the
+    mount. The walk carries each directory's node down to it's children so a full
+    path match is a dictionary lookup per directory, no path strings are compared.
+    """
+    def __init__(self):
+        self.children:typing.Dict[str, PathTrie] = {}
+        self.classes:typing.List[FileClass] = []
+
+    def add(self, path:str, file_class:FileClass) -> None:
+        node = self
+        for part in [x for x in path.split("/") if x]:
+            node = node.children.setdefault(part, PathTrie())
+        node.classes.append(file_class)
+
+    def get_child(self, name:str) -> object:
+        return self.children.get(name)
+
 class Mount:
     @staticmethod
-    def load_files(classes:typing.List[FileClass], mount:str):
-
-        normalized_mount = FileClass.correct_dir_path(mount)
-
-        if not os.path.exists(normalized_mount):
-            raise Exception("Share mount {} is not valid".format(normalized_mount))
+    def load_files(classes:typing.List[FileClass], mount:str, ledger:UploadLedger = None, workers:int = 16):
+        """
+        Collect the files of each class from the mount, files the ledger has as already
+        uploaded are counted in skipped_files rather than collected. Files of each class
+        are sorted so the order does not depend on the walk.
+        """
+        for file_class, file_path in Mount.walk_files(classes, mount, ledger, workers):
+            file_class.files.append(file_path)
 
-        for root, dirs, files in os.walk(mount, topdown=True):
+        for file_class in classes:
+            file_class.files.sort()
 
-            # NEW
-            normalized_root = FileClass.correct_dir_path(root)
-            print("Scanning {}".format(normalized_root))
+    @staticmethod
+    def walk_files(
+        classes:typing.List[FileClass], 
+        mount:str, 
+        ledger:UploadLedger = None, 
+        workers:int = 16
+        ) -> typing.Generator[typing.Tuple[FileClass, str], None, None]:
+        """
+        Walk the mount with up to workers directories scanned at once and yield each 
+        file of a class as it is found.
 
-            full_path = "/{}".format(normalized_root.replace(normalized_mount, ""))
-            leaf_path = os.path.split(normalized_root)[-1]
+        A directory belongs to the classes with it's full path (/path1/path2 below the 
+        mount) in parent_dir, then those with it's leaf name in parent_dir. A file goes 
+        to the first of those classes with it's extension. Directories that can not be
+        read are passed over as os.walk does.
 
-            class_collection = [x for x in classes if full_path in x.parent_dir]
-            collection_ids = [x.identity for x in class_collection]
-            leaf_collection = [x for x in classes if leaf_path in x.parent_dir]
+        Returns:
+            Generator of (FileClass, file path), in no set order
+        """
+        normalized_mount = FileClass.correct_dir_path(mount)
 
-            for file_class in leaf_collection:
-                if file_class.identity not in collection_ids:
-                    class_collection.append(file_class)
-                    collection_ids.append(file_class.identity)
+        if not os.path.exists(normalized_mount):
+            raise Exception("Share mount {} is not valid".format(normalized_mount))
 
-            if not len(class_collection):
-                continue
+        trie = PathTrie()
+        leaves:typing.Dict[str, typing.List[FileClass]] = {}
+        for file_class in classes:
+            for parent in file_class.parent_dir:
+                if "/" in parent:
+                    trie.add(parent, file_class)
+                elif parent:
+                    leaves.setdefault(parent, []).append(file_class)
 
-            # Keep track of every path we run into that matched
-            if normalized_root not in class_collection[0].supported_paths:
-                class_collection[0].supported_paths.append(normalized_root)
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+            futures = {executor.submit(Mount._scan_directory, normalized_mount, trie, leaves, ledger)}
 
-            for file in files:
-                extension = file.split('.')[-1]
+            while len(futures):
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, directories, directory_classes, matches, skipped = future.result()
+                    print("Scanning {}".format(directory))
 
+                    for path, node in directories:
+                        futures.add(executor.submit(Mount._scan_directory, path, node, leaves, ledger))
 
-                if extension.lower() == class_collection[0].data_extension:
-                    # Keep track of every path we collect a file from
-                    if normalized_root not in class_collection[0].loaded_paths:
-                        class_collection[0].loaded_paths.append(normalized_root)
+                    # Keep track of every path that matched and every path we collect from
+                    for file_class in directory_classes:
+                        file_class.supported_paths.add(directory)
 
-                    # Extension picked up a hit
-                    class_collection[0].files.append(os.path.join(normalized_root, file))
-            # NEW
+                    for file_class in skipped:
+                        file_class.loaded_paths.add(directory)
+                        file_class.skipped_files += skipped[file_class]
 
-            """orig
-            root_dir = os.path.split(root)[-1]
-            class_collection = [x for x in classes if root_dir in x.paren_dir]
+                    for file_class, file_path in matches:
+                        file_class.loaded_paths.add(directory)
+                        yield file_class, file_path
 
-            if not len(class_collection):
-                continue
-    
-            for file in files:
-                extension = file.split('.')[-1]
+    @staticmethod
+    def _scan_directory(
+        directory:str,
+        node:PathTrie,
+        leaves:typing.Dict[str, typing.List[FileClass]],
+        ledger:UploadLedger
+        ) -> tuple:
+        """
+        Scan a single directory on a walker thread.
 
-                if extension.lower() == class_collection[0].data_extension:
-                    class_collection[0].files.append(os.path.join(root, file))
-            """
\ No newline at end of file
+        Returns:
+            (directory, [(sub directory, trie node)], [FileClass], [(FileClass, file path)], {FileClass : skipped files})
+        """
+        directories:typing.List[typing.Tuple[str, PathTrie]] = []
+        matches:typing.List[typing.Tuple[FileClass, str]] = []
+        skipped:typing.Dict[FileClass, int] = {}
+
+        # Full path matches first, then leaf name matches, then first class per extension
+        directory_classes = list(node.classes) if node else []
+        for file_class in leaves.get(os.path.split(directory)[-1], []):
+            if file_class not in directory_classes:
+                directory_classes.append(file_class)
+
+        extensions:typing.Dict[str, FileClass] = {}
+        for file_class in directory_classes:
+            extensions.setdefault(file_class.data_extension, file_class)
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append((FileClass.correct_dir_path(entry.path), node.get_child(entry.name) if node else None))
+                            continue
+                    except OSError:
+                        continue
+
+                    file_class = extensions.get(entry.name.split('.')[-1].lower())
+                    if file_class is None:
+                        continue
+
+                    file_path = os.path.join(directory, entry.name)
+                    if ledger and ledger.get(file_path):
+                        skipped[file_class] = skipped.get(file_class, 0) + 1
+                    else:
+                        matches.append((file_class, file_path))
+        except OSError:
+            pass
+
+        return directory, directories, directory_classes, matches, skipped
@@ -0,0 +1,56 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+from urllib.parse import quote
+from datetime import datetime, timedelta
+from azure.storage.fileshare import generate_account_sas, ResourceTypes, AccountSasPermissions
+
+class MountShare:
+    """
+    The Azure file share behind the mount, used to give storage a SAS URL it can read
+    a mounted file from so the file is copied server side rather than through this 
+    container.
+
+    Holds only the share URL, the account settings and a read only account SAS so it
+    pickles to the upload workers cheaply. The SAS starts a few minutes in the past to
+    allow for clock skew and is renewed when it is close to expiring, so a run longer 
+    than SAS_HOURS keeps copying.
+    """
+    # Hours the SAS token is valid for
+    SAS_HOURS = 24
+    # Minutes the SAS starts before now, for clock skew with the storage service
+    SAS_SKEW_MINUTES = 15
+    # Minutes before expiry the SAS is renewed, longer than any single copy
+    SAS_RENEW_MINUTES = 120
+
+    def __init__(self, account_name:str, account_key:str, share_name:str, mount:str):
+        self.account_name = account_name
+        self.account_key = account_key
+        self.mount = mount
+        # Generic URL for the share
+        self.share_url = "https://{}.file.core.windows.net/{}".format(account_name, share_name)
+        self.sas_token:str = None
+        self.sas_expiry:datetime = None
+        self._renew_sas()
+
+    def get_file_url(self, file_path:str) -> str:
+        """SAS URL in the share of a file on the mount"""
+        if datetime.utcnow() + timedelta(minutes=MountShare.SAS_RENEW_MINUTES) >= self.sas_expiry:
+            self._renew_sas()
+
+        relative_path = os.path.relpath(file_path, self.mount).replace("\\", "/")
+        return "{}/{}?{}".format(self.share_url, quote(relative_path), self.sas_token)
+
+    def _renew_sas(self) -> None:
+        now = datetime.utcnow()
+        self.sas_expiry = now + timedelta(hours=MountShare.SAS_HOURS)
+        self.sas_token = generate_account_sas(
+            account_name=self.account_name,
+            account_key=self.account_key,
+            resource_types=ResourceTypes(object=True),
+            permission=AccountSasPermissions(read=True),
+            start=now - timedelta(minutes=MountShare.SAS_SKEW_MINUTES),
+            expiry=self.sas_expiry,
+            protocol="https"
+        )
@@ -0,0 +1,41 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import typing
+
+class ExecutionLane:
+    """
+    A size class of files with it's own workers. A file goes to the first lane with
+    a max_size it fits in, a max_size of 0 takes anything.
+    """
+    def __init__(self, name:str, max_size:int, max_workers:int):
+        self.name = name
+        self.max_size = int(max_size)
+        self.max_workers = max(1, int(max_workers))
+
+    @staticmethod
+    def parse(lanes:str) -> typing.List[object]:
+        """
+        Parse lanes from a setting of name:max_size:workers separated by commas, i.e.
+
+            small:16777216:32,large:0:4
+
+        Lanes are ordered smallest max_size first with the unlimited lane last.
+        """
+        return_lanes:typing.List[ExecutionLane] = []
+        for lane in [x.strip() for x in lanes.split(",") if x.strip()]:
+            parts = lane.split(":")
+            if len(parts) != 3:
+                raise Exception("Lane setting must be name:max_size:workers - {}".format(lane))
+            return_lanes.append(ExecutionLane(parts[0], parts[1], parts[2]))
+
+        return_lanes.sort(key=lambda x: x.max_size if x.max_size else float("inf"))
+        return return_lanes
+
+    @staticmethod
+    def get_lane(lanes:typing.List[object], size:int) -> object:
+        """Lane for a file of size bytes, the last lane takes anything too big for the rest"""
+        for lane in lanes:
+            if lane.max_size == 0 or int(size) <= lane.max_size:
+                return lane
+        return lanes[-1]
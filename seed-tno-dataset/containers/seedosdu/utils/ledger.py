@@ -0,0 +1,74 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import os
+import json
+import typing
+from datetime import datetime
+
+class UploadLedger:
+    """
+    Files that have been uploaded and registered in OSDU, keyed by path (relative to
+    the mount), size and modified time, so a file is never uploaded twice. A file that 
+    changed is a different entry and is uploaded again.
+
+    With a ledger_path the ledger is kept as an append-only JSON lines file, one line 
+    per upload, and loaded back on the next run so a load that was interrupted only
+    uploads what is left. A partly written last line from a crash is ignored, and is
+    ended with a newline before the first append so the next entry is not lost on it.
+    """
+    def __init__(self, ledger_path:str = None, mount:str = None):
+        self.ledger_path = ledger_path
+        self.mount = mount
+        # Key to the file_id, file_version and file_source of the upload
+        self._entries:typing.Dict[typing.Tuple[str, int, int], dict] = {}
+        # Set when the file ends part way through a line
+        self._partial_line = False
+
+        if self.ledger_path and os.path.exists(self.ledger_path):
+            with open(self.ledger_path, "r") as ledger_input:
+                for line in ledger_input:
+                    self._partial_line = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        self._entries[(entry["path"], entry["size"], entry["mtime"])] = entry
+                    except Exception:
+                        continue
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_key(self, file_path:str) -> typing.Tuple[str, int, int]:
+        relative_path = os.path.relpath(file_path, self.mount) if self.mount else file_path
+        relative_path = relative_path.replace("\\", "/")
+        if not os.path.exists(file_path):
+            return relative_path, 0, 0
+
+        stat = os.stat(file_path)
+        # Whole seconds, SMB mounts do not keep sub second times reliably
+        return relative_path, stat.st_size, int(stat.st_mtime)
+
+    def get(self, file_path:str) -> dict:
+        """Entry for a file, None if it has not been uploaded"""
+        return self._entries.get(self.get_key(file_path))
+
+    def record(self, file_path:str, file_id:str, file_version:str, file_source:str) -> None:
+        path, size, mtime = self.get_key(file_path)
+        entry = {
+            "path" : path,
+            "size" : size,
+            "mtime" : mtime,
+            "file_id" : file_id,
+            "file_version" : file_version,
+            "file_source" : file_source,
+            "timestamp" : str(datetime.utcnow())
+        }
+        self._entries[(path, size, mtime)] = entry
+
+        if self.ledger_path:
+            os.makedirs(os.path.dirname(self.ledger_path) or ".", exist_ok=True)
+            with open(self.ledger_path, "a") as ledger_output:
+                if self._partial_line:
+                    ledger_output.write("\n")
+                    self._partial_line = False
+                ledger_output.write(json.dumps(entry) + "\n")
@@ -0,0 +1,183 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import math
+import time
+import queue
+import base64
+import threading
+import typing
+from azure.storage.blob import BlobClient, BlobBlock
+from utils.requests.shaper import BandwidthShaper
+
+class UploadStats:
+    """
+    What happened uploading a single file
+    """
+    def __init__(self, file_size:int, block_size:int, blocks:int, concurrency:int):
+        self.file_size = file_size
+        self.block_size = block_size
+        self.blocks = blocks
+        self.concurrency = concurrency
+        self.seconds:float = 0.0
+
+    def get_mb_per_second(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return (self.file_size / (1024 * 1024)) / self.seconds
+
+class BlockUploader:
+    """
+    Uploads a local file to a block blob, overlapping the reads from disk with the
+    uploads to storage.
+
+    The block size grows with the file, from block_size_min doubling up to
+    block_size_max, so a file is about BLOCKS_TARGET blocks. The calling thread reads
+    the file one block at a time (unbuffered, block aligned reads) into a queue of at
+    most read_ahead blocks, and up to max_concurrency threads stage the blocks as they
+    arrive. The block list is committed once every block is staged.
+
+    Blocks held in memory (queued, being staged and being read) are capped at 
+    max_buffer bytes, so with large blocks the read ahead and stagers are cut back to
+    fit. At least one block is always queued, staged and read.
+
+    A file that fits in one block is uploaded with a single put.
+    """
+    BLOCKS_TARGET = 64
+
+    def __init__(
+        self, 
+        block_size_min:int, 
+        block_size_max:int, 
+        max_concurrency:int, 
+        read_ahead:int, 
+        max_buffer:int, 
+        shaper:BandwidthShaper = None):
+        self.block_size_min = max(1, int(block_size_min))
+        self.block_size_max = max(self.block_size_min, int(block_size_max))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.read_ahead = max(1, int(read_ahead))
+        # Bytes of blocks in memory for a single file
+        self.max_buffer = max(1, int(max_buffer))
+        # Every block sent is charged to the shaper when there is one
+        self.shaper = shaper
+
+    @staticmethod
+    def get_block_id(index:int) -> str:
+        """Block ids must be base64 and the same length for every block of a blob"""
+        return base64.b64encode("{:08d}".format(index).encode("utf-8")).decode("utf-8")
+
+    def get_block_size(self, file_size:int) -> int:
+        block_size = self.block_size_min
+        while block_size < self.block_size_max and file_size > block_size * BlockUploader.BLOCKS_TARGET:
+            block_size *= 2
+        return min(block_size, self.block_size_max)
+
+    def get_buffers(self, block_size:int) -> typing.Tuple[int, int]:
+        """(stagers, queued blocks) for a block size that keep within max_buffer"""
+        # One block is always being read
+        slots = max(3, self.max_buffer // block_size) - 1
+        concurrency = max(1, min(self.max_concurrency, slots // 2))
+        read_ahead = max(1, min(self.read_ahead, slots - concurrency))
+        return concurrency, read_ahead
+
+    def upload(self, blob_url:str, file_path:str, file_size:int) -> UploadStats:
+        """
+        Upload a file to the blob, replacing anything there. Raises the first error hit
+        reading or staging a block.
+
+        Parameters:
+        blob_url:
+            Signed URL of the blob
+        file_path:
+            Local file to upload
+        file_size:
+            Size of the local file in bytes
+
+        Returns:
+            UploadStats for the file
+        """
+        block_size = self.get_block_size(file_size)
+        blocks = max(1, math.ceil(file_size / block_size))
+        concurrency, read_ahead = self.get_buffers(block_size)
+        stats = UploadStats(file_size, block_size, blocks, min(concurrency, blocks))
+
+        start = time.time()
+        blob_client = BlobClient.from_blob_url(blob_url)
+
+        if blocks == 1:
+            if self.shaper:
+                self.shaper.egress(file_size)
+            with open(file_path, "rb") as source_file:
+                blob_client.upload_blob(source_file.read(), blob_type="BlockBlob", overwrite=True)
+        else:
+            self._upload_blocks(blob_client, file_path, block_size, stats.concurrency, read_ahead)
+            blob_client.commit_block_list([BlobBlock(block_id=BlockUploader.get_block_id(x)) for x in range(blocks)])
+
+        stats.seconds = time.time() - start
+        return stats
+
+    def _upload_blocks(self, blob_client:BlobClient, file_path:str, block_size:int, concurrency:int, read_ahead:int) -> None:
+        """Read the file into the queue on this thread while the stagers upload from it"""
+        blocks = queue.Queue(maxsize=read_ahead)
+        stop = threading.Event()
+        errors:typing.List[Exception] = []
+
+        def stage_blocks() -> None:
+            while True:
+                item = blocks.get()
+                if item is None:
+                    return
+                # Keep taking blocks after a failure so the reader is never stuck
+                if stop.is_set():
+                    continue
+
+                index, data = item
+                try:
+                    if self.shaper:
+                        self.shaper.egress(len(data))
+                    blob_client.stage_block(BlockUploader.get_block_id(index), data, length=len(data))
+                except Exception as ex:
+                    errors.append(ex)
+                    stop.set()
+
+        stagers = [threading.Thread(target=stage_blocks, daemon=True) for _ in range(concurrency)]
+        for stager in stagers:
+            stager.start()
+
+        try:
+            with open(file_path, "rb", buffering=0) as source_file:
+                index = 0
+                while not stop.is_set():
+                    data = self._read_block(source_file, block_size)
+                    if not data:
+                        break
+                    blocks.put((index, data))
+                    index += 1
+        except Exception as ex:
+            errors.append(ex)
+            stop.set()
+        finally:
+            for _ in stagers:
+                blocks.put(None)
+            for stager in stagers:
+                stager.join()
+
+        if len(errors):
+            raise errors[0]
+
+    def _read_block(self, source_file:typing.BinaryIO, block_size:int) -> bytearray:
+        """Read a full block, an unbuffered read can return less than asked for"""
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < block_size:
+            read = source_file.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+
+        view.release()
+        if filled < block_size:
+            del buffer[filled:]
+        return buffer
@@ -2,11 +2,15 @@
 # Copyright (c) Microsoft Corporation.
 ##########################################################
 import os
+import time
 import requests
+from azure.storage.blob import BlobClient
 from utils.logutil import LogBase, Logger
 from utils.configuration.config import Config
 from utils.requests.retryrequests import RequestsRetryCommand, RetryRequestResponse
-from azure.storage.blob import BlobClient
+from utils.requests.blockupload import BlockUploader, UploadStats
+from utils.requests.shaper import BandwidthShaper
+from utils.fileshare.share import MountShare
 
 class UploadUrl:
     def __init__(self, upload_response:dict):
@@ -16,6 +20,16 @@ class UploadUrl:
         for key in upload_response:
             setattr(self, key, upload_response[key])
 
+class CopyFailedError(Exception):
+    """
+    A server side copy did not complete. pending is True when the copy could not be
+    aborted and may still be writing to the blob, nothing else should be written 
+    to it then.
+    """
+    def __init__(self, message:str, pending:bool = False):
+        super().__init__(message)
+        self.pending = pending
+
 class FileUploadUrlResponse:
     def __init__(self, url:UploadUrl, response:RetryRequestResponse):
         self.url:UploadUrl = url
@@ -27,10 +41,26 @@ class FileUploadMetadataResponse:
         self.response:RetryRequestResponse = response
 
 class FileRequests(LogBase):
+    # Seconds between checks on a copy that is still pending
+    COPY_POLL_SECONDS = 5
+
     def __init__(self, configuration:Config, access_token:str):
         super().__init__("FileRequests", configuration.file_share_mount, configuration.log_identity)
         self.configuration:Config = configuration
         self.token:str = access_token
+        # Shared network limit for the container, None when unlimited
+        self.shaper:BandwidthShaper = BandwidthShaper.get_shaper(
+            configuration.log_identity or "seedosdu",
+            configuration.upload_bytes_per_second,
+            configuration.upload_control_share)
+        # Share behind the mount when files are copied server side
+        self.share:MountShare = None
+        if configuration.upload_mode == "copy":
+            self.share = MountShare(
+                configuration.share_account,
+                configuration.share_account_key,
+                configuration.share_name,
+                configuration.file_share_mount)
 
     def get_upload_url(self) -> FileUploadUrlResponse:
 
@@ -42,7 +72,8 @@ class FileRequests(LogBase):
         response:RetryRequestResponse = RequestsRetryCommand.make_request(
             requests.get,
             url,
-            headers=headers
+            headers=headers,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
@@ -68,16 +99,100 @@ class FileRequests(LogBase):
             logger.error(f"File {file_path} does not exist")
             raise Exception("File {} does not exist".format(file_path))
 
-        blob_client = BlobClient.from_blob_url(url.SignedURL)
-        with open(file_path, "rb") as las_file:
-            upload_response = blob_client.upload_blob(
-                las_file, blob_type="BlockBlob", overwrite=True)
-
-            logger.debug(f"Blob upload response {upload_response}")
-            upload_success = True
+        if self.share:
+            try:
+                seconds = self.copy_file(url, file_path)
+                logger.info("Copied {} : {} bytes from the share in {:.1f}s".format(
+                    os.path.split(file_path)[-1],
+                    os.path.getsize(file_path),
+                    seconds))
+                return True
+            except CopyFailedError as ex:
+                if ex.pending:
+                    # Uploading now would race the copy still running on the blob
+                    logger.error("Copy of {} could not be verified or aborted : {}".format(file_path, str(ex)))
+                    return False
+                logger.warn("Copy of {} failed, uploading from the mount : {}".format(file_path, str(ex)))
+            except Exception as ex:
+                logger.warn("Copy of {} not started, uploading from the mount : {}".format(file_path, str(ex)))
+
+        uploader = BlockUploader(
+            self.configuration.upload_block_size_min,
+            self.configuration.upload_block_size_max,
+            self.configuration.upload_max_concurrency,
+            self.configuration.upload_read_ahead,
+            self.configuration.upload_max_buffer,
+            self.shaper)
+
+        stats:UploadStats = uploader.upload(url.SignedURL, file_path, os.path.getsize(file_path))
+        logger.info("Uploaded {} : {} bytes in {} blocks of {}, {:.1f}s at {:.2f} MB/s".format(
+            os.path.split(file_path)[-1],
+            stats.file_size,
+            stats.blocks,
+            stats.block_size,
+            stats.seconds,
+            stats.get_mb_per_second()))
+        upload_success = True
 
         return upload_success
         
+    def copy_file(self, url:UploadUrl, file_path:str) -> float:
+        """
+        Have storage copy a mounted file from the share behind the mount, no file data 
+        passes through this container. 
+
+        The copy is always asynchronous, a synchronous copy only accepts a block blob 
+        as the source and not a file share. It is polled until it completes, reading 
+        the blob properties through the signed URL, and is aborted if it has not after 
+        copy_timeout seconds. 
+
+        Once the copy has started any failure (time out, copy failed, properties that
+        can not be read to verify it) aborts the copy and raises CopyFailedError, with
+        pending set if the abort did not go through. Failures before the copy started
+        raise as they are.
+
+        Parameters:
+        url: 
+            retrieved from getUploadUrl
+        file_path: 
+            File on the mount
+
+        Returns:
+            Seconds taken by the copy
+        """
+        start = time.time()
+        target_blob = BlobClient.from_blob_url(url.SignedURL)
+
+        copy = target_blob.start_copy_from_url(self.share.get_file_url(file_path))
+        status = copy.get("copy_status")
+
+        try:
+            while status == "pending":
+                if time.time() - start > self.configuration.upload_copy_timeout:
+                    raise Exception("Copy not complete after {} seconds".format(self.configuration.upload_copy_timeout))
+
+                time.sleep(FileRequests.COPY_POLL_SECONDS)
+                status = target_blob.get_blob_properties().copy.status
+        except Exception as ex:
+            raise CopyFailedError(str(ex), not self._abort_copy(target_blob, copy.get("copy_id")))
+
+        if status != "success":
+            # Failed or aborted copies are no longer writing to the blob
+            raise CopyFailedError("Copy ended {}".format(status))
+
+        return time.time() - start
+
+    def _abort_copy(self, target_blob:BlobClient, copy_id:str) -> bool:
+        """Abort a pending copy, False if it could not be aborted"""
+        logger:Logger = self.get_logger()
+
+        try:
+            target_blob.abort_copy(copy_id)
+            return True
+        except Exception as ex:
+            logger.warn("Abort of copy {} failed : {}".format(copy_id, str(ex)))
+            return False
+
     def upload_metadata(self, metadata:dict) -> FileUploadMetadataResponse:
 
         logger:Logger = self.get_logger()
@@ -89,7 +204,8 @@ class FileRequests(LogBase):
             requests.post,
             url,
             headers=headers,
-            json=metadata
+            json=metadata,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
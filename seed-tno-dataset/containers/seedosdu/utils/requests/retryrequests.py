@@ -2,6 +2,7 @@
 # Copyright (c) Microsoft Corporation.
 ##########################################################
 import time
+import json
 import requests
 
 class RetryRequestResponse:
@@ -62,6 +63,20 @@ class RequestsRetryCommand:
     def is_success(retry_response:RetryRequestResponse) -> bool:
         return retry_response.status_code in RequestsRetryCommand.ACCEPT_RANGE
 
+    @staticmethod
+    def get_request_size(url:str, kwargs:dict) -> int:
+        """
+        Rough size in bytes of a request, the URL, headers and body.
+        """
+        size = len(url)
+        for key, value in kwargs.get("headers", {}).items():
+            size += len(key) + len(str(value))
+        if kwargs.get("json") is not None:
+            size += len(json.dumps(kwargs["json"]))
+        if kwargs.get("data") is not None:
+            size += len(kwargs["data"])
+        return size
+
     @staticmethod
     def make_request(fn, url:str, **kwargs) -> RetryRequestResponse:
         """
@@ -84,7 +99,8 @@ class RequestsRetryCommand:
         
             fn: A function from requests, i.e. requests.get
             url: URL to hit with the call
-            kwargs: Additional requests data, i.e. {headers={}, json={}}
+            kwargs: Additional requests data, i.e. {headers={}, json={}}, and optionally 
+                shaper, a BandwidthShaper every attempt is charged to as a control call
 
         Returns:
         RetryRequestResponse in all cases except when:
@@ -101,6 +117,7 @@ class RequestsRetryCommand:
         elif not url:
             raise Exception("URL is a required parameter")
 
+        shaper = kwargs.pop("shaper", None)
         retry_response = RetryRequestResponse(url, kwargs)
         retry_response.action = fn.__name__
 
@@ -115,8 +132,13 @@ class RequestsRetryCommand:
             retry_response.attempts += 1
             retry_response.error = None
 
+            if shaper:
+                shaper.control(RequestsRetryCommand.get_request_size(url, kwargs))
+
             try:
                 response = fn(url, **kwargs)
+                if shaper:
+                    shaper.control(len(response.content))
                 retry_response.status_code = response.status_code
                 retry_response.status_codes.append(response.status_code)
 
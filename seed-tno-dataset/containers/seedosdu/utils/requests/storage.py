@@ -6,6 +6,7 @@ import typing
 from utils.logutil import LogBase, Logger
 from utils.configuration.config import Config
 from utils.requests.retryrequests import RequestsRetryCommand, RetryRequestResponse
+from utils.requests.shaper import BandwidthShaper
 
 
 class StorageFileVersionResponse:
@@ -19,6 +20,11 @@ class StorageRequests(LogBase):
         super().__init__("StorageRequests", configuration.file_share_mount, configuration.log_identity)
         self.configuration = configuration
         self.token = access_token
+        # Shared network limit for the container, None when unlimited
+        self.shaper:BandwidthShaper = BandwidthShaper.get_shaper(
+            configuration.log_identity or "seedosdu",
+            configuration.upload_bytes_per_second,
+            configuration.upload_control_share)
 
     def get_file_versions(self, file_identifier:str) -> StorageFileVersionResponse:
 
@@ -34,7 +40,8 @@ class StorageRequests(LogBase):
         response:RetryRequestResponse = RequestsRetryCommand.make_request(
             requests.get,
             url,
-            headers=headers
+            headers=headers,
+            shaper=self.shaper
         )
 
         if response.attempts > 1:
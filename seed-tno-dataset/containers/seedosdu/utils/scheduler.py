@@ -0,0 +1,67 @@
+##########################################################
+# Copyright (c) Microsoft Corporation.
+##########################################################
+import itertools
+import typing
+from utils.logutil import LogBase, Logger
+from utils.configuration.config import Config
+from utils.requests.auth import Credential
+from utils.fileshare.mount import FileClass
+from utils.uploader import FileUploader, FileUploadResult, UploadResults
+from utils.ledger import UploadLedger
+
+class UploadScheduler(LogBase):
+    """
+    Uploads the files of every FileClass in a single run of the uploader so no class
+    waits for the last slow file of another before it starts.
+
+    Files are handed to the uploader highest class priority first, classes with the
+    same priority are interleaved file by file. Results are split back out per class.
+    """
+    def __init__(self, classes:typing.List[FileClass], config:Config, credentials:Credential, ledger:UploadLedger = None):
+        super().__init__("Scheduler", config.file_share_mount, config.log_identity)
+        self.classes:typing.List[FileClass] = classes
+        self.config:Config = config
+        self.credentials:Credential = credentials
+        self.ledger:UploadLedger = ledger
+
+    def get_schedule(self) -> typing.List[str]:
+        """Every file of every class in the order they are uploaded"""
+        return_schedule:typing.List[str] = []
+
+        ordered = sorted(self.classes, key=lambda x: x.priority, reverse=True)
+        for _, same_priority in itertools.groupby(ordered, key=lambda x: x.priority):
+            for files in itertools.zip_longest(*[x.files for x in same_priority]):
+                return_schedule.extend([x for x in files if x is not None])
+
+        return return_schedule
+
+    def upload_files(self) -> typing.Dict[str, UploadResults]:
+        """
+        Upload the files of all classes.
+
+        Returns:
+            UploadResults of each class by FileClass identity
+        """
+        logger:Logger = self.get_logger()
+
+        schedule = self.get_schedule()
+        for file_class in sorted(self.classes, key=lambda x: x.priority, reverse=True):
+            logger.info("Schedule {} priority {} : {} files".format(file_class.parent_dir, file_class.priority, len(file_class.files)))
+
+        results:typing.List[FileUploadResult] = []
+        if len(schedule):
+            uploader = FileUploader(schedule, self.config, self.credentials, self.ledger)
+            results = uploader.upload_files().get_results()
+
+        # Split the results back out to the class each file came from
+        file_classes:typing.Dict[str, str] = {}
+        for file_class in self.classes:
+            for file_path in file_class.files:
+                file_classes[file_path] = file_class.identity
+
+        class_results:typing.Dict[str, typing.List[FileUploadResult]] = {x.identity : [] for x in self.classes}
+        for result in results:
+            class_results[file_classes[result.file_path]].append(result)
+
+        return {x : UploadResults(class_results[x]) for x in class_results}
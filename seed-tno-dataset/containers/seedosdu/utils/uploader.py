@@ -3,7 +3,6 @@
 ##########################################################
 import multiprocessing
 import typing
-import math
 import os
 import json
 from utils.logutil import LogBase, Logger
@@ -13,12 +12,17 @@ from utils.requests.file import FileRequests, FileUploadUrlResponse, FileUploadM
 from utils.requests.metagenerator import MetadataGenerator
 from utils.requests.storage import StorageRequests, StorageFileVersionResponse
 from utils.requests.retryrequests import RetryRequestResponse
-from joblib import Parallel, delayed
+from utils.lanes import ExecutionLane
+from utils.ledger import UploadLedger
+from joblib.externals.loky import ProcessPoolExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
 
 class FileUploadResult:
     def __init__(self):
         self.succeeded:bool = False
         self.file_name = None
+        self.file_path = None
+        self.attempts = 0
         self.file_id:str = None
         self.file_source:str = None
         self.file_version:str = None
@@ -59,15 +63,34 @@ class UploadResults:
                         self.status_codes[code] = 0
                     self.status_codes[code] += x.status_codes[code]
 
+    def get_results(self) -> typing.List[FileUploadResult]:
+        return self.success + self.failed
+
 class FileUploader(LogBase):
-    def __init__(self, file_list:typing.List[str], config:Config, credentials:Credential):
+    def __init__(self, file_list:typing.List[str], config:Config, credentials:Credential, ledger:UploadLedger = None):
         super().__init__("Uploader", config.file_share_mount, config.log_identity)
         self.file_list:typing.List[str] = file_list
         self.config:Config = config
         self.credentials:Credential = credentials
+        # Files already uploaded, shared across runs of the uploader when given
+        self.ledger:UploadLedger = ledger if ledger is not None else UploadLedger()
 
-    def upload_files(self) -> UploadResults: 
+    def __getstate__(self):
+        # Workers only upload single files, the list and ledger stay in this process
+        state = self.__dict__.copy()
+        state["file_list"] = []
+        state["ledger"] = None
+        return state
 
+    def upload_files(self) -> UploadResults: 
+        """
+        Upload every file in the list, each file is a task of it's own so a failure or 
+        time out only ever affects that one file.
+
+        A file that fails is retried up to max_attempts times. If it failed after it was
+        registered in OSDU (it has a file id) only the version check is retried, the 
+        file is not uploaded again. Files in the ledger are not uploaded at all.
+        """
         n_cores = multiprocessing.cpu_count()
         n_jobs = self.config.batch_multiplier * n_cores
 
@@ -83,40 +106,12 @@ class FileUploader(LogBase):
         file_requests = FileRequests(self.config, self.credentials.get_application_token())
         storage_requests = StorageRequests(self.config, self.credentials.get_application_token())
 
-        # Collection of the results
-        batch_results:typing.List[FileUploadResult] = []
-
-        # Tracking information
-        current_batch = 0
-        max_batch = math.ceil(len(self.file_list)/n_jobs)
-
-        # Process batches
-        for file_batch in self._batch(self.file_list, n_jobs):
-            current_batch += 1
-            batch_message = f"Uploading batch - {current_batch} of {max_batch}" 
-            print(batch_message)
-            logger.info(batch_message)
-
-            # Doc: https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html
-            # Adding in prefer="threads" is throwing a LOT of 400 errors and likely more failures
-            # however, without it I'm getting a lot of strange hangs in the processing of multiple
-            # containers. 
-            # Original now with 5 minute timeout per task
-            try:
-                batch_results += Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._upload_single_file)(file, file_requests, storage_requests) for file in file_batch)
-            except TimeoutError as ex:
-                logger.info("Batch timeout, retry it once.")
-                logger.info(str(ex))
-                batch_results += Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._upload_single_file)(file, file_requests, storage_requests) for file in file_batch)
-            except Exception as ex:
-                logger.info("Generic Exception")
-                logger.info(str(ex))
-                batch_results += Parallel(n_jobs=n_jobs, timeout=600.0)(delayed(self._upload_single_file)(file, file_requests, storage_requests) for file in file_batch)
-            
-            # Threading
-            #batch_results += Parallel(n_jobs=n_jobs, prefer="threads")(delayed(self._upload_single_file)(file, file_requests, storage_requests) for file in file_batch)
-            # Old multiprocessing : backend
-            #batch_results += Parallel(n_jobs=n_jobs, backend="multiprocessing")(delayed(self._upload_single_file)(file, file_requests, storage_requests) for file in file_batch)
+        # Size class lanes run side by side, otherwise one pool takes every file
+        lanes:typing.List[ExecutionLane] = [ExecutionLane("all", 0, n_jobs)]
+        if self.config.upload_lanes:
+            lanes = ExecutionLane.parse(self.config.upload_lanes)
+
+        batch_results = self._upload_lanes(lanes, file_requests, storage_requests)
 
         # Report on results
         return_results:UploadResults = UploadResults(batch_results)
@@ -145,12 +140,137 @@ class FileUploader(LogBase):
         return return_results
 
 
+    def _upload_lanes(
+        self, 
+        lanes:typing.List[ExecutionLane], 
+        file_requests:FileRequests, 
+        storage_requests:StorageRequests
+        ) -> typing.List[FileUploadResult]:
+        """
+        Upload the files in size class lanes, each lane is it's own process pool so the 
+        small files are not held up behind a large one.
+
+        Every completed result is kept as it arrives. If nothing completes for 
+        task_timeout seconds the files still in flight are failed without a retry, 
+        they may yet finish and a second upload would duplicate them.
+        """
+        logger:Logger = self.get_logger()
+
+        return_results:typing.Dict[str, FileUploadResult] = {}
+        attempts:typing.Dict[str, int] = {}
+        file_lanes:typing.Dict[str, int] = {}
+
+        lane_counts = [0] * len(lanes)
+        for file_name in self.file_list:
+            if file_name in file_lanes or file_name in return_results:
+                continue
+
+            entry = self.ledger.get(file_name)
+            if entry:
+                logger.info(f"Skipping {file_name}, uploaded as {entry['file_id']}")
+                return_results[file_name] = self._get_ledger_result(file_name, entry)
+                continue
+
+            size = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+            file_lanes[file_name] = lanes.index(ExecutionLane.get_lane(lanes, size))
+            lane_counts[file_lanes[file_name]] += 1
+
+        for idx in range(len(lanes)):
+            logger.info(f"Lane {lanes[idx].name}: {lane_counts[idx]} files, {lanes[idx].max_workers} workers")
+
+        executors = [ProcessPoolExecutor(max_workers=x.max_workers) for x in lanes]
+        futures = {}
+        stuck = False
+
+        def submit(file_name:str, previous:FileUploadResult = None) -> None:
+            attempts[file_name] = attempts.get(file_name, 0) + 1
+            executor = executors[file_lanes[file_name]]
+            if previous and previous.file_id:
+                future = executor.submit(self._verify_single_file, previous, storage_requests)
+            else:
+                future = executor.submit(self._upload_single_file, file_name, file_requests, storage_requests)
+            futures[future] = file_name
+
+        try:
+            for file_name in file_lanes:
+                submit(file_name)
+
+            while len(futures):
+                done, _ = wait(list(futures.keys()), timeout=self.config.upload_task_timeout, return_when=FIRST_COMPLETED)
+                if not len(done):
+                    stuck = True
+                    for future in futures:
+                        logger.warn("No progress in {} seconds, failing {}".format(self.config.upload_task_timeout, futures[future]))
+                        return_results[futures[future]] = self._get_failed_result(futures[future])
+                    break
+
+                for future in done:
+                    file_name = futures.pop(future)
+                    try:
+                        result:FileUploadResult = future.result()
+                    except Exception as ex:
+                        logger.info("Generic Exception - {} attempt {}".format(file_name, attempts[file_name]))
+                        logger.info(str(ex))
+                        result = self._get_failed_result(file_name)
+
+                    result.attempts = attempts[file_name]
+                    if result.succeeded:
+                        self.ledger.record(file_name, result.file_id, result.file_version, result.file_source)
+                    elif attempts[file_name] < self.config.upload_max_attempts:
+                        logger.info("Retry {} attempt {}".format(file_name, attempts[file_name] + 1))
+                        submit(file_name, result)
+                        continue
+
+                    return_results[file_name] = result
+                    if len(return_results) % 100 == 0:
+                        print(f"Uploaded {len(return_results)} of {len(self.file_list)}")
+        finally:
+            for executor in executors:
+                # Workers stuck on a file are not waited on
+                executor.shutdown(wait=not stuck, kill_workers=stuck)
+
+        return list(return_results.values())
+
+    def _get_failed_result(self, file_name:str) -> FileUploadResult:
+        failed_result = FileUploadResult()
+        failed_result.file_name = os.path.split(file_name)[-1]
+        failed_result.file_path = file_name
+        return failed_result
+
+    def _get_ledger_result(self, file_name:str, entry:dict) -> FileUploadResult:
+        ledger_result = self._get_failed_result(file_name)
+        ledger_result.file_id = entry["file_id"]
+        ledger_result.file_version = entry["file_version"]
+        ledger_result.file_source = entry["file_source"]
+        ledger_result.succeeded = True
+        return ledger_result
+
+    def _verify_single_file(self, previous:FileUploadResult, storage_requests:StorageRequests) -> FileUploadResult:
+        """
+        Retry of a file that was uploaded and registered but not verified, only the 
+        version check is repeated.
+        """
+        logger:Logger = self.get_logger()
+
+        return_result = previous
+        versions_response:StorageFileVersionResponse = storage_requests.get_file_versions(return_result.file_id)
+        return_result.updateStatus(versions_response.response)
+
+        if versions_response.versions:
+            return_result.file_version = versions_response.versions[0]
+            return_result.succeeded = True
+        else:
+            logger.error(f"Failed to get file versions for {return_result.file_path}")
+
+        return return_result
+
     def _upload_single_file(self, file_name:str, file_requests:FileRequests, storage_requests:StorageRequests) -> FileUploadResult:
 
         logger:Logger = self.get_logger()
 
         return_result = FileUploadResult()
         return_result.file_name = os.path.split(file_name)[-1]
+        return_result.file_path = file_name
 
         upload_response:FileUploadUrlResponse = file_requests.get_upload_url()
         return_result.updateStatus(upload_response.response)
@@ -185,9 +305,3 @@ class FileUploader(LogBase):
             logger.error("Failed to acquire upload url")
 
         return return_result
-
-    def _batch(self, items:list, batch_size:int) -> typing.List[str]:
-        idx = 0
-        while idx < len(items):
-            yield items[idx: idx + batch_size]
-            idx += batch_size